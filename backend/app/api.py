@@ -1,23 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from . import models, scheduler, database
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect, Request, Response
+from sqlalchemy import select, func, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, scheduler, database, log_hub, http_clients, status_events, script_query, backup_jobs, backup_store, \
+    backup_catalog, webdav_uploader, spawner, log_store, log_writer, log_tail, warm_runner
+from .settings_cache import settings
+from .notifier import notifier
+from .status_buffer import status_buffer
+from .script_versions import script_versions
 import os
 import shutil
+import uuid
 import asyncio
 import logging
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class ScriptCreate(BaseModel):
     name: str
@@ -27,32 +31,251 @@ class ScriptCreate(BaseModel):
     run_on_startup: bool = False
     description: Optional[str] = None
     arguments: Optional[str] = None
+    overlap_policy: Optional[str] = 'skip'  # 'skip' / 'queue' / 'parallel'
+    max_instances: Optional[int] = 1  # parallel 策略下允许的最大并行实例数
+    warm_start: Optional[bool] = False  # Python 脚本从预热 forkserver 启动
+    # 资源限制，为空表示不限制
+    timeout_seconds: Optional[int] = None  # 最大墙钟运行时间 (秒)
+    cpu_limit_seconds: Optional[int] = None  # CPU 时间上限 (秒)
+    memory_limit_mb: Optional[int] = None  # 进程组常驻内存上限 (MB)
+    max_open_files: Optional[int] = None  # 最大打开文件数
+    nice_level: Optional[int] = None  # CPU 调度优先级 (-20 ~ 19)
+    ionice_level: Optional[int] = None  # I/O 优先级 (0 ~ 7)
 
 class ScriptResponse(ScriptCreate):
     id: int
     last_status: Optional[str] = None
     last_run: Optional[datetime] = None
     last_output: Optional[str] = None
+    last_duration: Optional[float] = None
+    last_cpu_time: Optional[float] = None
+    last_max_rss_kb: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class ScriptSummary(BaseModel):
+    """脚本列表轮询用的精简字段，不含 last_output 等大字段"""
+    id: int
+    name: str
+    path: str
+    cron: Optional[str] = None
+    enabled: bool = True
+    run_on_startup: bool = False
+    description: Optional[str] = None
+    arguments: Optional[str] = None
+    last_status: Optional[str] = None
+    last_run: Optional[datetime] = None
+    last_duration: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+class ScriptSummaryList(BaseModel):
+    version: int  # 下次增量查询时作为 since 传回
+    full: bool  # True: scripts 为完整列表；False: 只包含 since 之后变化的脚本
+    scripts: List[ScriptSummary]
+    deleted: List[int] = []  # since 之后删除的脚本 ID
+    next_cursor: Optional[str] = None  # 分页查询时下一页的游标，没有更多时为空
+    total: Optional[int] = None  # 分页查询时符合筛选条件的脚本总数
+    status_counts: Optional[Dict[str, int]] = None  # 分页查询时符合筛选条件的脚本按状态的计数 (idle 为从未运行)
+
+class ScriptRunResponse(BaseModel):
+    id: int
+    script_id: int
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    status: Optional[str] = None
+    exit_code: Optional[int] = None
+    duration: Optional[float] = None
+    cpu_user: Optional[float] = None
+    cpu_system: Optional[float] = None
+    max_rss_kb: Optional[int] = None
+    io_read_blocks: Optional[int] = None
+    io_write_blocks: Optional[int] = None
+    ctx_voluntary: Optional[int] = None
+    ctx_involuntary: Optional[int] = None
+    limit_reason: Optional[str] = None
+    source: Optional[str] = None
+    log_offset: Optional[int] = None
+    log_end: Optional[int] = None
 
     class Config:
         from_attributes = True
 
+class ScriptRunPage(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    items: List[ScriptRunResponse]
+
+def script_response(script: models.Script) -> dict:
+    """脚本信息，叠加 status_buffer 中尚未写入数据库的状态"""
+    return status_buffer.overlay(script.id, ScriptResponse.model_validate(script).model_dump())
+
+def not_modified(request: Request, response: Response) -> Optional[Response]:
+    """脚本列表未变化 (If-None-Match 与当前版本一致) 时返回 304，否则在响应上设置 ETag"""
+    etag = script_versions.etag()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return None
+
+def script_list_query(status: Optional[str] = None, enabled: Optional[bool] = None, cron_type: Optional[str] = None,
+                      file_type: Optional[str] = None, q: Optional[str] = None, sort: str = "id", order: str = "asc",
+                      running_first: bool = False) -> script_query.ScriptQuery:
+    """脚本列表的筛选 / 排序参数：
+    status 逗号分隔的状态 (idle 为从未运行)，enabled，cron_type (scheduled / daemon / manual)，file_type (py / sh)，
+    q 名称搜索，sort (id / name / last_run / status)，order (asc / desc)，running_first 运行中的排在最前"""
+    query = script_query.ScriptQuery(status=status, enabled=enabled, cron_type=cron_type, file_type=file_type, q=q,
+                                     sort=sort, order=order, running_first=running_first)
+    try:
+        query.validate()
+    except script_query.InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return query
+
+async def fetch_script_page(db: AsyncSession, query: script_query.ScriptQuery, limit: Optional[int],
+                            cursor: Optional[str], columns=None):
+    try:
+        return await script_query.fetch_page(db, query, limit, cursor, columns)
+    except script_query.InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/scripts", response_model=List[ScriptResponse])
-async def get_scripts(db: Session = Depends(get_db)):
-    return db.query(models.Script).all()
+async def get_scripts(request: Request, response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                      query: script_query.ScriptQuery = Depends(script_list_query), db: AsyncSession = Depends(get_db)):
+    """脚本列表 (完整字段)，支持筛选 / 排序；传入 limit 时分页，下一页游标在响应头 X-Next-Cursor 中"""
+    if cached := not_modified(request, response):
+        return cached
+    scripts, next_cursor = await fetch_script_page(db, query, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [script_response(s) for s in scripts]
+
+SUMMARY_COLUMNS = [getattr(models.Script, field) for field in ScriptSummary.model_fields]
+
+@router.get("/scripts/summary", response_model=ScriptSummaryList)
+async def get_scripts_summary(request: Request, response: Response, since: Optional[int] = None,
+                              limit: Optional[int] = None, cursor: Optional[str] = None,
+                              query: script_query.ScriptQuery = Depends(script_list_query),
+                              db: AsyncSession = Depends(get_db)):
+    """高频轮询用的精简脚本列表：只查询 ScriptSummary 需要的列，支持 ETag / 304 和与 /scripts 相同的筛选 / 排序；
+    传入上次返回的 version 作为 since 时只返回之后变化且符合筛选条件的脚本 (since 过期时返回全量，full=true)，
+    已删除和变化后不再符合筛选条件的脚本在 deleted 中返回；
+    全量查询时可用 limit / cursor 分页；传入 limit 时 (包括增量查询) 同时返回符合筛选条件的 total 和按状态的计数
+    status_counts (取自数据库，比 status_buffer 中尚未写入的状态最多晚 STATUS_FLUSH_MS)"""
+    # 先取版本号再查询，查询期间发生的变化在下次增量中再返回一次，不会遗漏
+    version = script_versions.version
+    if cached := not_modified(request, response):
+        return cached
+
+    changes = script_versions.changes_since(since) if since is not None else None
+    next_cursor, total, counts = None, None, None
+    if changes is None:
+        scripts, next_cursor = await fetch_script_page(db, query, limit, cursor, SUMMARY_COLUMNS)
+        deleted = []
+    else:
+        changed, deleted = changes
+        scripts = (await db.scalars(
+            script_query.build(query, columns=SUMMARY_COLUMNS).where(models.Script.id.in_(changed))
+        )).all() if changed else []
+        # 变化后不再符合筛选条件的脚本要从客户端的列表中移除，与已删除的脚本一样处理
+        deleted = deleted + sorted(changed - {s.id for s in scripts})
+    if limit is not None:
+        counts = await script_query.status_counts(db, query)
+        total = sum(counts.values())
+    return {
+        "version": version,
+        "full": changes is None,
+        "scripts": [status_buffer.overlay(s.id, ScriptSummary.model_validate(s).model_dump()) for s in scripts],
+        "deleted": deleted,
+        "next_cursor": next_cursor,
+        "total": total,
+        "status_counts": counts,
+    }
+
+@router.websocket("/scripts/events")
+async def websocket_status_events(websocket: WebSocket, last_event_id: Optional[int] = None):
+    """脚本状态事件推送，所有消息均为 JSON，事件 id 单调递增 (与 /scripts/summary 的 version 一致)：
+
+    服务端 → 客户端
+      {"type": "hello", "id", "resumed"}  连接建立；resumed 为 false 时客户端需通过 /scripts/summary 重新同步
+      {"type": "status", "id", "script_id", "last_status", "last_run", "last_duration"}  状态变化
+      {"type": "changed" / "deleted", "id", "script_id"}  脚本新增、修改 / 删除
+      {"type": "reset", "id"}  批量变化 (如从备份恢复)，需要重新拉取完整列表
+    重连时用 ?last_event_id= 传入最后收到的事件 ID，缓冲中还有的事件会在 hello 之后补发
+    """
+    await websocket.accept()
+    # 先订阅再取补发的事件，两者之间没有 await，不会遗漏或重复
+    sub = status_events.hub.subscribe()
+    missed = None
+    if last_event_id is not None and last_event_id <= script_versions.version:
+        missed = status_events.hub.events_after(last_event_id)
+
+    async def pump():
+        await websocket.send_json({"type": "hello", "id": script_versions.version, "resumed": missed is not None})
+        for event in missed or []:
+            await websocket.send_json(event)
+        while True:
+            for event in await sub.get():
+                await websocket.send_json(event)
+
+    async def wait_disconnect():
+        # 客户端不发送消息，receive 用于及时发现断开
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(wait_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    except status_events.SlowConsumer:
+        logger.warning("Status event client is too slow, disconnected")
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+    except Exception as e:
+        logger.error(f"Status event stream error: {e}")
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        sub.close()
+
+def validate_overlap_policy(script: ScriptCreate):
+    if script.overlap_policy is not None and script.overlap_policy not in scheduler.OVERLAP_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Invalid overlap_policy: {script.overlap_policy}")
+    if script.max_instances is not None and script.max_instances < 1:
+        raise HTTPException(status_code=400, detail="max_instances must be >= 1")
+    for field in ("timeout_seconds", "cpu_limit_seconds", "memory_limit_mb", "max_open_files"):
+        value = getattr(script, field)
+        if value is not None and value < 1:
+            raise HTTPException(status_code=400, detail=f"{field} must be >= 1")
+    if script.nice_level is not None and not -20 <= script.nice_level <= 19:
+        raise HTTPException(status_code=400, detail="nice_level must be between -20 and 19")
+    if script.ionice_level is not None and not 0 <= script.ionice_level <= 7:
+        raise HTTPException(status_code=400, detail="ionice_level must be between 0 and 7")
 
 @router.post("/scripts", response_model=ScriptResponse)
-async def create_script(script: ScriptCreate, db: Session = Depends(get_db)):
+async def create_script(script: ScriptCreate, db: AsyncSession = Depends(get_db)):
+    validate_overlap_policy(script)
     db_script = models.Script(**script.dict())
     db.add(db_script)
-    db.commit()
-    db.refresh(db_script)
+    await db.commit()
+    await db.refresh(db_script)
+    script_versions.touch(db_script.id)
     
     # 获取 TG 配置
-    bot_token = db.query(models.Setting).filter(models.Setting.key == "tg_bot_token").first()
-    chat_id = db.query(models.Setting).filter(models.Setting.key == "tg_chat_id").first()
-    token_val = bot_token.value if bot_token else None
-    chat_val = chat_id.value if chat_id else None
+    token_val, chat_val = settings.telegram()
     
     # 如果启用了 cron，更新调度器
     if db_script.enabled and db_script.cron:
@@ -63,14 +286,16 @@ async def create_script(script: ScriptCreate, db: Session = Depends(get_db)):
             db_script.name,
             token_val,
             chat_val,
-            db_script.arguments
+            db_script.arguments,
+            overlap_policy=db_script.overlap_policy,
+            max_instances=db_script.max_instances
         )
     
-    return db_script
+    return script_response(db_script)
 
 @router.delete("/scripts/{script_id}")
-async def delete_script(script_id: int, db: Session = Depends(get_db)):
-    db_script = db.query(models.Script).filter(models.Script.id == script_id).first()
+async def delete_script(script_id: int, db: AsyncSession = Depends(get_db)):
+    db_script = await db.get(models.Script, script_id)
     if not db_script:
         raise HTTPException(status_code=404, detail="Script not found")
 
@@ -86,7 +311,8 @@ async def delete_script(script_id: int, db: Session = Depends(get_db)):
             logger.error(f"Failed to delete script file {db_script.path}: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to delete script file: {str(e)}")
 
-    # 删除对应的日志文件（使用脚本文件名作为日志名）
+    # 删除日志分段，以及升级前遗留的单文件日志
+    await asyncio.to_thread(log_store.remove_script_logs, script_id)
     log_file = scheduler.get_log_path(db_script.path)
     if os.path.exists(log_file):
         try:
@@ -95,28 +321,30 @@ async def delete_script(script_id: int, db: Session = Depends(get_db)):
         except Exception as e:
             logger.error(f"Failed to delete log file {log_file}: {e}")
 
-    db.delete(db_script)
-    db.commit()
+    # 运行历史随脚本一起删除
+    await db.execute(delete(models.ScriptRun).where(models.ScriptRun.script_id == script_id))
+    await db.delete(db_script)
+    await db.commit()
+    script_versions.remove(script_id)
     return {"message": "Script deleted"}
 
 @router.put("/scripts/{script_id}", response_model=ScriptResponse)
-async def update_script(script_id: int, script_update: ScriptCreate, db: Session = Depends(get_db)):
-    db_script = db.query(models.Script).filter(models.Script.id == script_id).first()
+async def update_script(script_id: int, script_update: ScriptCreate, db: AsyncSession = Depends(get_db)):
+    validate_overlap_policy(script_update)
+    db_script = await db.get(models.Script, script_id)
     if not db_script:
         raise HTTPException(status_code=404, detail="Script not found")
     
-    # 更新字段
-    for key, value in script_update.dict().items():
+    # 更新字段（只更新请求中携带的字段，避免旧版前端覆盖未展示的配置）
+    for key, value in script_update.dict(exclude_unset=True).items():
         setattr(db_script, key, value)
     
-    db.commit()
-    db.refresh(db_script)
+    await db.commit()
+    await db.refresh(db_script)
+    script_versions.touch(script_id)
 
     # 获取 TG 配置
-    bot_token = db.query(models.Setting).filter(models.Setting.key == "tg_bot_token").first()
-    chat_id = db.query(models.Setting).filter(models.Setting.key == "tg_chat_id").first()
-    token_val = bot_token.value if bot_token else None
-    chat_val = chat_id.value if chat_id else None
+    token_val, chat_val = settings.telegram()
 
     # 更新调度器
     # 先尝试移除旧任务
@@ -130,10 +358,12 @@ async def update_script(script_id: int, script_update: ScriptCreate, db: Session
             db_script.name,
             token_val,
             chat_val,
-            db_script.arguments
+            db_script.arguments,
+            overlap_policy=db_script.overlap_policy,
+            max_instances=db_script.max_instances
         )
         
-    return db_script
+    return script_response(db_script)
 
 @router.post("/upload")
 async def upload_script(file: UploadFile = File(...)):
@@ -146,42 +376,37 @@ async def upload_script(file: UploadFile = File(...)):
     return {"filename": file.filename, "path": file_path}
 
 @router.post("/scripts/{script_id}/run", response_model=ScriptResponse)
-async def run_script_manually(script_id: int, db: Session = Depends(get_db)):
+async def run_script_manually(script_id: int, db: AsyncSession = Depends(get_db)):
     logger.info(f"API Call: run_script_manually(id={script_id})")
-    script = db.query(models.Script).filter(models.Script.id == script_id).first()
+    script = await db.get(models.Script, script_id)
     if not script:
         logger.error(f"Script {script_id} not found")
         raise HTTPException(status_code=404, detail="Script not found")
 
     # 获取 TG 配置
-    bot_token = db.query(models.Setting).filter(models.Setting.key == "tg_bot_token").first()
-    chat_id = db.query(models.Setting).filter(models.Setting.key == "tg_chat_id").first()
-    token_val = bot_token.value if bot_token else None
-    chat_val = chat_id.value if chat_id else None
+    token_val, chat_val = settings.telegram()
 
     is_daemon = (script.cron == "@daemon")
 
-    # 异步运行脚本
-    import asyncio
-    asyncio.create_task(scheduler.run_script(
+    # 提交到执行引擎（手动触发优先于定时任务），脚本状态 ('running' / 'queued') 由执行引擎更新
+    scheduler.engine.submit(
         script.id,
         script.path,
         script.name,
         token_val,
         chat_val,
         script.arguments,
-        is_daemon=is_daemon
-    ))
+        is_daemon=is_daemon,
+        priority=scheduler.PRIORITY_MANUAL,
+        source="manual",
+        overlap_policy=script.overlap_policy,
+        max_instances=script.max_instances
+    )
 
-    # 立即更新脚本状态为 'running'
-    script.last_status = 'running'
-    db.commit()
-    db.refresh(script)
-
-    return script
+    return script_response(script)
 
 @router.post("/scripts/{script_id}/stop", response_model=ScriptResponse)
-async def stop_script_manually(script_id: int, db: Session = Depends(get_db)):
+async def stop_script_manually(script_id: int, db: AsyncSession = Depends(get_db)):
     logger.info(f"API Call: stop_script_manually(id={script_id})")
 
     # 尝试停止进程
@@ -189,67 +414,212 @@ async def stop_script_manually(script_id: int, db: Session = Depends(get_db)):
     logger.info(f"stop_script returned: {success}")
 
     # 无论成功与否，都更新数据库状态
-    script = db.query(models.Script).filter(models.Script.id == script_id).first()
+    script = await db.get(models.Script, script_id)
     if script:
-        script.last_status = 'stopped'
-        db.commit()
-        db.refresh(script)
-        logger.info(f"Updated script {script_id} status to 'stopped' in database")
-        return script
+        status_buffer.update_script(script_id, last_status='stopped')
+        logger.info(f"Updated script {script_id} status to 'stopped'")
+        return script_response(script)
     else:
         raise HTTPException(status_code=404, detail="Script not found")
 
+MAX_RUNS_PAGE_SIZE = 500
+
+async def paginate_runs(db: AsyncSession, script_id: Optional[int], status: Optional[str], source: Optional[str],
+                        limit: int, offset: int) -> dict:
+    """运行历史分页查询，按开始时间倒序"""
+    conditions = []
+    if script_id is not None:
+        conditions.append(models.ScriptRun.script_id == script_id)
+    if status:
+        conditions.append(models.ScriptRun.status == status)
+    if source:
+        conditions.append(models.ScriptRun.source == source)
+    limit = max(1, min(limit, MAX_RUNS_PAGE_SIZE))
+    offset = max(0, offset)
+    items = (await db.scalars(
+        select(models.ScriptRun).where(*conditions)
+        .order_by(models.ScriptRun.started_at.desc(), models.ScriptRun.id.desc()).offset(offset).limit(limit)
+    )).all()
+    total = await db.scalar(select(func.count()).select_from(models.ScriptRun).where(*conditions))
+    return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+@router.get("/scripts/{script_id}/runs", response_model=ScriptRunPage)
+async def get_script_runs(script_id: int, limit: int = 20, offset: int = 0, status: Optional[str] = None,
+                          source: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """脚本运行历史（含资源占用）；status / source 可筛选，如 status=limit_exceeded、source=cron"""
+    return await paginate_runs(db, script_id, status, source, limit, offset)
+
+@router.get("/scripts/{script_id}/tail")
+async def get_script_tail(script_id: int, lines: int = 100, db: AsyncSession = Depends(get_db)):
+    """脚本最近的输出 (跨运行)，运行中或刚结束的脚本直接从内存读取"""
+    if not await db.scalar(select(models.Script.id).where(models.Script.id == script_id)):
+        raise HTTPException(status_code=404, detail="Script not found")
+    data = await log_store.read_tail_lines(script_id, max(1, min(lines, 5000)))
+    return {"script_id": script_id, "lines": lines, "content": data.decode("utf-8", errors="replace")}
+
+@router.get("/runs/usage")
+async def get_resource_usage(hours: int = 24, limit: int = 20, db: AsyncSession = Depends(get_db)):
+    """按脚本汇总最近一段时间的资源占用，CPU 时间多的排在前面"""
+    from datetime import timedelta
+
+    since = datetime.now() - timedelta(hours=hours)
+    cpu_total = func.sum(func.coalesce(models.ScriptRun.cpu_user, 0) + func.coalesce(models.ScriptRun.cpu_system, 0))
+    rows = (await db.execute(select(
+        models.ScriptRun.script_id,
+        func.count(models.ScriptRun.id),
+        cpu_total,
+        func.max(models.ScriptRun.max_rss_kb),
+        func.sum(models.ScriptRun.duration),
+        func.sum(func.coalesce(models.ScriptRun.io_read_blocks, 0) + func.coalesce(models.ScriptRun.io_write_blocks, 0)),
+    ).where(
+        models.ScriptRun.started_at >= since
+    ).group_by(models.ScriptRun.script_id).order_by(cpu_total.desc()).limit(limit))).all()
+
+    names = {s.id: s.name for s in (await db.execute(select(models.Script.id, models.Script.name))).all()}
+    return [
+        {
+            "script_id": script_id,
+            "name": names.get(script_id),
+            "runs": runs,
+            "cpu_seconds": round(cpu or 0, 3),
+            "max_rss_kb": max_rss,
+            "wall_seconds": round(wall or 0, 3),
+            "io_blocks": io_blocks or 0,
+        }
+        for script_id, runs, cpu, max_rss, wall, io_blocks in rows
+    ]
+
+@router.get("/runs", response_model=ScriptRunPage)
+async def get_runs(script_id: Optional[int] = None, status: Optional[str] = None, source: Optional[str] = None,
+                   limit: int = 50, offset: int = 0, db: AsyncSession = Depends(get_db)):
+    """所有脚本的运行历史，可按脚本 / 状态 / 触发来源筛选"""
+    return await paginate_runs(db, script_id, status, source, limit, offset)
+
+@router.get("/runs/{run_id}", response_model=ScriptRunResponse)
+async def get_run(run_id: int, db: AsyncSession = Depends(get_db)):
+    run = await db.get(models.ScriptRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+@router.get("/runs/{run_id}/log")
+async def get_run_log(run_id: int, max_bytes: int = 1024 * 1024, db: AsyncSession = Depends(get_db)):
+    """读取某次运行的日志 (跨分段拼接，超过 max_bytes 时只返回末尾部分)"""
+    run = await db.get(models.ScriptRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not log_store.list_segments(run.script_id, run.id):
+        raise HTTPException(status_code=410, detail="Log of this run is no longer available")
+
+    data = await log_store.read_tail(run.script_id, max(1, max_bytes), run.id)
+    return {"run_id": run.id, "status": run.status, "log": data.decode("utf-8", errors="replace")}
+
+@router.get("/engine/stats")
+async def get_engine_stats():
+    """执行引擎状态：队列深度、等待时间、活跃槽位"""
+    stats = scheduler.engine.stats()
+    stats["warm_runner"] = warm_runner.runner.stats()
+    stats["memory_monitor"] = spawner.monitor.stats()
+    stats["log_writer"] = log_writer.writer.stats()
+    stats["log_hub"] = log_hub.hub.stats()
+    stats["log_tail"] = log_tail.cache.stats()
+    stats["settings_cache"] = settings.stats()
+    stats["http_clients"] = http_clients.stats()
+    stats["notifier"] = notifier.stats()
+    stats["status_buffer"] = status_buffer.stats()
+    stats["status_events"] = status_events.hub.stats()
+    stats["backup_jobs"] = backup_jobs.manager.stats()
+    stats["webdav_uploader"] = webdav_uploader.stats()
+    return stats
+
+# 实时日志：连接建立时先发送的历史日志 (可用 ?tail_bytes= / ?tail_lines= 覆盖)，以及新输出合并成帧的时间 / 大小
+LOG_STREAM_TAIL_BYTES = int(os.getenv("LOG_STREAM_TAIL_BYTES", str(256 * 1024)))
+LOG_STREAM_TAIL_LINES = int(os.getenv("LOG_STREAM_TAIL_LINES", "1000"))
+LOG_STREAM_FRAME_MS = int(os.getenv("LOG_STREAM_FRAME_MS", "50"))
+LOG_STREAM_FRAME_BYTES = 64 * 1024
+# 单次回看 / 初始历史的上限
+LOG_STREAM_MAX_CHUNK_BYTES = 1024 * 1024
+
 @router.websocket("/logs/{script_id}/stream")
-async def websocket_log_stream(websocket: WebSocket, script_id: int):
+async def websocket_log_stream(websocket: WebSocket, script_id: int, tail_bytes: Optional[int] = None,
+                               tail_lines: Optional[int] = None):
+    """实时日志，所有消息均为 JSON：
+
+    服务端 → 客户端
+      {"type": "history", "data", "run_id", "offset", "has_more"}  连接后的初始历史及回看位置
+      {"type": "log", "data"}                                     新输出
+      {"type": "older", "data", "run_id", "offset", "has_more"}   回看结果，内容位于之前已发送内容之前
+      {"type": "info" / "error", "data"}
+    客户端 → 服务端
+      {"type": "older", "run_id", "offset", "bytes"}  读取该位置之前的日志
+    """
     await websocket.accept()
 
-    # 从数据库获取脚本路径，用于生成日志文件路径
-    db = database.SessionLocal()
-    try:
-        script = db.query(models.Script).filter(models.Script.id == script_id).first()
-        if not script:
-            await websocket.send_text("Error: Script not found\n")
-            await websocket.close()
-            return
-        log_file_path = scheduler.get_log_path(script.path)
-    finally:
-        db.close()
+    async with database.AsyncSessionLocal() as db:
+        script = await db.get(models.Script, script_id)
+    if not script:
+        await websocket.send_json({"type": "error", "data": "Script not found"})
+        await websocket.close()
+        return
 
+    tail_bytes = min(max(0, tail_bytes if tail_bytes is not None else LOG_STREAM_TAIL_BYTES), LOG_STREAM_MAX_CHUNK_BYTES)
+    tail_lines = max(0, tail_lines if tail_lines is not None else LOG_STREAM_TAIL_LINES)
+    # 回看结果和实时输出由两个任务发送，串行化避免并发写 WebSocket
+    send_lock = asyncio.Lock()
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def pump():
+        # 类似 tail -f：先发送最近的日志，再由 log_hub 实时推送新增内容，脚本空闲时不消耗 CPU
+        async for message in log_store.follow(script_id, tail_bytes, tail_lines,
+                                                        LOG_STREAM_FRAME_MS / 1000, LOG_STREAM_FRAME_BYTES):
+            await send(message)
+
+    async def handle_requests():
+        # 处理客户端的回看请求；客户端断开时 receive 会抛出 WebSocketDisconnect，及时结束推送
+        while True:
+            request = await websocket.receive_json()
+            if request.get("type") != "older" or request.get("run_id") is None:
+                continue
+            size = min(max(1, int(request.get("bytes") or LOG_STREAM_TAIL_BYTES)), LOG_STREAM_MAX_CHUNK_BYTES)
+            data, run_id, offset, has_more = await asyncio.to_thread(
+                log_store.read_before, script_id, int(request["run_id"]), int(request.get("offset") or 0), size)
+            await send({"type": "older", "data": data.decode("utf-8", errors="replace"),
+                        "run_id": run_id, "offset": offset, "has_more": has_more})
+
+    tasks = []
     try:
-        # 等待文件创建 (如果刚启动)
-        retries = 0
-        while not os.path.exists(log_file_path):
-            await asyncio.sleep(0.5)
-            retries += 1
-            if retries > 10: # 5秒没文件，可能没启动成功
-                await websocket.send_text("Waiting for log file creation...\n")
-                
-        # 类似 tail -f
-        with open(log_file_path, "r") as f:
-            # 先读取现有内容
-            content = f.read()
-            if content:
-                await websocket.send_text(content)
-            
-            # 持续读取新增内容
-            while True:
-                line = f.read()
-                if line:
-                    await websocket.send_text(line)
-                else:
-                    await asyncio.sleep(0.5) # 避免 CPU 空转
+        if not log_store.list_segments(script_id):
+            await send({"type": "info", "data": "Waiting for log file creation...\n"})
+
+        tasks = [asyncio.create_task(pump()), asyncio.create_task(handle_requests())]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
     except WebSocketDisconnect:
         print(f"Client disconnected from log stream {script_id}")
+    except log_hub.SlowConsumer:
+        logger.warning(f"Log stream client of script {script_id} is too slow, disconnected")
+        try:
+            await websocket.send_json({"type": "error", "data": "Log output is faster than this connection, stream stopped. Reopen to continue."})
+            await websocket.close(code=1013)
+        except Exception:
+            pass
     except Exception as e:
         print(f"WebSocket error: {e}")
         try:
             await websocket.close()
         except:
             pass
+    finally:
+        for task in tasks:
+            task.cancel()
 
 @router.get("/scripts/{script_id}/content")
-async def get_script_content(script_id: int, db: Session = Depends(get_db)):
-    script = db.query(models.Script).filter(models.Script.id == script_id).first()
+async def get_script_content(script_id: int, db: AsyncSession = Depends(get_db)):
+    script = await db.get(models.Script, script_id)
     if not script or not os.path.exists(script.path):
         raise HTTPException(status_code=404, detail="Script file not found")
     with open(script.path, "r") as f:
@@ -257,8 +627,8 @@ async def get_script_content(script_id: int, db: Session = Depends(get_db)):
     return {"content": content}
 
 @router.put("/scripts/{script_id}/content")
-async def update_script_content(script_id: int, content: dict, db: Session = Depends(get_db)):
-    script = db.query(models.Script).filter(models.Script.id == script_id).first()
+async def update_script_content(script_id: int, content: dict, db: AsyncSession = Depends(get_db)):
+    script = await db.get(models.Script, script_id)
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
     with open(script.path, "w") as f:
@@ -268,56 +638,63 @@ async def update_script_content(script_id: int, content: dict, db: Session = Dep
 class TGConfig(BaseModel):
     token: str
     chat_id: str
+    proxy: Optional[str] = None
 
 class SettingItem(BaseModel):
     key: str
     value: str
 
 @router.get("/settings")
-async def get_all_settings(db: Session = Depends(get_db)):
-    settings = db.query(models.Setting).all()
-    return {s.key: s.value for s in settings}
+async def get_all_settings(db: AsyncSession = Depends(get_db)):
+    rows = (await db.scalars(select(models.Setting))).all()
+    return {s.key: s.value for s in rows}
 
 @router.post("/settings")
-async def save_setting(item: SettingItem, db: Session = Depends(get_db)):
+async def save_setting(item: SettingItem, db: AsyncSession = Depends(get_db)):
     logger.info(f"API Call: save_setting(key={item.key})")
-    setting = db.query(models.Setting).filter(models.Setting.key == item.key).first()
+    setting = await db.get(models.Setting, item.key)
     if setting:
         setting.value = item.value
     else:
         setting = models.Setting(key=item.key, value=item.value)
         db.add(setting)
     
-    db.commit()
+    await db.commit()
+    await settings.reload()
     return {"message": "Setting saved"}
 
 @router.post("/settings/apply")
 async def apply_settings():
     """统一应用配置并重启 Bot"""
     logger.info("API Call: apply_settings()")
-    from . import telegram_bot
+    from . import telegram_bot, warm_runner
+    scheduler.apply_engine_settings()
+    await warm_runner.apply_settings()
+    await scheduler.prune_run_history()
     await telegram_bot.start_bot()
     return {"message": "Settings applied and bot restarted"}
 
 @router.post("/test-tg")
 async def test_tg_connection(config: TGConfig):
     try:
-        await scheduler.notify_telegram("🎉 ScriptsManager: 连通性测试成功！", config.token, config.chat_id)
+        await scheduler.notify_telegram("🎉 ScriptsManager: 连通性测试成功！", config.token, config.chat_id,
+                                        config.proxy)
         return {"status": "success", "message": "Test message sent"}
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=str(e))
 
-def sync_scripts_from_disk(db: Session):
+async def sync_scripts_from_disk(db: AsyncSession):
     root = os.getenv("SCRIPT_ROOT", "/scripts")
     if not os.path.exists(root):
         return
 
     # 获取现有数据库中的所有路径
-    existing_paths = {s.path for s in db.query(models.Script).all()}
+    existing_paths = set((await db.scalars(select(models.Script.path))).all())
     
     # 遍历目录
+    new_scripts = []
     for filename in os.listdir(root):
         if filename.endswith(('.py', '.sh')):
             full_path = os.path.join(root, filename)
@@ -334,12 +711,16 @@ def sync_scripts_from_disk(db: Session):
                     run_on_startup=False
                 )
                 db.add(new_script)
-    db.commit()
+                new_scripts.append(new_script)
+    await db.commit()
+    for new_script in new_scripts:
+        script_versions.touch(new_script.id)
 
 @router.post("/scan")
-async def scan_scripts(db: Session = Depends(get_db)):
-    sync_scripts_from_disk(db)
-    return {"message": "Scan complete", "scripts": db.query(models.Script).all()}
+async def scan_scripts(db: AsyncSession = Depends(get_db)):
+    await sync_scripts_from_disk(db)
+    return {"message": "Scan complete",
+            "scripts": [script_response(s) for s in (await db.scalars(select(models.Script))).all()]}
 
 
 # ==================== 备份相关API ====================
@@ -350,150 +731,140 @@ from fastapi.responses import FileResponse
 class BackupRequest(BaseModel):
     script_ids: Optional[List[int]] = None  # None表示备份全部
     backup_type: Optional[str] = 'local' # 'local' or 'clouddrive'
+    incremental: Optional[bool] = False  # 增量备份：只存储变化的内容
 
 class BackupConfigRequest(BaseModel):
     # Local Backup Config
     local_backup_enabled: Optional[bool] = False
     local_backup_cron: Optional[str] = None
+    local_backup_incremental: Optional[bool] = False
     
     # CloudDrive2 Config
     cd2_backup_enabled: Optional[bool] = False
     cd2_backup_cron: Optional[str] = None
+    cd2_backup_incremental: Optional[bool] = False
     cd2_webdav_url: Optional[str] = None
     cd2_username: Optional[str] = None
     cd2_password: Optional[str] = None
     cd2_backup_path: Optional[str] = '/ScriptBackups'
+    cd2_keep_local: Optional[bool] = False  # 上传后仍在本地保留一份备份
+
+    # 保留策略 (本地和CloudDrive2共用)，0 表示不按该项保留，全为 0 时不清理
+    backup_keep_last: Optional[int] = 0
+    backup_keep_daily: Optional[int] = 0
+    backup_keep_weekly: Optional[int] = 0
+    backup_keep_monthly: Optional[int] = 0
 
 class TestCloudDriveRequest(BaseModel):
     webdav_url: str
     username: str
     password: str
 
-@router.post("/backup/manual")
-async def manual_backup(request: BackupRequest, db: Session = Depends(get_db)):
-    """手动备份脚本"""
+def submit_backup_job(**kwargs) -> dict:
+    """提交后台备份任务，立即返回任务信息；已有备份在运行时返回 409 (detail 中带正在运行的任务)"""
     try:
-        backup_type = request.backup_type or 'local'
-        
-        cd2_config = None
-        if backup_type == 'clouddrive':
-            # 读取CloudDrive2配置
-            cd2_url = db.query(models.Setting).filter(models.Setting.key == "cd2_webdav_url").first()
-            cd2_username = db.query(models.Setting).filter(models.Setting.key == "cd2_username").first()
-            cd2_password = db.query(models.Setting).filter(models.Setting.key == "cd2_password").first()
-            cd2_path = db.query(models.Setting).filter(models.Setting.key == "cd2_backup_path").first()
-
-            if not cd2_url or not cd2_username or not cd2_password:
-                raise HTTPException(status_code=400, detail="CloudDrive2配置不完整，请先在设置中配置")
-
-            cd2_config = {
-                'webdav_url': cd2_url.value,
-                'username': cd2_username.value,
-                'password': cd2_password.value,
-                'backup_path': cd2_path.value if cd2_path else '/ScriptBackups'
-            }
-
-        # 执行备份
-        result = backup_module.backup_and_upload(
-            script_ids=request.script_ids,
-            backup_type=backup_type,
-            cd2_config=cd2_config
-        )
+        return backup_jobs.manager.submit(**kwargs).to_dict()
+    except backup_jobs.BackupBusy as e:
+        raise HTTPException(status_code=409, detail={"message": "已有备份任务正在运行", "job": e.job.to_dict()})
 
-        if not result['success']:
-            raise HTTPException(status_code=500, detail=result['error'])
 
-        return {
-            "message": "备份成功",
-            "filename": result['filename'],
-            "local_path": result['local_path'],
-            "remote_path": result['remote_path']
-        }
+@router.post("/backup/manual")
+async def manual_backup(request: BackupRequest):
+    """手动备份脚本：提交后台任务，通过 /backup/jobs/{job_id} 查询进度"""
+    backup_type = request.backup_type or 'local'
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Manual backup failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    cd2_config = None
+    if backup_type == 'clouddrive':
+        # 读取CloudDrive2配置
+        cd2_config = settings.cd2_config()
+        if not cd2_config:
+            raise HTTPException(status_code=400, detail="CloudDrive2配置不完整，请先在设置中配置")
+
+    return submit_backup_job(kind=backup_type, trigger="manual", script_ids=request.script_ids,
+                             cd2_config=cd2_config, incremental=bool(request.incremental))
 
 
 @router.post("/backup/script/{script_id}")
-async def backup_single_script(script_id: int, db: Session = Depends(get_db)):
-    """备份单个脚本 (默认为本地备份)"""
+async def backup_single_script(script_id: int, db: AsyncSession = Depends(get_db)):
+    """备份单个脚本 (本地备份)：提交后台任务，通过 /backup/jobs/{job_id} 查询进度"""
     # 检查脚本是否存在
-    script = db.query(models.Script).filter(models.Script.id == script_id).first()
+    script = await db.get(models.Script, script_id)
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
 
-    try:
-        # 强制使用本地备份
-        backup_type = 'local'
-        cd2_config = None
-
-        # 执行备份（只备份单个脚本）
-        result = backup_module.backup_and_upload(
-            script_ids=[script_id],
-            backup_type=backup_type,
-            cd2_config=cd2_config
-        )
+    return submit_backup_job(kind="local", trigger="script", script_ids=[script_id])
 
-        if not result['success']:
-            raise HTTPException(status_code=500, detail=result['error'])
 
-        return {
-            "message": f"脚本 '{script.name}' 备份成功",
-            "filename": result['filename'],
-            "local_path": result['local_path'],
-            "remote_path": result['remote_path']
-        }
+@router.get("/backup/jobs")
+async def list_backup_jobs():
+    """最近的备份任务 (新的在前)"""
+    return [job.to_dict() for job in backup_jobs.manager.list()]
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Single script backup failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/backup/jobs/{job_id}")
+async def get_backup_job(job_id: str):
+    """备份任务的状态和进度"""
+    job = backup_jobs.manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Backup job not found")
+    return job.to_dict()
+
+
+@router.post("/backup/jobs/{job_id}/cancel")
+async def cancel_backup_job(job_id: str):
+    """取消备份任务，在下一个文件 / 上传分块之前生效"""
+    job = backup_jobs.manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Backup job not found")
+    return job.to_dict()
 
 
 @router.get("/backup/config")
-async def get_backup_config(db: Session = Depends(get_db)):
+async def get_backup_config():
     """获取备份配置"""
     config = {}
 
     keys = [
-        'local_backup_enabled', 'local_backup_cron',
-        'cd2_backup_enabled', 'cd2_backup_cron',
-        'cd2_webdav_url', 'cd2_username', 'cd2_password', 'cd2_backup_path'
+        'local_backup_enabled', 'local_backup_cron', 'local_backup_incremental',
+        'cd2_backup_enabled', 'cd2_backup_cron', 'cd2_backup_incremental',
+        'cd2_webdav_url', 'cd2_username', 'cd2_password', 'cd2_backup_path', 'cd2_keep_local',
+        'backup_keep_last', 'backup_keep_daily', 'backup_keep_weekly', 'backup_keep_monthly'
     ]
 
     for key in keys:
-        setting = db.query(models.Setting).filter(models.Setting.key == key).first()
-        config[key] = setting.value if setting else None
+        config[key] = settings.get(key)
 
     return config
 
 
 @router.post("/backup/config")
-async def save_backup_config(config: BackupConfigRequest, db: Session = Depends(get_db)):
+async def save_backup_config(config: BackupConfigRequest, db: AsyncSession = Depends(get_db)):
     """保存备份配置"""
     try:
-        def save_key(key, value):
-            setting = db.query(models.Setting).filter(models.Setting.key == key).first()
+        async def save_key(key, value):
+            setting = await db.get(models.Setting, key)
             if setting:
                 setting.value = str(value) if value is not None else ""
             else:
                 db.add(models.Setting(key=key, value=str(value) if value is not None else ""))
 
         # 保存所有配置
-        save_key('local_backup_enabled', str(config.local_backup_enabled).lower())
-        save_key('local_backup_cron', config.local_backup_cron)
-        save_key('cd2_backup_enabled', str(config.cd2_backup_enabled).lower())
-        save_key('cd2_backup_cron', config.cd2_backup_cron)
-        save_key('cd2_webdav_url', config.cd2_webdav_url)
-        save_key('cd2_username', config.cd2_username)
-        save_key('cd2_password', config.cd2_password)
-        save_key('cd2_backup_path', config.cd2_backup_path)
-
-        db.commit()
+        await save_key('local_backup_enabled', str(config.local_backup_enabled).lower())
+        await save_key('local_backup_cron', config.local_backup_cron)
+        await save_key('local_backup_incremental', str(config.local_backup_incremental).lower())
+        await save_key('cd2_backup_enabled', str(config.cd2_backup_enabled).lower())
+        await save_key('cd2_backup_cron', config.cd2_backup_cron)
+        await save_key('cd2_backup_incremental', str(config.cd2_backup_incremental).lower())
+        await save_key('cd2_webdav_url', config.cd2_webdav_url)
+        await save_key('cd2_username', config.cd2_username)
+        await save_key('cd2_password', config.cd2_password)
+        await save_key('cd2_backup_path', config.cd2_backup_path)
+        await save_key('cd2_keep_local', str(config.cd2_keep_local).lower())
+        for tier in ('last', 'daily', 'weekly', 'monthly'):
+            await save_key(f'backup_keep_{tier}', max(0, getattr(config, f'backup_keep_{tier}') or 0))
+
+        await db.commit()
+        await settings.reload()
         return {"message": "备份配置已保存"}
 
     except HTTPException:
@@ -526,11 +897,11 @@ async def test_clouddrive(request: TestCloudDriveRequest):
 
 
 @router.post("/backup/apply-schedule")
-async def apply_backup_schedule(db: Session = Depends(get_db)):
+async def apply_backup_schedule():
     """应用定时备份设置（无需重启）"""
     try:
         from .main import update_scheduled_backup
-        update_scheduled_backup(db)
+        update_scheduled_backup()
         return {"message": "定时备份设置已应用"}
     except Exception as e:
         logger.error(f"Apply backup schedule failed: {e}")
@@ -538,16 +909,33 @@ async def apply_backup_schedule(db: Session = Depends(get_db)):
 
 
 @router.get("/backup/history")
-async def get_backup_history():
-    """获取备份历史"""
+async def get_backup_history(limit: int = 20, offset: int = 0, include_remote: bool = False):
+    """获取备份历史 (备份目录的索引查询)；include_remote=true 时包含只在CloudDrive2上的备份"""
     try:
-        history = backup_module.get_backup_history(limit=20)
+        history = await asyncio.to_thread(backup_module.get_backup_history, limit, offset, include_remote)
         return {"backups": history}
     except Exception as e:
         logger.error(f"Get backup history failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/backup/retention/apply")
+async def apply_backup_retention():
+    """立即按保留策略清理所有系列的旧备份 (本地和CloudDrive2)"""
+    if backup_jobs.manager.current is not None:
+        raise HTTPException(status_code=409, detail="备份任务正在运行，请稍后再试")
+    policy = settings.backup_retention()
+    if not any(policy.values()):
+        raise HTTPException(status_code=400, detail="未配置保留策略")
+    try:
+        result = await asyncio.to_thread(backup_catalog.apply_retention, policy, backup_module.BACKUP_DIR,
+                                         settings.cd2_config())
+        return {"message": f"已清理 {result['removed']} 个旧备份", **result}
+    except Exception as e:
+        logger.error(f"Apply backup retention failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/backup/download/{filename}")
 async def download_backup(filename: str):
     """下载备份文件"""
@@ -590,6 +978,9 @@ async def delete_backup(filename: str):
         # 删除文件
         os.remove(filepath)
         logger.info(f"Deleted backup file: {filename}")
+        await asyncio.to_thread(backup_catalog.forget_local, [filename])
+        # 清理不再被任何增量快照引用的块
+        await asyncio.to_thread(backup_store.collect_garbage, backup_module.BACKUP_DIR)
         return {"message": f"备份文件 '{filename}' 已删除"}
 
     except HTTPException:
@@ -608,17 +999,20 @@ async def delete_all_backups():
 
         # 获取所有 zip 文件
         files = [f for f in os.listdir(backup_module.BACKUP_DIR) if f.endswith('.zip')]
-        deleted_count = 0
+        deleted = []
 
         for filename in files:
             filepath = os.path.join(backup_module.BACKUP_DIR, filename)
             try:
                 os.remove(filepath)
-                deleted_count += 1
+                deleted.append(filename)
                 logger.info(f"Deleted backup file: {filename}")
             except Exception as e:
                 logger.error(f"Failed to delete {filename}: {e}")
 
+        deleted_count = len(deleted)
+        await asyncio.to_thread(backup_catalog.forget_local, deleted)
+        await asyncio.to_thread(backup_store.collect_garbage, backup_module.BACKUP_DIR)
         return {"message": f"已删除 {deleted_count} 个备份文件", "deleted_count": deleted_count}
 
     except Exception as e:
@@ -626,40 +1020,48 @@ async def delete_all_backups():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 上传恢复文件时每次写入磁盘的字节数
+RESTORE_UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
 @router.post("/backup/upload-restore")
-async def upload_and_restore_backup(file: UploadFile = File(...)):
-    """上传备份文件并恢复"""
+async def upload_and_restore_backup(file: UploadFile = File(...), dry_run: bool = False):
+    """上传备份文件并恢复；dry_run=true 时只返回将要发生的更改"""
+    temp_path = None
     try:
         # 验证文件类型
         if not file.filename.endswith('.zip'):
             raise HTTPException(status_code=400, detail="只支持ZIP文件")
 
-        # 保存上传的文件到临时位置
-        temp_path = os.path.join(backup_module.BACKUP_DIR, f"restore_{file.filename}")
-
+        # 分块写入临时文件，不把整个上传读入内存；不以 .zip 结尾，不会出现在备份历史中
+        temp_path = os.path.join(backup_module.BACKUP_DIR, f"restore_{uuid.uuid4().hex}.upload")
         with open(temp_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            while chunk := await file.read(RESTORE_UPLOAD_CHUNK_BYTES):
+                f.write(chunk)
 
         # 恢复备份
-        result = backup_module.restore_from_backup(temp_path)
-
-        # 删除临时文件
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        result = await asyncio.to_thread(backup_module.restore_from_backup, temp_path, dry_run)
+        if not dry_run:
+            script_versions.invalidate_all()
 
         if not result['success']:
             raise HTTPException(status_code=500, detail=result.get('error', '恢复失败'))
 
         return {
             "message": result.get('message', '恢复成功'),
+            "dry_run": dry_run,
             "restored_count": result['restored_count'],
             "skipped_count": result['skipped_count'],
-            "details": result['details']
+            "details": result['details'],
+            "changes": result['changes']
         }
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Upload and restore backup failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # 删除临时文件
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
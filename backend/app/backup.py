@@ -1,4 +1,6 @@
+import hashlib
 import os
+import shutil
 import zipfile
 import datetime
 import logging
@@ -6,7 +8,7 @@ import json
 from typing import Optional, List
 from webdav3.client import Client
 from .database import SessionLocal
-from . import models
+from . import models, scheduler, backup_store, backup_stream, backup_catalog, webdav_uploader
 
 logger = logging.getLogger(__name__)
 
@@ -15,69 +17,69 @@ BACKUP_DIR = "/data/backups"
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
 
+class BackupCancelled(Exception):
+    """备份任务被取消"""
+
+
+class BackupProgress:
+    """备份进度回调，在执行备份的工作线程中调用；默认实现不记录进度、不可取消"""
+
+    def set_phase(self, phase: str, total_bytes: int):
+        """进入新阶段 (archiving / uploading)，total_bytes 为该阶段需要处理的字节数"""
+
+    def advance(self, nbytes: int):
+        """当前阶段又处理了 nbytes 字节"""
+
+    def check_cancelled(self):
+        """已请求取消时抛出 BackupCancelled"""
+
+
+NO_PROGRESS = BackupProgress()
+
+
 def create_backup_filename(prefix: str = "scripts_backup") -> str:
     """生成备份文件名"""
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{prefix}_{timestamp}.zip"
+    filename = f"{prefix}_{timestamp}.zip"
+    # 同一秒内的多次备份 (增量备份很快) 不覆盖已有文件；只在远程的备份没有本地文件，也要查备份目录
+    n = 1
+    while os.path.exists(os.path.join(BACKUP_DIR, filename)) or backup_catalog.exists(filename):
+        filename = f"{prefix}_{timestamp}_{n}.zip"
+        n += 1
+    return filename
 
 
-def backup_scripts_to_zip(script_ids: Optional[List[int]] = None) -> tuple[str, str]:
+def backup_scripts_to_zip(script_ids: Optional[List[int]] = None,
+                          progress: BackupProgress = NO_PROGRESS) -> tuple[str, str]:
     """
     将脚本打包为ZIP文件
 
     Args:
         script_ids: 要备份的脚本ID列表，None表示备份全部
+        progress: 进度回调，按脚本文件字节数汇报打包进度，每个文件之间检查是否取消
 
     Returns:
         (zip_file_path, zip_filename) 元组
     """
     db = SessionLocal()
     try:
-        # 查询要备份的脚本
-        if script_ids:
-            scripts = db.query(models.Script).filter(models.Script.id.in_(script_ids)).all()
-            prefix = f"script_{script_ids[0]}" if len(script_ids) == 1 else "scripts_partial"
-        else:
-            scripts = db.query(models.Script).all()
-            prefix = "scripts_backup"
-
-        if not scripts:
-            raise ValueError("没有找到要备份的脚本")
+        scripts, prefix = _query_scripts(db, script_ids)
 
         # 生成备份文件名
         zip_filename = create_backup_filename(prefix)
         zip_path = os.path.join(BACKUP_DIR, zip_filename)
 
-        # 创建ZIP文件
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # 备份每个脚本
-            for script in scripts:
-                # 1. 添加脚本文件
-                if os.path.exists(script.path):
-                    # 使用脚本名作为ZIP内部路径
-                    arcname = os.path.basename(script.path)
-                    zipf.write(script.path, arcname)
-                    logger.info(f"Added script file: {arcname}")
-                else:
-                    logger.warning(f"Script file not found: {script.path}")
-
-                # 2. 添加脚本元数据JSON
-                metadata = {
-                    "id": script.id,
-                    "name": script.name,
-                    "path": script.path,
-                    "cron": script.cron,
-                    "enabled": script.enabled,
-                    "run_on_startup": script.run_on_startup,
-                    "arguments": script.arguments,
-                    "created_at": script.created_at.isoformat() if script.created_at else None,
-                    "last_run": script.last_run.isoformat() if script.last_run else None,
-                    "last_status": script.last_status
-                }
+        sizes = {script.id: os.path.getsize(script.path) for script in scripts if os.path.exists(script.path)}
+        progress.set_phase("archiving", sum(sizes.values()))
 
-                metadata_filename = f"{os.path.splitext(os.path.basename(script.path))[0]}_metadata.json"
-                zipf.writestr(metadata_filename, json.dumps(metadata, ensure_ascii=False, indent=2))
-                logger.info(f"Added metadata: {metadata_filename}")
+        # 创建ZIP文件
+        try:
+            _write_zip(zip_path, scripts, sizes, progress)
+        except BaseException:
+            # 失败或取消时不留下不完整的备份文件
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+            raise
 
         logger.info(f"Backup created successfully: {zip_path}")
         return zip_path, zip_filename
@@ -86,12 +88,150 @@ def backup_scripts_to_zip(script_ids: Optional[List[int]] = None) -> tuple[str,
         db.close()
 
 
+def _query_scripts(db, script_ids: Optional[List[int]]) -> tuple[List[models.Script], str]:
+    """查询要备份的脚本，返回 (脚本列表, 备份文件名前缀)"""
+    if script_ids:
+        scripts = db.query(models.Script).filter(models.Script.id.in_(script_ids)).all()
+        prefix = f"script_{script_ids[0]}" if len(script_ids) == 1 else "scripts_partial"
+    else:
+        scripts = db.query(models.Script).all()
+        prefix = "scripts_backup"
+
+    if not scripts:
+        raise ValueError("没有找到要备份的脚本")
+    return scripts, prefix
+
+
+def _script_metadata(script: models.Script) -> tuple[str, dict]:
+    """脚本元数据JSON的文件名和内容"""
+    metadata = {
+        "id": script.id,
+        "name": script.name,
+        "path": script.path,
+        "cron": script.cron,
+        "enabled": script.enabled,
+        "run_on_startup": script.run_on_startup,
+        "arguments": script.arguments,
+        "overlap_policy": script.overlap_policy,
+        "max_instances": script.max_instances,
+        "warm_start": script.warm_start,
+        **{field: getattr(script, field) for field in scheduler.LIMIT_FIELDS},
+        "created_at": script.created_at.isoformat() if script.created_at else None,
+        "last_run": script.last_run.isoformat() if script.last_run else None,
+        "last_status": script.last_status
+    }
+    metadata_filename = f"{os.path.splitext(os.path.basename(script.path))[0]}_metadata.json"
+    return metadata_filename, metadata
+
+
+def _write_zip(target, scripts: List[models.Script], sizes: dict, progress: BackupProgress):
+    """target 为文件路径或可写的文件对象 (可以不支持 seek，如流式上传的管道)"""
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        # 备份每个脚本
+        for script in scripts:
+            progress.check_cancelled()
+            # 1. 添加脚本文件
+            if script.id in sizes:
+                # 使用脚本名作为ZIP内部路径
+                arcname = os.path.basename(script.path)
+                zipf.write(script.path, arcname)
+                progress.advance(sizes[script.id])
+                logger.info(f"Added script file: {arcname}")
+            else:
+                logger.warning(f"Script file not found: {script.path}")
+
+            # 2. 添加脚本元数据JSON
+            metadata_filename, metadata = _script_metadata(script)
+            zipf.writestr(metadata_filename, json.dumps(metadata, ensure_ascii=False, indent=2))
+            logger.info(f"Added metadata: {metadata_filename}")
+
+
+def backup_scripts_incremental(script_ids: Optional[List[int]] = None,
+                               progress: BackupProgress = NO_PROGRESS) -> tuple[str, str, dict]:
+    """
+    增量备份：脚本内容存入去重的块仓库 (只写入新的块)，生成只含 manifest 和元数据的快照ZIP
+
+    Args:
+        script_ids: 要备份的脚本ID列表，None表示备份全部
+        progress: 进度回调，同 backup_scripts_to_zip
+
+    Returns:
+        (zip_file_path, zip_filename, stats) 元组，stats 含本次新增字节数和相比完整备份节省的字节数
+    """
+    db = SessionLocal()
+    try:
+        scripts, prefix = _query_scripts(db, script_ids)
+
+        zip_filename = create_backup_filename(f"{prefix}_incr")
+        zip_path = os.path.join(BACKUP_DIR, zip_filename)
+
+        sizes = {script.id: os.path.getsize(script.path) for script in scripts if os.path.exists(script.path)}
+        progress.set_phase("archiving", sum(sizes.values()))
+
+        store = backup_store.ChunkStore(BACKUP_DIR)
+        stats = {
+            "mode": "incremental",
+            "files": 0,
+            "files_changed": 0,
+            "bytes_total": 0,  # 脚本文件总大小，即完整备份需要打包的字节数
+            "bytes_new": 0,  # 本次新写入块仓库的字节数 (压缩前)
+            "bytes_stored": 0,  # 本次新写入块仓库的字节数 (压缩后)
+        }
+        with backup_store.lock:
+            index = store.load_index()
+            files = {}
+            try:
+                for script in scripts:
+                    progress.check_cancelled()
+                    if script.id not in sizes:
+                        logger.warning(f"Script file not found: {script.path}")
+                        continue
+                    stored = backup_store.store_file(store, script.path, index, progress)
+                    entry = stored["entry"]
+                    files[os.path.basename(script.path)] = entry
+                    index[script.path] = entry
+                    stats["files"] += 1
+                    stats["files_changed"] += stored["changed"]
+                    stats["bytes_total"] += entry["size"]
+                    stats["bytes_new"] += stored["new_bytes"]
+                    stats["bytes_stored"] += stored["stored_bytes"]
+
+                manifest = {
+                    "format": backup_store.MANIFEST_FORMAT,
+                    "version": 1,
+                    "chunk_size": backup_store.CHUNK_SIZE,
+                    "created_at": datetime.datetime.now().isoformat(),
+                    "files": files,
+                }
+                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    zipf.writestr(backup_store.MANIFEST_NAME, json.dumps(manifest, indent=2))
+                    for script in scripts:
+                        metadata_filename, metadata = _script_metadata(script)
+                        zipf.writestr(metadata_filename, json.dumps(metadata, ensure_ascii=False, indent=2))
+            except BaseException:
+                if os.path.exists(zip_path):
+                    os.remove(zip_path)
+                raise
+
+            store.save_index(index)
+
+        stats["bytes_saved"] = stats["bytes_total"] - stats["bytes_new"]
+        stats["snapshot_size"] = os.path.getsize(zip_path)
+        logger.info(f"Incremental backup created: {zip_path} ({stats['files_changed']}/{stats['files']} files changed, "
+                    f"{stats['bytes_new']} new bytes, {stats['bytes_saved']} bytes saved vs full backup)")
+        return zip_path, zip_filename, stats
+
+    finally:
+        db.close()
+
+
 def upload_to_clouddrive(
     local_file: str,
     remote_path: str,
     webdav_url: str,
     username: str,
-    password: str
+    password: str,
+    progress: BackupProgress = NO_PROGRESS
 ) -> bool:
     """
     使用WebDAV上传文件到CloudDrive2（直接使用HTTP请求，避免webdav3库的HEAD请求问题）
@@ -102,51 +242,23 @@ def upload_to_clouddrive(
         webdav_url: WebDAV服务地址
         username: CloudDrive2 用户名
         password: CloudDrive2 密码
+        progress: 进度回调，按已发送字节数汇报上传进度，每个分块之前检查是否取消
 
     Returns:
-        是否上传成功
+        是否上传成功（取消时抛出 BackupCancelled）
     """
-    import requests
-    from requests.auth import HTTPBasicAuth
-
     try:
-        # 清理参数
-        webdav_url = webdav_url.strip().rstrip('/')
-        username = username.strip()
-        password = password.strip()
-        auth = HTTPBasicAuth(username, password)
-
-        # 确保远程目录存在（使用 MKCOL 请求创建目录）
-        remote_dir = os.path.dirname(remote_path)
-        if remote_dir and remote_dir != '/':
-            parts = remote_dir.strip('/').split('/')
-            current_path = ''
-            for part in parts:
-                current_path += '/' + part
-                dir_url = f"{webdav_url}{current_path}/"
-                try:
-                    # MKCOL 创建目录，如果已存在会返回 405 或其他错误，忽略即可
-                    resp = requests.request('MKCOL', dir_url, auth=auth, timeout=30)
-                    if resp.status_code in [201, 301, 302]:
-                        logger.info(f"Created directory: {current_path}")
-                    # 405/409 表示目录已存在，忽略
-                except Exception as e:
-                    logger.debug(f"MKCOL {current_path} error (may already exist): {e}")
-
-        # 上传文件（使用 PUT 请求）
-        file_url = f"{webdav_url}{remote_path}"
-        logger.info(f"Uploading {local_file} to {file_url}")
-
-        with open(local_file, 'rb') as f:
-            resp = requests.put(file_url, data=f, auth=auth, timeout=300)
+        # 上传器复用共享的长连接会话，已知存在的远程目录不再 MKCOL，上传后校验远程文件大小
+        uploader = webdav_uploader.get(webdav_url, username, password)
+        logger.info(f"Uploading {local_file} to {uploader.url(remote_path)}")
 
-        if resp.status_code in [200, 201, 204]:
-            logger.info(f"Upload successful: {remote_path} (status: {resp.status_code})")
-            return True
-        else:
-            logger.error(f"Upload failed: {remote_path} (status: {resp.status_code}, response: {resp.text[:200]})")
-            return False
+        progress.set_phase("uploading", os.path.getsize(local_file))
+        result = uploader.upload_file(local_file, remote_path, progress)
+        logger.info(f"Upload successful: {remote_path} (verified: {result['verified']})")
+        return True
 
+    except BackupCancelled:
+        raise
     except Exception as e:
         logger.error(f"Failed to upload to CloudDrive2: {type(e).__name__}: {e}")
         import traceback
@@ -154,6 +266,78 @@ def upload_to_clouddrive(
         return False
 
 
+def stream_backup_to_clouddrive(script_ids: Optional[List[int]], cd2_config: dict,
+                                progress: BackupProgress = NO_PROGRESS) -> dict:
+    """
+    完整备份边打包边上传到CloudDrive2，不先写出本地ZIP (见 backup_stream)
+
+    Args:
+        script_ids: 要备份的脚本ID列表，None表示备份全部
+        cd2_config: CloudDrive2配置，keep_local 为 True 时同时在本地保留一份备份
+        progress: 进度回调，按已打包的脚本字节数汇报进度
+
+    Returns:
+        {'filename', 'remote_path', 'local_path', 'stats', 'info'}，stats 含上传字节数、吞吐量和重试次数，
+        info 为备份目录记录的大小、校验和与脚本数
+    """
+    webdav_url = cd2_config['webdav_url'].strip().rstrip('/')
+    backup_path = cd2_config.get('backup_path', '/ScriptBackups')
+    keep_local = bool(cd2_config.get('keep_local'))
+
+    db = SessionLocal()
+    try:
+        scripts, prefix = _query_scripts(db, script_ids)
+        filename = create_backup_filename(prefix)
+        remote_path = f"{backup_path.rstrip('/')}/{filename}"
+        local_path = os.path.join(BACKUP_DIR, filename)
+        sizes = {script.id: os.path.getsize(script.path) for script in scripts if os.path.exists(script.path)}
+
+        checksum = {}
+
+        def write_archive(target):
+            progress.set_phase("streaming", sum(sizes.values()))
+            writer = _HashingWriter(target)
+            _write_zip(writer, scripts, sizes, progress)
+            checksum['sha256'] = writer.hexdigest()
+
+        uploader = webdav_uploader.get(webdav_url, cd2_config['username'], cd2_config['password'])
+        uploader.ensure_dir(os.path.dirname(remote_path))
+        logger.info(f"Streaming backup to {uploader.url(remote_path)}")
+        try:
+            stats = backup_stream.ArchiveUpload(uploader.client, uploader.url(remote_path), write_archive, progress,
+                                                local_path, keep_local).run()
+        except webdav_uploader.UploadError as e:
+            raise Exception(f"上传到CloudDrive2失败: {e}")
+        return {
+            'filename': filename,
+            'remote_path': remote_path,
+            'local_path': local_path if keep_local else None,
+            'stats': stats,
+            'info': {'size': stats['archive_size'], 'checksum': checksum.get('sha256'), 'script_count': len(scripts)},
+        }
+
+    finally:
+        db.close()
+
+
+class _HashingWriter:
+    """写入 target 的同时计算 SHA-256：流式上传的归档不落盘，只能边写边算"""
+
+    def __init__(self, target):
+        self.target = target
+        self._hash = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        return self.target.write(data)
+
+    def flush(self):
+        self.target.flush()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
 def test_clouddrive_connection(webdav_url: str, username: str, password: str) -> tuple[bool, str]:
     """
     测试CloudDrive2连接
@@ -185,7 +369,10 @@ def test_clouddrive_connection(webdav_url: str, username: str, password: str) ->
 def backup_and_upload(
     script_ids: Optional[List[int]] = None,
     backup_type: str = 'local',
-    cd2_config: Optional[dict] = None
+    cd2_config: Optional[dict] = None,
+    progress: BackupProgress = NO_PROGRESS,
+    incremental: bool = False,
+    retention: Optional[dict] = None
 ) -> dict:
     """
     备份脚本并根据配置上传到CloudDrive2
@@ -194,57 +381,89 @@ def backup_and_upload(
         script_ids: 要备份的脚本ID列表
         backup_type: 'local' 或 'clouddrive'
         cd2_config: CloudDrive2配置 {'webdav_url', 'username', 'password', 'backup_path'}
+        progress: 进度回调 (见 BackupProgress)，可用于取消备份
+        incremental: 增量备份 (见 backup_scripts_incremental)，上传时只上传远程缺少的块
+        retention: 保留策略 (见 backup_catalog.apply_retention)，备份成功后清理同一系列的旧备份
 
     Returns:
-        备份结果字典
+        备份结果字典，增量备份时 stats 中包含新增字节数和相比完整备份节省的字节数，retention 为保留策略清理的结果
     """
     result = {
         'success': False,
+        'cancelled': False,
         'local_path': None,
         'remote_path': None,
         'filename': None,
+        'stats': None,
+        'retention': None,
         'error': None
     }
 
     try:
+        upload = backup_type == 'clouddrive' and cd2_config
+        if upload and not (cd2_config.get('webdav_url') and cd2_config.get('username') and cd2_config.get('password')):
+            raise ValueError("CloudDrive2配置不完整")
+
+        # 完整备份上传到CloudDrive时边打包边上传，不先写出本地文件
+        if upload and not incremental:
+            streamed = stream_backup_to_clouddrive(script_ids, cd2_config, progress)
+            info = streamed.pop('info')
+            result.update(streamed)
+            result['success'] = True
+            _finish_backup(result, 'clouddrive', info, cd2_config, retention)
+            return result
+
         # 1. 创建本地备份
-        local_path, filename = backup_scripts_to_zip(script_ids)
+        if incremental:
+            local_path, filename, result['stats'] = backup_scripts_incremental(script_ids, progress)
+        else:
+            local_path, filename = backup_scripts_to_zip(script_ids, progress)
         result['local_path'] = local_path
         result['filename'] = filename
+        info = backup_catalog.archive_info(local_path)
 
-        # 2. 如果配置了CloudDrive，上传备份
-        if backup_type == 'clouddrive' and cd2_config:
-            webdav_url = cd2_config.get('webdav_url')
-            username = cd2_config.get('username')
-            password = cd2_config.get('password')
+        # 2. 如果配置了CloudDrive，上传增量快照
+        if upload:
             backup_path = cd2_config.get('backup_path', '/ScriptBackups')
 
-            if not webdav_url or not username or not password:
-                raise ValueError("CloudDrive2配置不完整")
-
             # 构建远程路径
             remote_path = f"{backup_path.rstrip('/')}/{filename}"
             result['remote_path'] = remote_path
 
+            # 快照引用的块先于快照上传，远程只要出现快照，它引用的块就都已存在
+            result['stats'].update(_upload_chunks(local_path, cd2_config, progress))
+
             # 上传文件
             upload_success = upload_to_clouddrive(
                 local_file=local_path,
                 remote_path=remote_path,
-                webdav_url=webdav_url,
-                username=username,
-                password=password
+                webdav_url=cd2_config['webdav_url'],
+                username=cd2_config['username'],
+                password=cd2_config['password'],
+                progress=progress
             )
 
             if not upload_success:
                 raise Exception("上传到CloudDrive2失败")
 
-            # 上传成功后删除本地备份文件
-            if os.path.exists(local_path):
+            # 上传成功后删除本地备份文件 (除非配置了保留本地副本)
+            if not cd2_config.get('keep_local') and os.path.exists(local_path):
                 os.remove(local_path)
                 logger.info(f"Deleted local backup after CloudDrive upload: {local_path}")
                 result['local_path'] = None  # 清除本地路径
 
         result['success'] = True
+        _finish_backup(result, 'clouddrive' if upload else 'local', info, cd2_config if upload else None, retention)
+        return result
+
+    except BackupCancelled:
+        # 取消时删除已生成的本地文件 (流式上传已自行清理本地和远程的不完整文件)
+        if result['local_path'] and os.path.exists(result['local_path']):
+            os.remove(result['local_path'])
+        result['local_path'] = None
+        result['cancelled'] = True
+        result['error'] = "备份已取消"
+        logger.info("Backup cancelled")
         return result
 
     except Exception as e:
@@ -253,60 +472,115 @@ def backup_and_upload(
         return result
 
 
-def get_backup_history(limit: int = 20) -> List[dict]:
+def _finish_backup(result: dict, backup_type: str, info: dict, cd2_config: Optional[dict],
+                   retention: Optional[dict]):
+    """备份成功后写入备份目录并按保留策略清理同一系列的旧备份；这一步出错只记录日志，不影响备份结果"""
+    try:
+        backup_catalog.record(
+            result['filename'], backup_type, info,
+            local_path=result['local_path'],
+            remote_url=cd2_config['webdav_url'] if cd2_config else None,
+            remote_path=result['remote_path']
+        )
+        if retention:
+            series = (backup_catalog.series_of(result['filename']), backup_type)
+            result['retention'] = backup_catalog.apply_retention(retention, BACKUP_DIR, cd2_config, series)
+    except Exception as e:
+        logger.error(f"Failed to update backup catalog for {result['filename']}: {e}")
+
+
+def _upload_chunks(snapshot_path: str, cd2_config: dict, progress: BackupProgress) -> dict:
+    """上传增量快照引用、而远程还没有的块，返回上传的块数和字节数"""
+    backup_path = cd2_config.get('backup_path', '/ScriptBackups')
+    remote_id = backup_store.remote_id(cd2_config['webdav_url'], backup_path)
+    store = backup_store.ChunkStore(BACKUP_DIR)
+    with zipfile.ZipFile(snapshot_path) as zipf:
+        manifest = backup_store.read_manifest(zipf)
+    referenced = {digest for entry in manifest['files'].values() for digest in entry['chunks']}
+    missing = sorted(referenced - store.remote_chunks(remote_id))
+
+    # 块文件小而多，逐个串行上传时耗时主要在请求往返上，改为并发上传
+    uploader = webdav_uploader.get(cd2_config['webdav_url'], cd2_config['username'], cd2_config['password'])
+    results = uploader.upload_many(
+        [(backup_store.chunk_path(store.root, digest), backup_store.remote_chunk_path(backup_path, digest))
+         for digest in missing],
+        progress
+    )
+    store.mark_remote(remote_id, missing)
+    uploaded_bytes = sum(result['size'] for result in results)
+
+    logger.info(f"Uploaded {len(missing)}/{len(referenced)} chunks ({uploaded_bytes} bytes) to CloudDrive2")
+    return {"chunks_uploaded": len(missing), "bytes_uploaded": uploaded_bytes}
+
+
+def get_backup_history(limit: int = 20, offset: int = 0, include_remote: bool = False) -> List[dict]:
     """
-    获取本地备份历史
+    获取备份历史 (查询备份目录，见 backup_catalog)
+
+    Args:
+        limit / offset: 分页
+        include_remote: 同时列出本地已删除、只在CloudDrive2上的备份
 
     Returns:
-        备份文件列表
+        按创建时间倒序的备份列表
     """
     try:
-        backups = []
+        return backup_catalog.list_backups(limit, offset, include_remote)
 
-        if not os.path.exists(BACKUP_DIR):
-            return backups
-
-        # 列出所有ZIP文件
-        files = [f for f in os.listdir(BACKUP_DIR) if f.endswith('.zip')]
-        files.sort(reverse=True)  # 按文件名降序排序（时间戳在文件名中）
+    except Exception as e:
+        logger.error(f"Failed to get backup history: {e}")
+        return []
 
-        for filename in files[:limit]:
-            filepath = os.path.join(BACKUP_DIR, filename)
-            stat = os.stat(filepath)
 
-            backups.append({
-                'filename': filename,
-                'size': stat.st_size,
-                'created_at': datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                'path': filepath
-            })
+# 恢复时从 ZIP 条目复制脚本内容的缓冲大小
+RESTORE_COPY_BYTES = 1024 * 1024
 
-        return backups
 
-    except Exception as e:
-        logger.error(f"Failed to get backup history: {e}")
-        return []
+def _restored_fields(metadata: dict) -> dict:
+    """元数据中恢复到脚本记录的字段"""
+    return {
+        'name': metadata['name'],
+        'cron': metadata.get('cron'),
+        'enabled': metadata.get('enabled', False),
+        'run_on_startup': metadata.get('run_on_startup', False),
+        'arguments': metadata.get('arguments', ''),
+        'overlap_policy': metadata.get('overlap_policy') or 'skip',
+        'max_instances': metadata.get('max_instances') or 1,
+        'warm_start': metadata.get('warm_start', False),
+        **{field: metadata.get(field) for field in scheduler.LIMIT_FIELDS},
+    }
 
 
-def restore_from_backup(zip_file_path: str) -> dict:
+def restore_from_backup(zip_file_path: str, dry_run: bool = False) -> dict:
     """
     从备份ZIP恢复脚本
 
+    不解压整个ZIP：先只读取各脚本的元数据规划恢复内容，再逐个从ZIP条目 (增量快照则从块仓库) 流式写出脚本文件。
+    脚本文件先写到目标旁的临时文件，数据库更改在同一个事务中提交，提交成功后才替换目标文件。
+
     Args:
         zip_file_path: ZIP文件路径
+        dry_run: 只报告将要新增 / 更新 / 跳过的脚本，不写文件也不修改数据库
 
     Returns:
-        恢复结果
+        恢复结果，changes 为每个脚本的操作 (create / update) 和会被修改的字段
     """
     result = {
         'success': False,
+        'dry_run': dry_run,
         'restored_count': 0,
         'skipped_count': 0,
         'error': None,
-        'details': []
+        'details': [],
+        'changes': []
     }
 
+    def skip(message: str):
+        result['details'].append(message)
+        result['skipped_count'] += 1
+
     db = SessionLocal()
+    staged = []  # [(临时文件, 目标路径)]
     try:
         # 验证ZIP文件
         if not os.path.exists(zip_file_path):
@@ -315,98 +589,133 @@ def restore_from_backup(zip_file_path: str) -> dict:
         if not zipfile.is_zipfile(zip_file_path):
             raise ValueError("无效的ZIP文件")
 
-        # 创建临时解压目录
-        temp_dir = os.path.join(BACKUP_DIR, f"restore_temp_{int(datetime.datetime.now().timestamp())}")
-        os.makedirs(temp_dir, exist_ok=True)
-
-        try:
-            # 解压ZIP文件
-            with zipfile.ZipFile(zip_file_path, 'r') as zipf:
-                zipf.extractall(temp_dir)
-
-            # 查找所有元数据JSON文件
-            metadata_files = [f for f in os.listdir(temp_dir) if f.endswith('_metadata.json')]
+        script_root = os.getenv("SCRIPT_ROOT", "/scripts")
+        store = backup_store.ChunkStore(BACKUP_DIR)
+
+        with zipfile.ZipFile(zip_file_path, 'r') as zipf:
+            # 只读取中央目录和 manifest，脚本内容在下面按需逐个读取
+            manifest = backup_store.read_manifest(zipf)
+            chunked = {os.path.basename(name): entry for name, entry in manifest['files'].items()} if manifest else {}
+            entries = {}
+            metadata_names = []
+            for info in zipf.infolist():
+                if info.is_dir() or info.filename == backup_store.MANIFEST_NAME:
+                    continue
+                if info.filename.endswith('_metadata.json'):
+                    metadata_names.append(info.filename)
+                else:
+                    entries[os.path.basename(info.filename)] = info
 
-            if not metadata_files:
+            if not metadata_names:
                 raise ValueError("备份中没有找到元数据文件")
 
-            # 恢复每个脚本
-            for metadata_file in metadata_files:
-                metadata_path = os.path.join(temp_dir, metadata_file)
-
+            plans = []
+            for metadata_name in metadata_names:
+                try:
+                    metadata = json.loads(zipf.read(metadata_name))
+                    if not metadata.get('name'):
+                        raise ValueError("元数据缺少脚本名")
+                    plans.append((metadata_name, metadata, os.path.basename(metadata['path'])))
+                except Exception as e:
+                    logger.error(f"Failed to read metadata {metadata_name}: {e}")
+                    skip(f"恢复失败 {metadata_name}: {str(e)}")
+
+            # 一次查出所有相关的已有脚本，不再逐个查询
+            targets = [os.path.join(script_root, script_filename) for _, _, script_filename in plans]
+            names = [metadata['name'] for _, metadata, _ in plans]
+            existing = {s.path: s for s in db.query(models.Script).filter(models.Script.path.in_(targets))}
+            name_owners = dict(db.query(models.Script.name, models.Script.path).filter(models.Script.name.in_(names)))
+
+            for metadata_name, metadata, script_filename in plans:
+                target_path = os.path.join(script_root, script_filename)
+                temp_path = None
                 try:
-                    # 读取元数据
-                    with open(metadata_path, 'r', encoding='utf-8') as f:
-                        metadata = json.load(f)
-
-                    script_filename = os.path.basename(metadata['path'])
-                    script_source = os.path.join(temp_dir, script_filename)
-
                     # 检查脚本文件是否存在
-                    if not os.path.exists(script_source):
-                        result['details'].append(f"跳过 {metadata['name']}: 脚本文件缺失")
-                        result['skipped_count'] += 1
+                    if script_filename in chunked:
+                        if backup_store.missing_chunks(store, chunked[script_filename]):
+                            skip(f"跳过 {metadata['name']}: 块仓库中缺少脚本文件的数据")
+                            continue
+                    elif script_filename not in entries:
+                        skip(f"跳过 {metadata['name']}: 脚本文件缺失")
                         continue
 
-                    # 目标路径
-                    script_root = os.getenv("SCRIPT_ROOT", "/scripts")
-                    target_path = os.path.join(script_root, script_filename)
+                    # 脚本名唯一：同名脚本指向其他文件时不能恢复
+                    owner = name_owners.get(metadata['name'])
+                    if owner is not None and owner != target_path:
+                        skip(f"跳过 {metadata['name']}: 已存在同名脚本 ({owner})")
+                        continue
 
-                    # 检查数据库中是否已存在同名脚本
-                    existing_script = db.query(models.Script).filter(
-                        models.Script.path == target_path
-                    ).first()
+                    fields = _restored_fields(metadata)
+                    existing_script = existing.get(target_path)
+                    if existing_script:
+                        change = {
+                            'name': metadata['name'],
+                            'action': 'update',
+                            'path': target_path,
+                            'fields': [f for f, v in fields.items() if getattr(existing_script, f) != v]
+                        }
+                    else:
+                        change = {'name': metadata['name'], 'action': 'create', 'path': target_path,
+                                  'fields': list(fields)}
+                    change['overwrite_file'] = os.path.exists(target_path)
+
+                    if dry_run:
+                        action = '将更新脚本' if existing_script else '将新增脚本'
+                        result['details'].append(f"{action}: {metadata['name']}")
+                        result['changes'].append(change)
+                        result['restored_count'] += 1
+                        continue
 
-                    # 复制脚本文件
-                    import shutil
-                    shutil.copy2(script_source, target_path)
-                    logger.info(f"Restored script file: {target_path}")
+                    # 流式写出脚本文件到临时文件，提交数据库后再替换目标文件
+                    temp_path = f"{target_path}.restore-tmp{len(staged)}"
+                    with open(temp_path, 'wb') as f:
+                        if script_filename in chunked:
+                            backup_store.restore_file(store, chunked[script_filename], f)
+                        else:
+                            with zipf.open(entries[script_filename]) as src:
+                                shutil.copyfileobj(src, f, RESTORE_COPY_BYTES)
+                    staged.append((temp_path, target_path))
 
                     if existing_script:
                         # 更新现有脚本配置
-                        existing_script.name = metadata['name']
-                        existing_script.cron = metadata.get('cron')
-                        existing_script.enabled = metadata.get('enabled', False)
-                        existing_script.run_on_startup = metadata.get('run_on_startup', False)
-                        existing_script.arguments = metadata.get('arguments', '')
+                        for field, value in fields.items():
+                            setattr(existing_script, field, value)
                         result['details'].append(f"更新脚本: {metadata['name']}")
                     else:
                         # 创建新脚本记录
-                        new_script = models.Script(
-                            name=metadata['name'],
-                            path=target_path,
-                            cron=metadata.get('cron'),
-                            enabled=metadata.get('enabled', False),
-                            run_on_startup=metadata.get('run_on_startup', False),
-                            arguments=metadata.get('arguments', ''),
-                            last_status=None,
-                            last_run=None
-                        )
+                        new_script = models.Script(path=target_path, last_status=None, last_run=None, **fields)
                         db.add(new_script)
+                        existing[target_path] = new_script
                         result['details'].append(f"新增脚本: {metadata['name']}")
+                    name_owners[metadata['name']] = target_path
 
+                    result['changes'].append(change)
                     result['restored_count'] += 1
 
                 except Exception as e:
-                    logger.error(f"Failed to restore script from {metadata_file}: {e}")
-                    result['details'].append(f"恢复失败 {metadata_file}: {str(e)}")
-                    result['skipped_count'] += 1
-
-            # 提交数据库更改
-            db.commit()
+                    logger.error(f"Failed to restore script from {metadata_name}: {e}")
+                    if temp_path and os.path.exists(temp_path) and (temp_path, target_path) not in staged:
+                        os.remove(temp_path)
+                    skip(f"恢复失败 {metadata_name}: {str(e)}")
 
+        if dry_run:
             result['success'] = True
-            result['message'] = f"成功恢复 {result['restored_count']} 个脚本，跳过 {result['skipped_count']} 个"
+            result['message'] = f"预演：将恢复 {result['restored_count']} 个脚本，跳过 {result['skipped_count']} 个"
+            return result
 
-        finally:
-            # 清理临时目录
-            if os.path.exists(temp_dir):
-                import shutil
-                shutil.rmtree(temp_dir)
+        # 所有数据库更改在一个事务中提交，成功后再替换脚本文件
+        db.commit()
+        for temp_path, target_path in staged:
+            os.replace(temp_path, target_path)
+            logger.info(f"Restored script file: {target_path}")
+        staged.clear()
 
+        result['success'] = True
+        result['message'] = f"成功恢复 {result['restored_count']} 个脚本，跳过 {result['skipped_count']} 个"
         return result
 
     except Exception as e:
+        db.rollback()
         result['error'] = str(e)
         logger.error(f"Restore from backup failed: {e}")
         import traceback
@@ -414,4 +723,8 @@ def restore_from_backup(zip_file_path: str) -> dict:
         return result
 
     finally:
+        # 未提交的恢复：删除已写出的临时文件
+        for temp_path, _ in staged:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
         db.close()
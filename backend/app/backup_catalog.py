@@ -0,0 +1,284 @@
+"""
+备份目录 (backup_catalog 表)：记录每个备份归档的大小、脚本数、SHA-256、类型 (local / clouddrive) 和本地 / 远程位置。
+备份历史直接按 created_at 索引查询该表，不再每次列出并 stat 备份目录。
+
+- 备份成功后由 backup_and_upload 调用 record 写入；启动时 sync_local 补录备份目录中未记录的归档，并清除已不存在的本地文件
+- apply_retention 按保留策略清理旧备份：保留最近 N 个，另外每日 / 每周 / 每月各保留若干个 (每个时间段内最新的一个)。
+  本地文件和 CloudDrive2 上的远程文件都会删除，删除增量快照后再清理本地和远程不再被引用的块
+  (只在远程的快照引用的块在本地保留，见 backup_store.collect_garbage)
+- 保留策略按系列分别计算：文件名前缀 (完整 / 增量 / 单脚本备份) 和类型都相同的备份为一个系列
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+from . import models, backup_store, webdav_uploader
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# create_backup_filename 生成的文件名：<前缀>_<YYYYmmdd>_<HHMMSS>[_n].zip
+_FILENAME_PATTERN = re.compile(r"^(.*)_\d{8}_\d{6}(?:_\d+)?\.zip$")
+
+# 保留策略的时间段：名称 -> 时间段的键
+RETENTION_TIERS = {
+    "daily": lambda t: t.date(),
+    "weekly": lambda t: t.isocalendar()[:2],
+    "monthly": lambda t: (t.year, t.month),
+}
+
+
+def series_of(filename: str) -> str:
+    match = _FILENAME_PATTERN.match(filename)
+    return match.group(1) if match else os.path.splitext(filename)[0]
+
+
+def archive_info(path: str) -> dict:
+    """本地归档的大小、SHA-256、脚本数和 (增量快照) 引用的块，只读取 ZIP 的中央目录和 manifest"""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            file_hash.update(data)
+    with zipfile.ZipFile(path) as zipf:
+        script_count = sum(1 for name in zipf.namelist() if name.endswith("_metadata.json"))
+        manifest = backup_store.read_manifest(zipf)
+    chunks = sorted({digest for entry in manifest["files"].values() for digest in entry["chunks"]}) if manifest else None
+    return {
+        "size": os.path.getsize(path),
+        "checksum": file_hash.hexdigest(),
+        "script_count": script_count,
+        "incremental": manifest is not None,
+        "chunks": chunks,
+    }
+
+
+def exists(filename: str) -> bool:
+    with SessionLocal() as db:
+        return db.query(models.BackupRecord.id).filter(models.BackupRecord.filename == filename).first() is not None
+
+
+def record(filename: str, backup_type: str, info: dict, local_path: Optional[str] = None,
+           remote_url: Optional[str] = None, remote_path: Optional[str] = None,
+           created_at: Optional[datetime.datetime] = None):
+    """写入 (或覆盖同名的) 备份记录，info 为 archive_info 的结果"""
+    with SessionLocal() as db:
+        row = db.query(models.BackupRecord).filter(models.BackupRecord.filename == filename).first()
+        if row is None:
+            row = models.BackupRecord(filename=filename)
+            db.add(row)
+        _fill(row, backup_type, info, local_path, remote_url, remote_path, created_at)
+        db.commit()
+
+
+def _fill(row: models.BackupRecord, backup_type: str, info: dict, local_path: Optional[str],
+          remote_url: Optional[str], remote_path: Optional[str], created_at: Optional[datetime.datetime]):
+    row.series = series_of(row.filename)
+    row.backup_type = backup_type
+    row.incremental = bool(info.get("incremental"))
+    row.created_at = created_at or datetime.datetime.now()
+    row.size = info.get("size")
+    row.script_count = info.get("script_count")
+    row.checksum = info.get("checksum")
+    row.local_path = local_path
+    row.remote_url = remote_url.strip().rstrip("/") if remote_url else None
+    row.remote_path = remote_path
+    row.chunks = json.dumps(info["chunks"]) if info.get("chunks") else None
+
+
+def _to_dict(row: models.BackupRecord) -> dict:
+    return {
+        "filename": row.filename,
+        "size": row.size,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "path": row.local_path,
+        "backup_type": row.backup_type,
+        "incremental": row.incremental,
+        "script_count": row.script_count,
+        "checksum": row.checksum,
+        "remote_path": row.remote_path,
+    }
+
+
+def list_backups(limit: int = 20, offset: int = 0, include_remote: bool = False) -> List[dict]:
+    """按时间倒序列出备份；默认只列出本地还在的备份"""
+    with SessionLocal() as db:
+        query = db.query(models.BackupRecord)
+        if not include_remote:
+            query = query.filter(models.BackupRecord.local_path.isnot(None))
+        rows = query.order_by(models.BackupRecord.created_at.desc(), models.BackupRecord.id.desc()) \
+            .offset(offset).limit(limit).all()
+        return [_to_dict(row) for row in rows]
+
+
+def forget_local(filenames: List[str]):
+    """本地文件已被删除：清除本地路径，远程也没有的记录直接删除"""
+    with SessionLocal() as db:
+        rows = db.query(models.BackupRecord).filter(models.BackupRecord.filename.in_(filenames)).all()
+        for row in rows:
+            if row.remote_path:
+                row.local_path = None
+            else:
+                db.delete(row)
+        db.commit()
+
+
+def sync_local(backup_dir: str) -> dict:
+    """让目录与备份目录中的文件一致：补录未记录的归档 (以修改时间为创建时间)，清除已不存在的本地文件"""
+    if not os.path.isdir(backup_dir):
+        return {"added": 0, "missing": 0}
+    files = {f for f in os.listdir(backup_dir) if f.endswith(".zip")}
+    with SessionLocal() as db:
+        rows = db.query(models.BackupRecord.filename, models.BackupRecord.local_path).all()
+    known = {filename for filename, _ in rows}
+    missing = [filename for filename, local_path in rows if local_path and not os.path.exists(local_path)]
+
+    added = 0
+    with SessionLocal() as db:
+        for filename in sorted(files - known):
+            path = os.path.join(backup_dir, filename)
+            try:
+                info = archive_info(path)
+            except Exception as e:
+                logger.warning(f"Cannot add {filename} to backup catalog: {e}")
+                continue
+            row = models.BackupRecord(filename=filename)
+            _fill(row, "local", info, path, None, None, datetime.datetime.fromtimestamp(os.path.getmtime(path)))
+            db.add(row)
+            added += 1
+        db.commit()
+    if missing:
+        forget_local(missing)
+    if added or missing:
+        logger.info(f"Backup catalog synced: {added} added, {len(missing)} missing local files cleared")
+    return {"added": added, "missing": len(missing)}
+
+
+def referenced_chunks() -> set:
+    """目录中所有增量快照 (无论在本地还是远程) 引用的块"""
+    referenced = set()
+    with SessionLocal() as db:
+        for (chunks,) in db.query(models.BackupRecord.chunks).filter(models.BackupRecord.chunks.isnot(None)):
+            referenced.update(json.loads(chunks))
+    return referenced
+
+
+def select_expired(rows: List[models.BackupRecord], policy: Dict[str, int]) -> List[models.BackupRecord]:
+    """
+    rows 为同一系列按时间倒序的备份，返回按保留策略应删除的备份。
+    policy: {"last": N, "daily": N, "weekly": N, "monthly": N}，0 表示不按该项保留
+    """
+    keep = {row.id for row in rows[:policy.get("last", 0)]}
+    for tier, period in RETENTION_TIERS.items():
+        count = policy.get(tier, 0)
+        periods = set()
+        for row in rows:
+            if len(periods) >= count:
+                break
+            key = period(row.created_at)
+            if key not in periods:
+                # 每个时间段保留其中最新的一个
+                periods.add(key)
+                keep.add(row.id)
+    return [row for row in rows if row.id not in keep]
+
+
+def apply_retention(policy: Dict[str, int], backup_dir: str, cd2_config: Optional[dict] = None,
+                    series: Optional[Tuple[str, str]] = None) -> dict:
+    """
+    按保留策略删除旧备份 (本地和远程)，返回删除的数量和清理的块。
+
+    Args:
+        policy: 保留策略 (见 select_expired)，全为 0 时不删除任何备份
+        backup_dir: 本地备份目录
+        cd2_config: CloudDrive2配置，用于删除远程文件；为空或地址不同时远程文件保留，记录留待下次清理
+        series: 只处理该 (系列, 类型) 的备份，None 表示处理全部
+    """
+    result = {"removed": 0, "local_removed": 0, "remote_removed": 0, "remote_failed": 0,
+              "chunks_removed": 0, "remote_chunks_removed": 0}
+    if not any(policy.values()):
+        return result
+
+    uploader = None
+    if cd2_config:
+        uploader = webdav_uploader.get(cd2_config["webdav_url"], cd2_config["username"], cd2_config["password"])
+    incremental_local = incremental_remote = False
+
+    with SessionLocal() as db:
+        query = db.query(models.BackupRecord)
+        if series is not None:
+            query = query.filter(models.BackupRecord.series == series[0], models.BackupRecord.backup_type == series[1])
+        rows = query.order_by(models.BackupRecord.series, models.BackupRecord.backup_type,
+                              models.BackupRecord.created_at.desc()).all()
+        groups: Dict[Tuple[str, str], List[models.BackupRecord]] = {}
+        for row in rows:
+            groups.setdefault((row.series, row.backup_type), []).append(row)
+
+        for group in groups.values():
+            for row in select_expired(group, policy):
+                if row.local_path:
+                    if os.path.exists(row.local_path):
+                        os.remove(row.local_path)
+                    row.local_path = None
+                    result["local_removed"] += 1
+                    incremental_local |= bool(row.incremental)
+                if row.remote_path:
+                    if uploader is not None and row.remote_url == uploader.base_url and uploader.delete(row.remote_path):
+                        row.remote_path = None
+                        result["remote_removed"] += 1
+                        incremental_remote |= bool(row.incremental)
+                    else:
+                        result["remote_failed"] += 1
+                if row.remote_path is None:
+                    db.delete(row)
+                    result["removed"] += 1
+                logger.info(f"Retention policy removed backup {row.filename}")
+        db.commit()
+
+    if incremental_local:
+        result["chunks_removed"] = backup_store.collect_garbage(backup_dir)["removed_chunks"]
+    if incremental_remote:
+        result["remote_chunks_removed"] = _collect_remote_chunks(uploader, cd2_config.get("backup_path", "/ScriptBackups"),
+                                                                 backup_dir)
+    return result
+
+
+def _collect_remote_chunks(uploader: webdav_uploader.WebDAVUploader, backup_path: str, backup_dir: str) -> int:
+    """删除远程不再被任何 (目录中记录的) 远程增量快照引用的块，返回删除的块数"""
+    location = backup_store.remote_id(uploader.base_url, backup_path)
+    store = backup_store.ChunkStore(backup_dir)
+    uploaded = store.remote_chunks(location)
+    if not uploaded:
+        return 0
+
+    # 远程有目录中没有记录的增量快照 (如建立目录之前上传的) 时，无法知道它们引用了哪些块，本次不清理
+    names = uploader.list_dir(backup_path)
+    prefix = backup_path.rstrip("/") + "/"
+    with SessionLocal() as db:
+        rows = db.query(models.BackupRecord.remote_path, models.BackupRecord.chunks).filter(
+            models.BackupRecord.remote_url == uploader.base_url,
+            models.BackupRecord.remote_path.like(prefix + "%"),
+        ).all()
+    known = {os.path.basename(remote_path) for remote_path, _ in rows}
+    if names is None or any(name.endswith(".zip") and series_of(name).endswith("_incr") and name not in known
+                            for name in names):
+        logger.info(f"Skip remote chunk cleanup in {backup_path}: remote snapshots not in the backup catalog")
+        return 0
+
+    referenced = set()
+    for _, chunks in rows:
+        if chunks:
+            referenced.update(json.loads(chunks))
+    removed = [digest for digest in sorted(uploaded - referenced)
+               if uploader.delete(backup_store.remote_chunk_path(backup_path, digest))]
+    if removed:
+        store.forget_remote(location, removed)
+        logger.info(f"Removed {len(removed)} unreferenced backup chunks from {uploader.base_url}{backup_path}")
+    return len(removed)
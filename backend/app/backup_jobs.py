@@ -0,0 +1,214 @@
+"""
+后台备份任务：手动备份、单脚本备份和定时备份都提交为带 ID 的任务，在工作线程中执行，接口立即返回任务信息，
+前端通过 GET /api/backup/jobs/{id} 查询阶段和字节级进度，可通过 POST /api/backup/jobs/{id}/cancel 取消。
+
+同一时间只运行一个备份任务：已有任务在运行时提交新任务抛出 BackupBusy (接口返回 409，定时备份跳过本次)。
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from . import backup as backup_module
+from .settings_cache import settings
+
+logger = logging.getLogger(__name__)
+
+# 保留最近多少个已结束的任务供查询
+MAX_FINISHED_JOBS = 50
+
+FINISHED_STATUSES = ("success", "failed", "cancelled")
+
+
+class BackupBusy(Exception):
+    """已有备份任务在运行"""
+
+    def __init__(self, job: "BackupJob"):
+        super().__init__(f"备份任务 {job.id} 正在运行")
+        self.job = job
+
+
+class BackupJob(backup_module.BackupProgress):
+    def __init__(self, kind: str, trigger: str, script_ids: Optional[List[int]], cd2_config: Optional[dict],
+                 incremental: bool = False):
+        self.id = uuid.uuid4().hex
+        self.kind = kind  # local / clouddrive
+        self.trigger = trigger  # manual / script / scheduled
+        self.incremental = incremental
+        self.script_ids = script_ids
+        self.cd2_config = cd2_config
+        self.status = "pending"  # pending / running / success / failed / cancelled
+        self.phase: Optional[str] = None  # archiving / uploading
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self._cancel = threading.Event()
+        self._done = asyncio.Event()
+
+    # BackupProgress 回调，在工作线程中调用；只做简单赋值，读取方看到的是某一时刻的近似值
+    def set_phase(self, phase: str, total_bytes: int):
+        self.phase = phase
+        self.bytes_total = total_bytes
+        self.bytes_done = 0
+
+    def advance(self, nbytes: int):
+        self.bytes_done += nbytes
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise backup_module.BackupCancelled()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> dict:
+        percent = None
+        if self.bytes_total:
+            percent = round(min(self.bytes_done / self.bytes_total, 1.0) * 100, 1)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "trigger": self.trigger,
+            "incremental": self.incremental,
+            "script_ids": self.script_ids,
+            "status": self.status,
+            "phase": self.phase,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "percent": percent,
+            "cancel_requested": self._cancel.is_set(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "filename": self.result.get("filename") if self.result else None,
+            "local_path": self.result.get("local_path") if self.result else None,
+            "remote_path": self.result.get("remote_path") if self.result else None,
+            "stats": self.result.get("stats") if self.result else None,
+            "retention": self.result.get("retention") if self.result else None,
+            "error": self.error,
+        }
+
+
+class BackupJobManager:
+    def __init__(self):
+        self._jobs: "OrderedDict[str, BackupJob]" = OrderedDict()
+        self._current: Optional[BackupJob] = None
+        self._tasks = set()
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @property
+    def current(self) -> Optional[BackupJob]:
+        return self._current
+
+    def submit(self, kind: str = "local", trigger: str = "manual", script_ids: Optional[List[int]] = None,
+               cd2_config: Optional[dict] = None, incremental: bool = False) -> BackupJob:
+        """提交备份任务并立即返回；已有任务在运行时抛出 BackupBusy"""
+        if self._current is not None:
+            self.rejected += 1
+            raise BackupBusy(self._current)
+        job = BackupJob(kind, trigger, script_ids, cd2_config, incremental)
+        self._current = job
+        self._jobs[job.id] = job
+        self.submitted += 1
+        self._prune()
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: BackupJob):
+        job.status = "running"
+        job.started_at = time.time()
+        logger.info(f"Backup job {job.id} started ({job.trigger}, {job.kind})")
+        try:
+            result = await asyncio.to_thread(
+                backup_module.backup_and_upload,
+                script_ids=job.script_ids,
+                backup_type=job.kind,
+                cd2_config=job.cd2_config,
+                progress=job,
+                incremental=job.incremental,
+                retention=settings.backup_retention(),
+            )
+            job.result = result
+            if result.get("cancelled"):
+                job.status = "cancelled"
+                job.error = result.get("error")
+                self.cancelled += 1
+            elif result["success"]:
+                job.status = "success"
+                self.succeeded += 1
+            else:
+                job.status = "failed"
+                job.error = result.get("error")
+                self.failed += 1
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            self.failed += 1
+            logger.exception(f"Backup job {job.id} error: {e}")
+        finally:
+            job.finished_at = time.time()
+            job._done.set()
+            if self._current is job:
+                self._current = None
+            logger.info(f"Backup job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[BackupJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[BackupJob]:
+        """最近的任务，新的在前"""
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Optional[BackupJob]:
+        """请求取消任务：在下一个文件 / 上传分块之前生效；任务已结束时不做任何事"""
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished:
+            job._cancel.set()
+        return job
+
+    async def wait(self, job: BackupJob) -> BackupJob:
+        await job._done.wait()
+        return job
+
+    async def stop(self, timeout: float = 10):
+        """关闭时取消正在运行的任务并等待它退出"""
+        job = self._current
+        if job is None:
+            return
+        job._cancel.set()
+        try:
+            await asyncio.wait_for(self.wait(job), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Backup job {job.id} did not stop within {timeout}s")
+
+    def stats(self) -> dict:
+        return {
+            "current": self._current.id if self._current else None,
+            "submitted": self.submitted,
+            "rejected_busy": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+
+manager = BackupJobManager()
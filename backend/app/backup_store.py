@@ -0,0 +1,234 @@
+"""
+增量备份：脚本内容按固定大小分块，以 SHA-256 为文件名存入去重的块仓库 (BACKUP_DIR/chunks)，
+每次增量备份只写入新出现的块，生成的快照 ZIP 只包含 manifest.json (文件 -> 块列表) 和脚本元数据。
+
+- 文件索引 (chunks/index.json) 记录上次备份时每个脚本文件的大小、修改时间和块列表，未变化的文件不再读取和计算哈希
+- 块以 zlib 压缩存储；恢复时按 manifest 从块仓库逐块拼出脚本文件并校验 SHA-256 (restore_from_backup)
+- 上传到 CloudDrive2 时，已上传过的块记录在 chunks/remote-<id>.txt，只上传远程缺少的块
+- 删除快照后调用 collect_garbage 清理不再被任何快照引用的块 (已上传到远程的块保留)；远程不再被引用的块由保留策略清理 (backup_catalog)
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import zipfile
+import zlib
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 分块大小，修改后已有的块仍可用于恢复，但新旧块之间不再去重
+CHUNK_SIZE = int(os.getenv("BACKUP_CHUNK_KB", "1024")) * 1024
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = "incremental"
+
+# 生成快照和清理块互斥，避免清理掉正在生成的快照刚写入的块
+lock = threading.Lock()
+
+
+def chunk_root(backup_dir: str) -> str:
+    return os.path.join(backup_dir, "chunks")
+
+
+def chunk_path(root: str, digest: str) -> str:
+    return os.path.join(root, digest[:2], digest)
+
+
+def remote_chunk_path(backup_path: str, digest: str) -> str:
+    """块在 WebDAV 上的路径 (相对于 WebDAV 根目录)"""
+    return f"{backup_path.rstrip('/')}/chunks/{digest[:2]}/{digest}"
+
+
+def remote_id(webdav_url: str, backup_path: str) -> str:
+    """远程位置的标识 (WebDAV 地址 + 备份目录)，已上传的块按它分别记录"""
+    return f"{webdav_url.strip().rstrip('/')}|{backup_path.rstrip('/')}"
+
+
+class ChunkStore:
+    def __init__(self, backup_dir: str):
+        self.root = chunk_root(backup_dir)
+        self.index_path = os.path.join(self.root, "index.json")
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(chunk_path(self.root, digest))
+
+    def put(self, digest: str, data: bytes) -> int:
+        """写入块 (已存在时跳过)，返回写入的压缩后字节数"""
+        path = chunk_path(self.root, digest)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, 6)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return len(compressed)
+
+    def get(self, digest: str) -> bytes:
+        with open(chunk_path(self.root, digest), "rb") as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"块 {digest} 校验失败")
+        return data
+
+    def load_index(self) -> Dict[str, dict]:
+        """上次增量备份的文件索引: path -> {size, mtime_ns, sha256, chunks}"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable backup index {self.index_path}: {e}")
+            return {}
+
+    def save_index(self, index: Dict[str, dict]):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _remote_record(self, remote_id: str) -> str:
+        return os.path.join(self.root, f"remote-{hashlib.sha1(remote_id.encode()).hexdigest()[:16]}.txt")
+
+    def remote_chunks(self, remote_id: str) -> Set[str]:
+        """已上传到该远程位置的块"""
+        try:
+            with open(self._remote_record(remote_id), "r") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def all_remote_chunks(self) -> Set[str]:
+        """已上传到任一远程位置、且还没在远程删除的块"""
+        digests = set()
+        for name in os.listdir(self.root):
+            if name.startswith("remote-") and name.endswith(".txt"):
+                with open(os.path.join(self.root, name), "r") as f:
+                    digests.update(line.strip() for line in f if line.strip())
+        return digests
+
+    def mark_remote(self, remote_id: str, digests: Iterable[str]):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._remote_record(remote_id), "a") as f:
+            f.writelines(f"{digest}\n" for digest in digests)
+
+    def forget_remote(self, remote_id: str, digests: Iterable[str]):
+        """从远程记录中移除已在远程删除的块"""
+        remaining = self.remote_chunks(remote_id) - set(digests)
+        tmp_path = f"{self._remote_record(remote_id)}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(f"{digest}\n" for digest in sorted(remaining))
+        os.replace(tmp_path, self._remote_record(remote_id))
+
+
+def store_file(store: ChunkStore, path: str, index: Dict[str, dict], progress) -> dict:
+    """
+    把一个脚本文件存入块仓库，返回 manifest 中该文件的条目和本次的统计。
+    大小和修改时间与索引一致且块都在仓库中时直接复用索引中的块列表，不读取文件。
+    """
+    st = os.stat(path)
+    cached = index.get(path)
+    if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns \
+            and all(store.has(digest) for digest in cached["chunks"]):
+        progress.advance(st.st_size)
+        return {"entry": cached, "new_bytes": 0, "stored_bytes": 0, "changed": False}
+
+    file_hash = hashlib.sha256()
+    chunks: List[str] = []
+    new_bytes = stored_bytes = 0
+    with open(path, "rb") as f:
+        while True:
+            progress.check_cancelled()
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            file_hash.update(data)
+            digest = hashlib.sha256(data).hexdigest()
+            chunks.append(digest)
+            written = store.put(digest, data)
+            if written:
+                new_bytes += len(data)
+                stored_bytes += written
+            progress.advance(len(data))
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_hash.hexdigest(), "chunks": chunks}
+    return {"entry": entry, "new_bytes": new_bytes, "stored_bytes": stored_bytes, "changed": True}
+
+
+def read_manifest(zipf: zipfile.ZipFile) -> Optional[dict]:
+    """增量快照的 manifest，完整备份返回 None"""
+    if MANIFEST_NAME not in zipf.namelist():
+        return None
+    manifest = json.loads(zipf.read(MANIFEST_NAME))
+    return manifest if manifest.get("format") == MANIFEST_FORMAT else None
+
+
+def missing_chunks(store: ChunkStore, entry: dict) -> List[str]:
+    """manifest 中一个文件条目引用、而块仓库中没有的块"""
+    return [digest for digest in entry["chunks"] if not store.has(digest)]
+
+
+def restore_file(store: ChunkStore, entry: dict, fileobj):
+    """按 manifest 中一个文件的条目，从块仓库逐块拼出文件内容写入 fileobj 并校验；缺块或校验失败时抛出异常"""
+    file_hash = hashlib.sha256()
+    for digest in entry["chunks"]:
+        data = store.get(digest)
+        file_hash.update(data)
+        fileobj.write(data)
+    if file_hash.hexdigest() != entry["sha256"]:
+        raise ValueError("文件校验失败")
+
+
+def collect_garbage(backup_dir: str) -> dict:
+    """
+    删除不再被任何增量快照引用的块，返回清理的块数和字节数。
+
+    只在远程 (CloudDrive2) 的快照没有本地文件，恢复它们仍需要本地的块：备份目录表中记录的快照 (本地和远程)
+    引用的块，以及已上传到远程的块 (remote-*.txt，可能属于目录表之前上传的快照) 都视为仍被引用，
+    直到远程清理 (backup_catalog 的保留策略) 删除远程的块并从记录中移除
+    """
+    from . import backup_catalog
+
+    store = ChunkStore(backup_dir)
+    if not os.path.isdir(store.root):
+        return {"removed_chunks": 0, "removed_bytes": 0}
+    with lock:
+        referenced = set()
+        for filename in os.listdir(backup_dir):
+            if not filename.endswith(".zip"):
+                continue
+            try:
+                with zipfile.ZipFile(os.path.join(backup_dir, filename)) as zipf:
+                    manifest = read_manifest(zipf)
+            except Exception as e:
+                # 无法读取的快照可能仍引用块，本次不清理
+                logger.warning(f"Skip chunk garbage collection, cannot read {filename}: {e}")
+                return {"removed_chunks": 0, "removed_bytes": 0}
+            if manifest:
+                for entry in manifest["files"].values():
+                    referenced.update(entry["chunks"])
+        try:
+            referenced.update(backup_catalog.referenced_chunks())
+            referenced.update(store.all_remote_chunks())
+        except Exception as e:
+            logger.warning(f"Skip chunk garbage collection, cannot read remote snapshot references: {e}")
+            return {"removed_chunks": 0, "removed_bytes": 0}
+
+        removed = removed_bytes = 0
+        for prefix in os.listdir(store.root):
+            prefix_dir = os.path.join(store.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                if digest in referenced:
+                    continue
+                path = os.path.join(prefix_dir, digest)
+                removed_bytes += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} unreferenced backup chunks ({removed_bytes} bytes)")
+        return {"removed_chunks": removed, "removed_bytes": removed_bytes}
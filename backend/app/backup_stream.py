@@ -0,0 +1,251 @@
+"""
+流式备份上传：边打包边 PUT 到 WebDAV (不带 Content-Length，HTTP/1.1 下为 chunked 传输编码)，
+不再先在 /data/backups 写出完整的 ZIP 再上传，省去一次完整的磁盘写入和读取，也不需要预留与备份同样大的磁盘空间。
+
+- 打包在单独的线程中写入有界管道，上传慢时打包线程等待 (背压)，内存占用与备份大小无关
+- 可选保留本地副本：打包时同时写入本地文件
+- 失败按指数退避重试：有完整的本地副本时从本地副本上传，服务端保留了部分文件且支持 Content-Range 写入时
+  只发送剩余部分 (续传)，否则整个重传；没有本地副本时重新打包再流式上传
+- 服务端拒绝 chunked 上传 (411 / 501) 时先写出本地文件，再带 Content-Length 上传
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+import httpx
+
+from .webdav_uploader import RETRIES, RETRY_MAX_DELAY, UploadError, check_status, read_file, remote_props, \
+    sleep_cancellable, verify
+
+logger = logging.getLogger(__name__)
+
+# 管道中每块的大小和最多积压的块数 (积压上限即打包领先上传的最大字节数)
+PIPE_CHUNK_BYTES = 256 * 1024
+PIPE_MAX_CHUNKS = 16
+
+# 这些状态码表示服务端不接受没有 Content-Length 的上传
+CHUNKED_UNSUPPORTED = (411, 501)
+
+
+class StreamPipe:
+    """打包线程写入、上传线程读取的有界管道；ZipFile 把它当作不可 seek 的文件写入"""
+
+    _EOF = object()
+
+    def __init__(self, local_file=None):
+        self._queue = queue.Queue(PIPE_MAX_CHUNKS)
+        self._buffer = bytearray()
+        self._local = local_file
+        self._detached = False
+        self._abort = False
+        self.error: Optional[BaseException] = None
+        self.written = 0
+        self.sent = 0
+
+    # --- 写入端 (打包线程) ---
+    def write(self, data) -> int:
+        if self._abort:
+            raise UploadError("上传已中止")
+        if self._local is not None:
+            self._local.write(data)
+        self.written += len(data)
+        if not self._detached:
+            self._buffer += data
+            if len(self._buffer) >= PIPE_CHUNK_BYTES:
+                self._put(bytes(self._buffer))
+                self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _put(self, item):
+        while not self._detached:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self, error: Optional[BaseException] = None):
+        """打包结束 (error 为打包线程的异常)"""
+        self.error = error
+        if error is None and self._buffer:
+            self._put(bytes(self._buffer))
+        self._buffer.clear()
+        self._put(self._EOF)
+
+    # --- 读取端 (上传请求) ---
+    def chunks(self, progress):
+        while True:
+            progress.check_cancelled()
+            item = self._queue.get()
+            if item is self._EOF:
+                if self.error is not None:
+                    raise self.error
+                return
+            self.sent += len(item)
+            yield item
+
+    def detach(self, keep_local: bool):
+        """上传端不再读取：有本地副本时打包线程继续写完本地文件，否则中止打包"""
+        self._detached = True
+        self._abort = not (keep_local and self._local is not None)
+
+
+class ArchiveUpload:
+    """
+    把 write_archive(fileobj) 写出的归档上传到 url。
+
+    write_archive 在打包线程中调用，可能被调用多次 (重新打包重试)；progress 为 backup.BackupProgress。
+    local_path 为本地副本 / 回退用临时文件的路径，keep_local 为 False 时结束后删除。
+    """
+
+    def __init__(self, client: httpx.Client, url: str, write_archive: Callable, progress, local_path: str,
+                 keep_local: bool = False, retries: int = RETRIES):
+        self.client = client
+        self.url = url
+        self.write_archive = write_archive
+        self.progress = progress
+        self.local_path = local_path
+        self.keep_local = keep_local
+        self.retries = retries
+        self.local_complete = False
+        self.stats = {
+            "mode": "stream",
+            "attempts": 0,
+            "bytes_sent": 0,
+            "archive_size": None,
+            "resumed_from": None,
+            "chunked_fallback": False,
+            "verified": False,
+        }
+
+    def run(self) -> dict:
+        """上传归档，返回统计 (含吞吐量)；失败抛出异常，取消时抛出 BackupCancelled"""
+        start = time.monotonic()
+        delay = 1
+        try:
+            for attempt in range(1, self.retries + 2):
+                self.stats["attempts"] = attempt
+                self.progress.check_cancelled()
+                try:
+                    if self.local_complete:
+                        done = self._upload_local()
+                    else:
+                        done = self._stream()
+                    if done:
+                        break
+                    error = "服务端暂时不可用"
+                except httpx.TransportError as e:
+                    error = f"{type(e).__name__}: {e}"
+                if attempt > self.retries:
+                    raise UploadError(f"上传失败，已重试 {self.retries} 次: {error}")
+                logger.warning(f"Backup upload attempt {attempt} failed ({error}), retrying in {delay}s")
+                sleep_cancellable(delay, self.progress)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+        except BaseException:
+            # 取消或最终失败时删除远程的不完整文件和不需要保留的本地文件
+            self._delete_remote()
+            if os.path.exists(self.local_path) and not (self.keep_local and self.local_complete):
+                os.remove(self.local_path)
+            raise
+
+        if not self.keep_local and os.path.exists(self.local_path):
+            os.remove(self.local_path)
+        elapsed = time.monotonic() - start
+        self.stats["seconds"] = round(elapsed, 3)
+        self.stats["throughput_mb_s"] = round(self.stats["bytes_sent"] / 1024 / 1024 / elapsed, 2) if elapsed else None
+        logger.info(f"Backup uploaded to {self.url}: {self.stats['archive_size']} bytes, "
+                    f"{self.stats['throughput_mb_s']} MB/s, {self.stats['attempts']} attempt(s)")
+        return self.stats
+
+    def _stream(self) -> bool:
+        """边打包边上传；返回是否上传成功"""
+        local = open(self.local_path, "wb") if self.keep_local else None
+        pipe = StreamPipe(local)
+
+        def produce():
+            try:
+                self.write_archive(pipe)
+                pipe.finish()
+            except BaseException as e:
+                pipe.finish(e)
+
+        producer = threading.Thread(target=produce, name="backup-stream", daemon=True)
+        producer.start()
+        try:
+            resp = self.client.put(self.url, content=pipe.chunks(self.progress))
+        finally:
+            # 上传中断时，有本地副本则让打包线程写完本地文件，供重试时从本地续传
+            pipe.detach(self.keep_local)
+            producer.join()
+            if local is not None:
+                local.close()
+            self.stats["bytes_sent"] += pipe.sent
+            self.local_complete = local is not None and pipe.error is None
+
+        if pipe.error is not None and not isinstance(pipe.error, UploadError):
+            # 打包本身出错 (如取消、读取脚本失败)，重试没有意义
+            raise pipe.error
+        if resp.status_code in CHUNKED_UNSUPPORTED:
+            logger.warning(f"WebDAV server rejected chunked upload (HTTP {resp.status_code}), "
+                           f"falling back to a local temp file")
+            self.stats["chunked_fallback"] = True
+            self._write_local()
+            return self._upload_local()
+        if not check_status(resp):
+            return False
+        self.stats["archive_size"] = pipe.written
+        return self._verify(pipe.written, resp)
+
+    def _verify(self, size: int, resp: httpx.Response) -> bool:
+        """以远程文件的大小 / ETag 确认上传完整，不一致时按失败重试"""
+        verified = verify(self.client, self.url, size, resp)
+        self.stats["verified"] = bool(verified)
+        return verified is not False
+
+    def _write_local(self):
+        if not self.local_complete:
+            with open(self.local_path, "wb") as f:
+                self.write_archive(f)
+            self.local_complete = True
+
+    def _upload_local(self) -> bool:
+        """从本地副本上传，远程已有部分文件时尝试用 Content-Range 续传；返回是否上传成功"""
+        size = os.path.getsize(self.local_path)
+        self.stats["archive_size"] = size
+        props = remote_props(self.client, self.url)
+        offset = props[0] if props and props[0] < size else 0
+        if offset:
+            resp = self._put_local(offset, size)
+            # 服务端可能忽略 Content-Range 只保存了剩余部分，以远程大小确认
+            if resp is not None and verify(self.client, self.url, size, resp):
+                self.stats["resumed_from"] = offset
+                self.stats["verified"] = True
+                return True
+            logger.info("WebDAV server does not support ranged PUT, uploading the whole archive")
+        resp = self._put_local(0, size)
+        return resp is not None and self._verify(size, resp)
+
+    def _put_local(self, offset: int, size: int) -> Optional[httpx.Response]:
+        """从本地副本的 offset 处开始上传，成功返回响应，可重试的失败 / 不支持续传时返回 None"""
+        self.progress.set_phase("uploading", size)
+        self.progress.advance(offset)
+        headers = {"Content-Length": str(size - offset)}
+        if offset:
+            headers["Content-Range"] = f"bytes {offset}-{size - 1}/{size}"
+        resp = self.client.put(self.url, content=read_file(self.local_path, offset, self.progress), headers=headers)
+        self.stats["bytes_sent"] += size - offset
+        if offset and resp.status_code in (400, 416, 501):
+            return None
+        return resp if check_status(resp) else None
+
+    def _delete_remote(self):
+        try:
+            self.client.request("DELETE", self.url, timeout=30)
+        except httpx.HTTPError:
+            pass
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
@@ -13,8 +14,47 @@ if DATABASE_URL.startswith("sqlite:///"):
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite 连接参数：WAL 模式下读不阻塞写、写不阻塞读；NORMAL 同步级别在 WAL 下只在检查点时 fsync；
+# busy_timeout 让并发写入排队等待而不是立即报 database is locked
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper(),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384")),  # 负数表示以 KB 为单位
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE_MB", "64")) * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+# 同步引擎：启动时的建表 / 迁移，以及在工作线程中运行的备份代码
 # check_same_thread=False is needed for SQLite
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# 异步引擎：API、执行引擎和 Telegram Bot 在事件循环中使用，SQLite 读写 (含 fsync) 在 aiosqlite 线程中完成，不阻塞事件循环
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite:///", "sqlite+aiosqlite:///", 1) \
+    if DATABASE_URL.startswith("sqlite:///") else DATABASE_URL
+# 非 WAL 模式下读写互斥，多个连接交错写入会互相等待锁直至超时，因此所有会话共用一个连接按事务排队；
+# WAL 模式下读可以并发，写入由 busy_timeout 在 aiosqlite 线程中排队
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **({"pool_size": 1, "max_overflow": 0} if IS_SQLITE and SQLITE_JOURNAL_MODE != "WAL" else {})
+)
+# 提交后不过期对象，避免在事件循环中访问属性时触发隐式查询
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+
+Base = declarative_base()
@@ -0,0 +1,226 @@
+"""
+预热的 Python forkserver（由 warm_runner 以独立进程启动，只依赖标准库）
+
+启动时预先 import 配置的模块，之后每个运行请求都从这里 fork 出子进程执行脚本，
+省去解释器启动和重复 import 的开销。
+
+协议（Unix socket，每次运行一个连接）：
+  1. 客户端发送一行 JSON {"path", "args", "cwd", "limits"}，并通过 SCM_RIGHTS 附带 stdout 管道写端
+  2. 服务端 fork 子进程，回复一行 {"pid": pid}
+  3. 子进程退出后服务端回复一行 {"returncode": rc, "rusage": {...}}（被信号杀死时 rc 为负的信号值），然后关闭连接
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+
+def _run_child(request: dict, out_fd: int):
+    """在 fork 出的子进程中执行脚本，永不返回"""
+    code = 1
+    try:
+        # 新建会话/进程组，与 start_new_session=True 的行为一致，stop_script 可以 killpg
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_fd, 1)
+        os.dup2(out_fd, 2)
+        os.close(devnull)
+        os.close(out_fd)
+
+        # 等价于 python3 -u：输出不做缓冲，保证实时日志
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), write_through=True, line_buffering=True)
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), write_through=True, line_buffering=True)
+        os.environ["PYTHONUNBUFFERED"] = "1"
+
+        script_path = request["path"]
+        if request.get("cwd"):
+            os.chdir(request["cwd"])
+        sys.argv = [script_path] + list(request.get("args") or [])
+        sys.path[0] = os.path.dirname(os.path.abspath(script_path))
+
+        _apply_limits(request.get("limits") or {})
+
+        import random
+        random.seed()
+
+        runpy.run_path(script_path, run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        # 与解释器正常退出一致：等待非守护线程结束、执行 atexit 回调，再刷新输出后退出
+        try:
+            threading = sys.modules.get("threading")
+            if threading is not None:
+                threading._shutdown()
+            import atexit
+            atexit._run_exitfuncs()
+        except BaseException:
+            traceback.print_exc()
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(code & 0xFF)
+
+
+def _apply_limits(limits: dict):
+    """在子进程内设置资源限制 (与 spawner.limit_prefix 含义一致)"""
+    import resource
+    if limits.get("cpu_limit_seconds"):
+        cpu = int(limits["cpu_limit_seconds"])
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 5))
+    if limits.get("max_open_files"):
+        nofile = int(limits["max_open_files"])
+        resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, nofile))
+    if limits.get("nice_level") is not None:
+        os.setpriority(os.PRIO_PROCESS, 0, int(limits["nice_level"]))
+    if limits.get("ionice_level") is not None:
+        import subprocess
+        subprocess.run(["ionice", "-c", "2", "-n", str(int(limits["ionice_level"])), "-p", str(os.getpid())],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def rusage_to_dict(ru, include_maxrss: bool = False) -> dict:
+    """
+    把 resource.struct_rusage 转成可序列化的字典。
+
+    ru_maxrss 只在 include_maxrss 时返回：posix_spawn (vfork) 启动的进程在 exec 时会记下父进程 (ScriptsManager)
+    的峰值，不能作为脚本的峰值内存；forkserver fork 出的子进程有自己的计数，ru_maxrss 就是子进程的真实峰值
+    """
+    usage = {
+        "cpu_user": round(ru.ru_utime, 3),
+        "cpu_system": round(ru.ru_stime, 3),
+        "io_read_blocks": ru.ru_inblock,
+        "io_write_blocks": ru.ru_oublock,
+        "ctx_voluntary": ru.ru_nvcsw,
+        "ctx_involuntary": ru.ru_nivcsw,
+    }
+    if include_maxrss:
+        usage["max_rss_kb"] = ru.ru_maxrss
+    return usage
+
+
+def _returncode(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def serve(socket_path: str, preload: list):
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"forkserver: failed to preload {module}: {e}", file=sys.stderr, flush=True)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(64)
+
+    # SIGCHLD 通过 wakeup fd 唤醒 select 循环
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    sel = selectors.DefaultSelector()
+    sel.register(server, selectors.EVENT_READ, "accept")
+    sel.register(wake_r, selectors.EVENT_READ, "child")
+    sel.register(sys.stdin, selectors.EVENT_READ, "parent")
+
+    children = {}  # pid -> conn
+
+    print("READY", flush=True)
+
+    while True:
+        for key, _ in sel.select():
+            if key.data == "parent":
+                # 父进程 (ScriptsManager) 退出时 stdin 关闭，随之退出
+                if not sys.stdin.buffer.read1(1024):
+                    os.remove(socket_path)
+                    return
+
+            elif key.data == "accept":
+                conn, _ = server.accept()
+                try:
+                    msg, fds, _, _ = socket.recv_fds(conn, 65536, 1)
+                    request = json.loads(msg.decode("utf-8"))
+                    if not fds:
+                        raise ValueError("missing stdout fd")
+                except Exception as e:
+                    conn.sendall((json.dumps({"error": str(e)}) + "\n").encode())
+                    conn.close()
+                    continue
+
+                pid = os.fork()
+                if pid == 0:
+                    sel.close()
+                    server.close()
+                    conn.close()
+                    for c in children.values():
+                        c.close()
+                    signal.set_wakeup_fd(-1)
+                    os.close(wake_r)
+                    os.close(wake_w)
+                    _run_child(request, fds[0])
+
+                os.close(fds[0])
+                children[pid] = conn
+                conn.sendall((json.dumps({"pid": pid}) + "\n").encode())
+
+            elif key.data == "child":
+                try:
+                    while os.read(wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                while True:
+                    try:
+                        pid, status, rusage = os.wait4(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        break
+                    if pid == 0:
+                        break
+                    conn = children.pop(pid, None)
+                    if conn:
+                        try:
+                            message = {"returncode": _returncode(status),
+                                       "rusage": rusage_to_dict(rusage, include_maxrss=True)}
+                            conn.sendall((json.dumps(message) + "\n").encode())
+                        except OSError:
+                            pass
+                        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--preload", default="")
+    opts = parser.parse_args()
+    serve(opts.socket, [m.strip() for m in opts.preload.split(",") if m.strip()])
@@ -0,0 +1,170 @@
+"""
+长连接 HTTP 客户端池：Telegram (异步) 和 WebDAV (同步，备份上传在工作线程中执行) 各用一个共享客户端，
+连接保持 keep-alive 复用，安装了 h2 时启用 HTTP/2，避免每次通知 / 轮询 / 上传都重新握手 TCP + TLS (+ 代理 CONNECT)。
+
+Telegram 客户端按代理分别缓存 (Bot 和通知可能在不同时刻读到不同的代理配置，各自复用自己的客户端，不会来回重建)，
+超过 TELEGRAM_MAX_CLIENTS 个时淘汰最久未用的；WebDAV 账号变化时重建客户端。
+被淘汰的 Telegram 客户端延迟关闭，不打断正在进行的请求 (如 getUpdates 长轮询)。
+应用关闭时由 main.py 调用 close()。
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 每个客户端保持的空闲连接数及空闲连接保留时间
+KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# 被替换的 Telegram 客户端在关闭前等待的秒数，需大于 getUpdates 长轮询的超时
+RETIRE_DELAY = 60
+# 同时缓存的 Telegram 客户端数 (每个代理配置一个)
+TELEGRAM_MAX_CLIENTS = 4
+
+TELEGRAM_TIMEOUT = httpx.Timeout(10.0)
+WEBDAV_TIMEOUT = httpx.Timeout(30.0, write=300.0, read=300.0)
+
+
+class PoolStats:
+    """统计请求数和新建连接数，两者之差即复用的连接次数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.rebuilds = 0
+
+    def on_trace(self, name: str):
+        if name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    def to_dict(self) -> dict:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": reused,
+            "reuse_rate": round(reused / self.requests, 3) if self.requests else None,
+            "rebuilds": self.rebuilds,
+        }
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_keepalive_connections=KEEPALIVE_CONNECTIONS, keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+class TelegramClients:
+    """Telegram Bot API 客户端，按代理配置分别复用"""
+
+    def __init__(self):
+        self.stats = PoolStats()
+        self._clients: "OrderedDict[Optional[str], httpx.AsyncClient]" = OrderedDict()  # 代理 -> 客户端，按最近使用排序
+        self._retiring = set()
+
+    async def _on_request(self, request: httpx.Request):
+        self.stats.requests += 1
+        stats = self.stats
+
+        async def trace(name, info):
+            stats.on_trace(name)
+
+        request.extensions["trace"] = trace
+
+    def get(self, proxy: Optional[str] = None) -> httpx.AsyncClient:
+        """取得使用指定代理的客户端，该代理还没有客户端时新建"""
+        proxy = proxy or None
+        client = self._clients.get(proxy)
+        if client is not None and not client.is_closed:
+            self._clients.move_to_end(proxy)
+            return client
+        if self._clients:
+            logger.info(f"Creating Telegram HTTP client (proxy: {proxy})")
+        client = self._clients[proxy] = httpx.AsyncClient(
+            proxy=proxy, http2=HTTP2_AVAILABLE, limits=_limits(), timeout=TELEGRAM_TIMEOUT,
+            event_hooks={"request": [self._on_request]},
+        )
+        self._clients.move_to_end(proxy)
+        while len(self._clients) > TELEGRAM_MAX_CLIENTS:
+            _, oldest = self._clients.popitem(last=False)
+            self._retire(oldest)
+            self.stats.rebuilds += 1
+        return client
+
+    def _retire(self, client: httpx.AsyncClient):
+        async def close_later():
+            await asyncio.sleep(RETIRE_DELAY)
+            await client.aclose()
+
+        task = asyncio.get_running_loop().create_task(close_later())
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def close(self):
+        for task in list(self._retiring):
+            task.cancel()
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+class WebDAVClients:
+    """WebDAV 客户端，按 (服务地址, 账号) 复用；供工作线程中的同步备份代码使用"""
+
+    def __init__(self):
+        self.stats = PoolStats()
+        self._client: Optional[httpx.Client] = None
+        self._key: Optional[Tuple[str, str, str]] = None
+        self._lock = threading.Lock()
+
+    def _on_request(self, request: httpx.Request):
+        self.stats.requests += 1
+        request.extensions["trace"] = lambda name, info: self.stats.on_trace(name)
+
+    def get(self, base_url: str, username: str, password: str) -> httpx.Client:
+        key = (base_url, username, password)
+        with self._lock:
+            if self._client is not None and self._key == key:
+                return self._client
+            if self._client is not None:
+                self._client.close()
+                self.stats.rebuilds += 1
+            self._client = httpx.Client(
+                auth=(username, password), http2=HTTP2_AVAILABLE, limits=_limits(), timeout=WEBDAV_TIMEOUT,
+                event_hooks={"request": [self._on_request]},
+            )
+            self._key = key
+            return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+                self._key = None
+
+
+telegram = TelegramClients()
+webdav = WebDAVClients()
+
+
+async def close():
+    await telegram.close()
+    webdav.close()
+
+
+def stats() -> dict:
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "telegram": telegram.stats.to_dict(),
+        "webdav": webdav.stats.to_dict(),
+    }
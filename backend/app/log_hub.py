@@ -0,0 +1,101 @@
+"""
+进程内日志发布/订阅：run_script 采集到的输出在写盘的同时发布到这里，
+由 WebSocket 等订阅方实时接收，无需轮询日志文件。
+
+每个订阅者有独立的有界缓冲区，积压超过上限的慢消费者会被断开，不影响其他订阅者和脚本本身。
+没有订阅者时 publish 只是一次字典查询。
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者允许积压的最大字节数
+CLIENT_BUFFER_BYTES = int(os.getenv("LOG_STREAM_CLIENT_BUFFER_BYTES", str(1024 * 1024)))
+
+
+class SlowConsumer(Exception):
+    """订阅者积压超过缓冲上限，已被断开"""
+
+
+class Subscription:
+    def __init__(self, hub: "LogHub", script_id: int, max_bytes: int):
+        self.hub = hub
+        self.script_id = script_id
+        self.max_bytes = max_bytes
+        self.buffered = 0
+        self.dropped = False
+        self._chunks = deque()  # (run_id, offset, data)
+        self._ready = asyncio.Event()
+
+    def push(self, run_id: int, offset: int, data: bytes):
+        if self.dropped:
+            return
+        if self.buffered + len(data) > self.max_bytes:
+            # 慢消费者：丢弃积压并断开，由调用方决定如何通知客户端
+            self.dropped = True
+            self._chunks.clear()
+            self.buffered = 0
+            self.hub.dropped += 1
+            self.hub.unsubscribe(self)
+            self._ready.set()
+            return
+        self._chunks.append((run_id, offset, data))
+        self.buffered += len(data)
+        self._ready.set()
+
+    async def get(self) -> List[Tuple[int, int, bytes]]:
+        """等待并取出当前积压的全部输出"""
+        await self._ready.wait()
+        if self.dropped:
+            raise SlowConsumer()
+        chunks = list(self._chunks)
+        self._chunks.clear()
+        self.buffered = 0
+        self._ready.clear()
+        return chunks
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LogHub:
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self.published_bytes = 0
+        self.dropped = 0
+
+    def subscribe(self, script_id: int, max_bytes: int = CLIENT_BUFFER_BYTES) -> Subscription:
+        sub = Subscription(self, script_id, max_bytes)
+        self._subscribers.setdefault(script_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._subscribers.get(sub.script_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.script_id]
+
+    def publish(self, script_id: int, run_id: int, offset: int, data: bytes):
+        """发布一段输出，offset 为该段在本次运行日志中的起始字节"""
+        subs = self._subscribers.get(script_id)
+        if not subs:
+            return
+        self.published_bytes += len(data)
+        for sub in list(subs):
+            sub.push(run_id, offset, data)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "scripts_watched": len(self._subscribers),
+            "published_bytes": self.published_bytes,
+            "dropped_slow_consumers": self.dropped,
+        }
+
+
+hub = LogHub()
@@ -0,0 +1,484 @@
+"""
+分段日志存储：每次运行的输出写入独立的日志分段，按脚本 id / 运行 id 组织
+
+    /data/logs/<script_id>/<run_id>.<seq>.log      正在写入的分段
+    /data/logs/<script_id>/<run_id>.<seq>.log.gz   已关闭并压缩的分段
+
+单个分段超过 LOG_SEGMENT_BYTES 时在运行中途切换到下一个分段，旧分段关闭后压缩。
+读取接口 (tail / follow) 透明地处理未压缩和已压缩的分段。
+写入的同时发布到 log_hub，follow 用它实时推送新输出而不是轮询文件；
+尾部同时保存在 log_tail 的内存缓冲中，read_tail / read_tail_lines 优先从内存读取。
+"""
+import asyncio
+import codecs
+import gzip
+import logging
+import os
+import re
+import shutil
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import log_writer, log_hub, log_tail
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = "/data/logs"
+# 单个分段的大小上限，超过后切换到新分段
+SEGMENT_BYTES = int(os.getenv("LOG_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+
+_SEGMENT_RE = re.compile(r"^(\d+)\.(\d+)\.log(\.gz)?$")
+
+# script_id -> 正在写入的 RunLog 列表 (parallel 策略下可能有多个)
+ACTIVE_RUNS: Dict[int, List["RunLog"]] = {}
+# 尚未关闭完成的运行 (script_id, run_id)：包括 close() 之后还在压缩最后分段的运行，prune 不处理这些运行的分段
+OPEN_RUNS: Set[Tuple[int, int]] = set()
+
+
+def script_dir(script_id: int) -> str:
+    return os.path.join(LOG_DIR, str(script_id))
+
+
+def segment_path(script_id: int, run_id: int, seq: int) -> str:
+    return os.path.join(script_dir(script_id), f"{run_id}.{seq:04d}.log")
+
+
+def _scan(script_id: int) -> Dict[Tuple[int, int], str]:
+    """(run_id, seq) -> 分段路径；压缩过程中两者同时存在时以 .gz 为准"""
+    segments = {}
+    try:
+        names = os.listdir(script_dir(script_id))
+    except FileNotFoundError:
+        return segments
+    for name in names:
+        match = _SEGMENT_RE.match(name)
+        if not match:
+            continue
+        key = (int(match.group(1)), int(match.group(2)))
+        if key in segments and not match.group(3):
+            continue
+        segments[key] = os.path.join(script_dir(script_id), name)
+    return segments
+
+
+def list_segments(script_id: int, run_id: Optional[int] = None) -> List[Tuple[int, int, str]]:
+    """按 (run_id, seq) 升序返回分段"""
+    return [(r, s, path) for (r, s), path in sorted(_scan(script_id).items()) if run_id is None or r == run_id]
+
+
+def _read_segment(path: str, start: int = 0, end: Optional[int] = None) -> bytes:
+    """读取分段 [start, end) 区间，分段可能在读取期间被压缩，此时改读 .gz"""
+    for candidate in (path, path[:-3] if path.endswith(".gz") else path + ".gz"):
+        try:
+            opener = gzip.open if candidate.endswith(".gz") else open
+            with opener(candidate, "rb") as f:
+                f.seek(start)
+                return f.read() if end is None else f.read(max(0, end - start))
+        except FileNotFoundError:
+            continue
+    return b""
+
+
+def _segment_size(path: str) -> int:
+    if path.endswith(".gz"):
+        # gzip 尾部 4 字节为原始长度 (mod 2^32)，分段远小于 4GB
+        with open(path, "rb") as f:
+            f.seek(-4, 2)
+            return int.from_bytes(f.read(4), "little")
+    return os.path.getsize(path)
+
+
+def tail(script_id: int, max_bytes: int, run_id: Optional[int] = None) -> bytes:
+    """从磁盘读取脚本 (或某次运行) 最后 max_bytes 字节输出，跨分段、跨运行拼接"""
+    chunks = []
+    remaining = max_bytes
+    for _, _, path in reversed(list_segments(script_id, run_id)):
+        try:
+            size = _segment_size(path)
+        except OSError:
+            continue
+        start = max(0, size - remaining)
+        data = _read_segment(path, start, size)
+        chunks.append(data)
+        remaining -= len(data)
+        if remaining <= 0:
+            break
+    return b"".join(reversed(chunks))
+
+
+async def read_tail(script_id: int, max_bytes: int, run_id: Optional[int] = None) -> bytes:
+    """最后 max_bytes 字节输出：优先使用内存缓冲，未命中时在线程中读取磁盘"""
+    cached = log_tail.cache.get(script_id, max_bytes, run_id)
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(tail, script_id, max_bytes, run_id)
+
+
+TAIL_BLOCK_BYTES = 8192
+
+
+def _segment_tail_lines(path: str, lines: int) -> bytes:
+    """读取分段的最后 lines 行 (可能多出开头的半行)，不把整个分段读入内存
+
+    未压缩分段从末尾按块向前读取；压缩分段无法向前定位，顺序解压并只保留最后几行。
+    """
+    if path.endswith(".gz"):
+        window = deque(maxlen=lines + 1)
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                window.append(line)
+        return b"".join(window)
+
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        position = f.tell()
+        blocks = []
+        newlines = 0
+        while position > 0 and newlines <= lines:
+            step = min(TAIL_BLOCK_BYTES, position)
+            position -= step
+            f.seek(position)
+            block = f.read(step)
+            blocks.insert(0, block)
+            newlines += block.count(b"\n")
+        return b"".join(blocks)
+
+
+def tail_lines(script_id: int, lines: int, run_id: Optional[int] = None) -> bytes:
+    """从磁盘读取脚本 (或某次运行) 的最后 lines 行，跨分段、跨运行拼接"""
+    chunks = []
+    newlines = 0
+    for _, _, path in reversed(list_segments(script_id, run_id)):
+        try:
+            data = _segment_tail_lines(path, lines)
+        except FileNotFoundError:
+            continue
+        chunks.insert(0, data)
+        newlines += data.count(b"\n")
+        if newlines > lines:
+            break
+    return log_tail.last_lines(b"".join(chunks), lines)
+
+
+async def read_tail_lines(script_id: int, lines: int, run_id: Optional[int] = None) -> bytes:
+    """最后 lines 行：优先使用内存缓冲，未命中时在线程中从文件末尾向前读取"""
+    cached = log_tail.cache.get_lines(script_id, lines, run_id)
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(tail_lines, script_id, lines, run_id)
+
+
+def run_size(script_id: int, run_id: int) -> int:
+    total = 0
+    for _, _, path in list_segments(script_id, run_id):
+        try:
+            total += _segment_size(path)
+        except OSError:
+            pass
+    return total
+
+
+def read_run_range(script_id: int, run_id: int, start: int, end: int) -> bytes:
+    """读取某次运行日志 [start, end) 字节区间 (偏移按各分段解压后依次拼接计算)"""
+    chunks = []
+    base = 0
+    for _, _, path in list_segments(script_id, run_id):
+        if base >= end:
+            break
+        try:
+            size = _segment_size(path)
+        except OSError:
+            continue
+        if base + size > start:
+            chunks.append(_read_segment(path, max(0, start - base), min(size, end - base)))
+        base += size
+    return b"".join(chunks)
+
+
+def _previous_run(script_id: int, run_id: int) -> Optional[int]:
+    older = [r for r, _, _ in list_segments(script_id) if r < run_id]
+    return max(older) if older else None
+
+
+def read_before(script_id: int, run_id: int, offset: int, max_bytes: int,
+                max_lines: int = 0) -> Tuple[bytes, int, int, bool]:
+    """读取位置 (run_id, offset) 之前最多 max_bytes 字节 / max_lines 行，用于日志回看
+
+    到达一次运行的开头后继续读取上一次运行。返回 (数据, 新的 run_id, 新的 offset, 是否还有更早的日志)，
+    下一次回看从返回的位置继续。
+    """
+    pieces = []
+    remaining = max_bytes
+    while remaining > 0:
+        if offset <= 0:
+            previous = _previous_run(script_id, run_id)
+            if previous is None:
+                break
+            run_id, offset = previous, run_size(script_id, previous)
+            continue
+        start = max(0, offset - remaining)
+        data = read_run_range(script_id, run_id, start, offset)
+        pieces.insert(0, data)
+        remaining -= offset - start
+        offset = start
+
+    data = b"".join(pieces)
+    if max_lines and data.count(b"\n") > max_lines:
+        # 只保留最后 max_lines 行，回看位置相应后移
+        cut = len(data)
+        for _ in range(max_lines + 1):
+            cut = data.rfind(b"\n", 0, cut)
+        cut += 1
+        data = data[cut:]
+        # 被丢弃的部分可能跨越多次运行，从最早一段开始逐段前移
+        skip = cut
+        while skip > 0:
+            size = run_size(script_id, run_id)
+            if offset + skip < size:
+                offset += skip
+                break
+            skip -= size - offset
+            later = [r for r, _, _ in list_segments(script_id) if r > run_id]
+            run_id, offset = min(later), 0
+
+    has_more = offset > 0 or _previous_run(script_id, run_id) is not None
+    return data, run_id, offset, has_more
+
+
+def remove_script_logs(script_id: int):
+    log_tail.cache.forget(script_id)
+    shutil.rmtree(script_dir(script_id), ignore_errors=True)
+
+
+def _compress(path: str):
+    """压缩已关闭的分段：写入临时文件后原子重命名，再删除原文件"""
+    if not os.path.exists(path):
+        return
+    tmp_path = path + ".gz.tmp"
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, path + ".gz")
+    os.remove(path)
+
+
+class RunLog:
+    """一次运行的日志写入端，写入经 log_writer 批量落盘，超过分段大小时自动切换分段"""
+
+    def __init__(self, script_id: int, run_id: int):
+        self.script_id = script_id
+        self.run_id = run_id
+        self.seq = 0
+        self.segment_bytes = 0
+        self.total_bytes = 0
+        self._sealing: List[asyncio.Task] = []
+        os.makedirs(script_dir(script_id), exist_ok=True)
+        ACTIVE_RUNS.setdefault(script_id, []).append(self)
+        OPEN_RUNS.add((script_id, run_id))
+        log_tail.cache.start(script_id, run_id)
+
+    @property
+    def path(self) -> str:
+        return segment_path(self.script_id, self.run_id, self.seq)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not data:
+            return
+        log_writer.writer.write(self.path, data)
+        log_hub.hub.publish(self.script_id, self.run_id, self.total_bytes, data)
+        log_tail.cache.append(self.run_id, data)
+        self.segment_bytes += len(data)
+        self.total_bytes += len(data)
+        if self.segment_bytes >= SEGMENT_BYTES:
+            self._rotate()
+
+    def _rotate(self):
+        old_path = self.path
+        self.seq += 1
+        self.segment_bytes = 0
+        self._sealing.append(asyncio.ensure_future(self._seal(old_path)))
+
+    async def _seal(self, path: str):
+        try:
+            await log_writer.writer.close_file(path)
+            await asyncio.to_thread(_compress, path)
+        except Exception as e:
+            logger.error(f"Failed to compress log segment {path}: {e}")
+
+    async def sync(self) -> int:
+        """等待已提交的输出全部落盘，返回本次运行的总字节数"""
+        await log_writer.writer.sync(self.path)
+        return self.total_bytes
+
+    async def close(self):
+        """关闭并压缩最后一个分段"""
+        runs = ACTIVE_RUNS.get(self.script_id, [])
+        if self in runs:
+            runs.remove(self)
+            if not runs:
+                del ACTIVE_RUNS[self.script_id]
+        log_tail.cache.finish(self.script_id, self.run_id)
+        self._sealing.append(asyncio.ensure_future(self._seal(self.path)))
+        try:
+            await asyncio.gather(*self._sealing)
+        finally:
+            OPEN_RUNS.discard((self.script_id, self.run_id))
+
+
+def open_run(script_id: int, run_id: int) -> RunLog:
+    return RunLog(script_id, run_id)
+
+
+def append_note(script_id: int, text: str) -> bool:
+    """向该脚本最近启动的运行日志追加提示信息 (如重叠跳过)，没有正在运行的实例时返回 False"""
+    runs = ACTIVE_RUNS.get(script_id)
+    if not runs:
+        return False
+    runs[-1].write(text)
+    return True
+
+
+async def follow(script_id: int, tail_bytes: int, tail_lines: int = 0,
+                 frame_interval: float = 0.05, frame_bytes: int = 64 * 1024):
+    """类似 tail -f：先产出一条 history 事件 (最近 tail_bytes 字节 / tail_lines 行及回看位置)，
+    之后产出 log 事件推送新输出
+
+    先订阅 log_hub 再读取历史，并按 (run_id, 字节偏移) 去掉两者重叠的部分，保证不丢不重。
+    新输出按 frame_interval 秒或 frame_bytes 字节合并成一帧。订阅者积压过多时抛出 log_hub.SlowConsumer。
+    """
+    sub = log_hub.hub.subscribe(script_id)
+    try:
+        # 订阅前发布的输出全部落盘后，磁盘内容与订阅收到的内容恰好衔接
+        active = list(ACTIVE_RUNS.get(script_id, []))
+        await asyncio.gather(*(run.sync() for run in active))
+
+        seen = {run.run_id: run_size(script_id, run.run_id) for run in active}
+        segments = list_segments(script_id)
+        history = {"type": "history", "data": "", "run_id": None, "offset": 0, "has_more": False}
+        if segments:
+            run_id = segments[-1][0]
+            end = seen.get(run_id)
+            if end is None:
+                end = seen[run_id] = run_size(script_id, run_id)
+            data, cursor_run, cursor_offset, has_more = await asyncio.to_thread(
+                read_before, script_id, run_id, end, tail_bytes, tail_lines)
+            history.update(data=data.decode("utf-8", errors="replace"), run_id=cursor_run,
+                           offset=cursor_offset, has_more=has_more)
+        yield history
+
+        decoders = {}
+
+        def decode(chunks) -> str:
+            out = []
+            for run_id, offset, data in chunks:
+                skip = seen.get(run_id, 0) - offset
+                if skip >= len(data):
+                    continue
+                if skip > 0:
+                    data, offset = data[skip:], offset + skip
+                seen[run_id] = offset + len(data)
+                decoder = decoders.get(run_id)
+                if decoder is None:
+                    decoder = decoders[run_id] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                out.append(decoder.decode(data))
+            return "".join(out)
+
+        loop = asyncio.get_running_loop()
+        while True:
+            text = decode(await sub.get())
+            # 在 frame_interval 内继续收集输出，合并成一帧发送
+            deadline = loop.time() + frame_interval
+            while len(text) < frame_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    text += decode(await asyncio.wait_for(sub.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            if text:
+                yield {"type": "log", "data": text}
+    finally:
+        sub.close()
+
+
+def _run_groups() -> Dict[Tuple[int, int], dict]:
+    """扫描日志目录，按 (script_id, run_id) 汇总大小和最后修改时间"""
+    groups = {}
+    try:
+        script_dirs = os.listdir(LOG_DIR)
+    except FileNotFoundError:
+        return groups
+    for name in script_dirs:
+        if not name.isdigit():
+            continue
+        script_id = int(name)
+        for (run_id, _), path in _scan(script_id).items():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            group = groups.setdefault((script_id, run_id), {"size": 0, "mtime": 0.0, "paths": []})
+            group["size"] += st.st_size
+            group["mtime"] = max(group["mtime"], st.st_mtime)
+            group["paths"].append(path)
+    return groups
+
+
+def prune(retention_days: int, max_runs_per_script: int, max_total_bytes: int) -> dict:
+    """按保留天数 / 每脚本运行数 / 总大小清理日志 (0 表示不限制)，并压缩重启前遗留的未压缩分段
+
+    未关闭完成的运行 (OPEN_RUNS) 不处理：它们的分段由 RunLog 自己压缩，两边同时压缩会写同一个临时文件。
+    OPEN_RUNS 在扫描目录之后读取 (扫描到的分段所属的运行一定已经登记)，压缩和删除前再逐个确认。
+    """
+    groups = _run_groups()
+    active = set(OPEN_RUNS)
+    groups = {key: g for key, g in groups.items() if key not in active}
+    removed = set()
+
+    for key, group in groups.items():
+        for path in group["paths"]:
+            if path.endswith(".log") and key not in OPEN_RUNS:
+                try:
+                    _compress(path)
+                except Exception as e:
+                    logger.error(f"Failed to compress stale log segment {path}: {e}")
+
+    if retention_days > 0:
+        cutoff = time.time() - retention_days * 86400
+        removed.update(key for key, g in groups.items() if g["mtime"] < cutoff)
+
+    if max_runs_per_script > 0:
+        by_script = {}
+        for script_id, run_id in groups:
+            if (script_id, run_id) not in removed:
+                by_script.setdefault(script_id, []).append(run_id)
+        for script_id, run_ids in by_script.items():
+            removed.update((script_id, r) for r in sorted(run_ids, reverse=True)[max_runs_per_script:])
+
+    if max_total_bytes > 0:
+        remaining = sorted((g["mtime"], key) for key, g in groups.items() if key not in removed)
+        total = sum(groups[key]["size"] for _, key in remaining)
+        for _, key in remaining:
+            if total <= max_total_bytes:
+                break
+            removed.add(key)
+            total -= groups[key]["size"]
+
+    freed = 0
+    removed_runs = 0
+    for script_id, run_id in removed:
+        if (script_id, run_id) in OPEN_RUNS:
+            continue
+        removed_runs += 1
+        # 直接使用扫描时的路径，不再逐个运行列目录；未压缩的分段上面已被压缩为 .gz
+        for path in groups[(script_id, run_id)]["paths"]:
+            for candidate in (path, path + ".gz") if path.endswith(".log") else (path,):
+                try:
+                    freed += os.path.getsize(candidate)
+                    os.remove(candidate)
+                except FileNotFoundError:
+                    pass
+    return {"runs_removed": removed_runs, "bytes_freed": freed}
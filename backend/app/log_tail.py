@@ -0,0 +1,159 @@
+"""
+内存中的日志尾部缓存：每次运行保留最近 LOG_TAIL_BUFFER_BYTES 字节输出的环形缓冲，
+运行中的实例和每个脚本最近一次结束的运行都可直接从内存读取尾部，无需读日志文件。
+
+所有缓冲总大小受 LOG_TAIL_TOTAL_BYTES 限制，超出时按最久未写入的顺序淘汰已结束运行的缓冲。
+缓冲无法满足请求时 (冷启动、被淘汰、请求超出缓冲大小) 由 log_store 回退到读取磁盘。
+"""
+import os
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+# 每次运行保留的尾部大小
+BUFFER_BYTES = int(os.getenv("LOG_TAIL_BUFFER_BYTES", str(64 * 1024)))
+# 所有缓冲的总大小上限
+TOTAL_BYTES = int(os.getenv("LOG_TAIL_TOTAL_BYTES", str(32 * 1024 * 1024)))
+
+
+class RingBuffer:
+    """固定容量的字节环形缓冲，只保留最后 capacity 字节"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self.total = 0  # 写入过的总字节数
+        self._chunks = deque()
+
+    @property
+    def complete(self) -> bool:
+        """缓冲中是否保存了这次运行的全部输出"""
+        return self.total == self.size
+
+    def append(self, data: bytes):
+        self.total += len(data)
+        if len(data) >= self.capacity:
+            self._chunks.clear()
+            self._chunks.append(data[-self.capacity:])
+            self.size = self.capacity
+            return
+        self._chunks.append(data)
+        self.size += len(data)
+        while self.size > self.capacity:
+            overflow = self.size - self.capacity
+            head = self._chunks[0]
+            if len(head) <= overflow:
+                self._chunks.popleft()
+                self.size -= len(head)
+            else:
+                self._chunks[0] = head[overflow:]
+                self.size -= overflow
+
+    def tail(self, max_bytes: int) -> bytes:
+        data = b"".join(self._chunks)
+        if len(self._chunks) > 1:
+            self._chunks.clear()
+            self._chunks.append(data)
+        return data[-max_bytes:] if max_bytes < len(data) else data
+
+
+class TailCache:
+    def __init__(self, buffer_bytes: int = BUFFER_BYTES, total_bytes: int = TOTAL_BYTES):
+        self.buffer_bytes = buffer_bytes
+        self.total_bytes = total_bytes
+        self._live: Dict[int, Tuple[int, RingBuffer]] = {}  # run_id -> (script_id, buffer)
+        self._last: "OrderedDict[int, Tuple[int, RingBuffer]]" = OrderedDict()  # script_id -> (run_id, buffer)
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, script_id: int, run_id: int):
+        self._live[run_id] = (script_id, RingBuffer(self.buffer_bytes))
+
+    def append(self, run_id: int, data: bytes):
+        entry = self._live.get(run_id)
+        if entry:
+            entry[1].append(data)
+
+    def finish(self, script_id: int, run_id: int):
+        entry = self._live.pop(run_id, None)
+        if entry is None:
+            return
+        # 并行实例先后结束时保留较新的一次运行
+        previous = self._last.get(script_id)
+        if previous is None or previous[0] <= run_id:
+            self._last[script_id] = (run_id, entry[1])
+            self._last.move_to_end(script_id)
+        self._evict()
+
+    def forget(self, script_id: int):
+        self._last.pop(script_id, None)
+
+    def _used(self) -> int:
+        return sum(b.size for _, b in self._live.values()) + sum(b.size for _, b in self._last.values())
+
+    def _evict(self):
+        used = self._used()
+        while used > self.total_bytes and self._last:
+            _, (_, buffer) = self._last.popitem(last=False)
+            used -= buffer.size
+
+    def _lookup(self, script_id: int, run_id: Optional[int]) -> Optional[Tuple[int, RingBuffer]]:
+        if run_id is not None:
+            entry = self._live.get(run_id)
+            if entry:
+                return run_id, entry[1]
+            last = self._last.get(script_id)
+            return last if last and last[0] == run_id else None
+        # 不指定运行时取该脚本最新的一次 (运行中优先)
+        live = [(r, b) for r, (sid, b) in self._live.items() if sid == script_id]
+        if live:
+            return max(live, key=lambda item: item[0])
+        return self._last.get(script_id)
+
+    def get(self, script_id: int, max_bytes: int, run_id: Optional[int] = None) -> Optional[bytes]:
+        """缓冲足以满足请求时返回尾部，否则返回 None
+
+        指定 run_id 时，缓冲保存了整次运行即可满足；不指定时需要跨运行拼接，要求缓冲中的字节数足够。
+        """
+        entry = self._lookup(script_id, run_id)
+        if entry and (entry[1].size >= max_bytes or (run_id is not None and entry[1].complete)):
+            self.hits += 1
+            return entry[1].tail(max_bytes)
+        self.misses += 1
+        return None
+
+    def get_lines(self, script_id: int, lines: int, run_id: Optional[int] = None) -> Optional[bytes]:
+        """按行取尾部，规则同 get"""
+        entry = self._lookup(script_id, run_id)
+        if entry:
+            data = entry[1].tail(entry[1].size)
+            # 缓冲开头可能是半行，多于 lines 个换行才能保证最后 lines 行完整
+            if data.count(b"\n") > lines or (run_id is not None and entry[1].complete):
+                self.hits += 1
+                return last_lines(data, lines)
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "live_runs": len(self._live),
+            "cached_last_runs": len(self._last),
+            "bytes_used": self._used(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+def last_lines(data: bytes, lines: int) -> bytes:
+    """返回 data 的最后 lines 行 (末尾换行不计为空行)"""
+    end = len(data) - 1 if data.endswith(b"\n") else len(data)
+    cut = end
+    for _ in range(lines):
+        cut = data.rfind(b"\n", 0, cut)
+        if cut < 0:
+            return data
+    return data[cut + 1:]
+
+
+cache = TailCache()
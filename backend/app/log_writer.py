@@ -0,0 +1,223 @@
+"""
+批量日志写入器：脚本输出由事件循环按块读取后交给后台线程，后台线程按大小或时间批量写盘，
+避免逐行同步写文件阻塞事件循环。
+
+同一路径的写入严格按提交顺序落盘；sync / close 等操作排在队列中，
+执行前会先把该路径之前的数据写完，因此可以用来获取准确的文件偏移。
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 缓冲达到该字节数立即刷盘，否则最多等待 FLUSH_INTERVAL 秒
+FLUSH_BYTES = int(os.getenv("LOG_FLUSH_BYTES", str(256 * 1024)))
+FLUSH_INTERVAL = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "200")) / 1000
+# 积压超过该字节数时读取端暂停读取，由管道反压让脚本放慢输出
+HIGH_WATER_BYTES = int(os.getenv("LOG_HIGH_WATER_BYTES", str(32 * 1024 * 1024)))
+# 空闲超过该秒数的文件句柄会被关闭
+IDLE_CLOSE_SECONDS = 30
+# 吞吐统计窗口 (秒)
+RATE_WINDOW = 10
+
+
+class LogWriter:
+    def __init__(self, flush_bytes: int = FLUSH_BYTES, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = deque()  # (op, path, payload, future)
+        self._urgent = 0  # 队列中等待结果的操作数，有则立即处理
+        self._backlog = 0
+        self._thread: Optional[threading.Thread] = None
+        self._files = {}  # path -> [file, last_used]
+        self._closed = False
+        # 统计
+        self.bytes_written = 0
+        self.lines_written = 0
+        self.batches = 0
+        self._history = deque()  # (timestamp, bytes, lines)
+
+    @property
+    def backlog_bytes(self) -> int:
+        return self._backlog
+
+    @property
+    def saturated(self) -> bool:
+        return self._backlog >= HIGH_WATER_BYTES
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def _submit(self, op: str, path: str, payload=None, future=None):
+        with self._cond:
+            self._ensure_thread()
+            self._pending.append((op, path, payload, future))
+            if op == "write":
+                self._backlog += len(payload)
+                # 写入空队列时唤醒空闲等待的线程开始计时，否则少量输出会一直留在内存中
+                if self._backlog >= self.flush_bytes or len(self._pending) == 1:
+                    self._cond.notify()
+            else:
+                self._urgent += 1
+                self._cond.notify()
+
+    def write(self, path: str, data):
+        """提交一段输出 (bytes 或 str)，不阻塞"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if data:
+            self._submit("write", path, data)
+
+    async def _request(self, op: str, path: str, payload=None):
+        future = concurrent.futures.Future()
+        self._submit(op, path, payload, future)
+        return await asyncio.wrap_future(future)
+
+    async def sync(self, path: str) -> int:
+        """等待该路径此前提交的数据全部落盘，返回文件当前大小"""
+        return await self._request("sync", path)
+
+    async def close_file(self, path: str):
+        """写完并关闭该路径的句柄 (删除文件前调用)"""
+        await self._request("close", path)
+
+    # ---- 后台线程 ----
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = None
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    if self._urgent or self._backlog >= self.flush_bytes or self._closed:
+                        break
+                    if not self._pending:
+                        # 空闲时无限等待，不占用 CPU
+                        deadline = None
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    if deadline is None:
+                        deadline = now + self.flush_interval
+                    if now >= deadline:
+                        break
+                    self._cond.wait(deadline - now)
+                batch, self._pending = self._pending, deque()
+                self._urgent = 0
+                self._backlog = 0
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.error(f"Log writer failed to process batch: {e}")
+            self._close_idle()
+
+    def _file(self, path: str):
+        entry = self._files.get(path)
+        if entry is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            entry = self._files[path] = [open(path, "ab", buffering=0), 0.0]
+        entry[1] = time.monotonic()
+        return entry[0]
+
+    def _flush_path(self, path: str, buffers: dict):
+        chunks = buffers.pop(path, None)
+        if not chunks:
+            return
+        data = b"".join(chunks)
+        try:
+            self._file(path).write(data)
+        except Exception as e:
+            logger.error(f"Log writer failed to write {path}: {e}")
+            self._drop(path)
+            return
+        self.bytes_written += len(data)
+        lines = data.count(b"\n")
+        self.lines_written += lines
+        self._history.append((time.monotonic(), len(data), lines))
+
+    def _drop(self, path: str):
+        entry = self._files.pop(path, None)
+        if entry:
+            try:
+                entry[0].close()
+            except Exception:
+                pass
+
+    def _process(self, batch):
+        buffers = defaultdict(list)
+        for op, path, payload, future in batch:
+            if op == "write":
+                buffers[path].append(payload)
+                continue
+
+            self._flush_path(path, buffers)
+            try:
+                if op == "sync":
+                    result = os.path.getsize(path) if os.path.exists(path) else 0
+                else:  # close
+                    self._drop(path)
+                    result = None
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+
+        for path in list(buffers):
+            self._flush_path(path, buffers)
+        self.batches += 1
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for path, (_, last_used) in list(self._files.items()):
+            if now - last_used > IDLE_CLOSE_SECONDS:
+                self._drop(path)
+
+    def close(self, timeout: float = 5):
+        """写完所有积压数据并停止后台线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        for path in list(self._files):
+            self._drop(path)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._history and now - self._history[0][0] > RATE_WINDOW:
+            self._history.popleft()
+        window = list(self._history)
+        return {
+            "bytes_per_second": round(sum(b for _, b, _ in window) / RATE_WINDOW, 1),
+            "lines_per_second": round(sum(n for _, _, n in window) / RATE_WINDOW, 1),
+            "backlog_bytes": self._backlog,
+            "bytes_written": self.bytes_written,
+            "lines_written": self.lines_written,
+            "batches": self.batches,
+            "open_files": len(self._files),
+        }
+
+
+writer = LogWriter()
+
+
+async def capture(stream: asyncio.StreamReader, write, chunk_size: int = 64 * 1024):
+    """按块读取进程输出交给 write (如 RunLog.write)，直到 EOF；积压过多时暂停读取形成反压"""
+    while True:
+        if writer.saturated:
+            await asyncio.sleep(0.05)
+            continue
+        data = await stream.read(chunk_size)
+        if not data:
+            break
+        write(data)
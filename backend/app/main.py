@@ -2,9 +2,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-from .database import engine, SessionLocal, Base
-from . import models, api, scheduler
+from sqlalchemy import select, update
+from .database import engine, async_engine, AsyncSessionLocal, Base
+from . import models, api, scheduler, warm_runner, log_writer, http_clients
+from .settings_cache import settings
+from .notifier import notifier
+from .status_buffer import status_buffer
 import os
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,68 +21,44 @@ app = FastAPI(title="ScriptsManager API")
 
 from .api import sync_scripts_from_disk
 from . import telegram_bot
-from . import backup as backup_module
+from . import backup_jobs, backup_catalog
+
+
+async def run_scheduled_backup(label: str, kind: str, incremental: bool, cd2_config=None):
+    """提交定时备份任务并等待完成；已有备份在运行时跳过本次"""
+    try:
+        job = backup_jobs.manager.submit(kind=kind, trigger="scheduled", cd2_config=cd2_config,
+                                         incremental=incremental)
+    except backup_jobs.BackupBusy as e:
+        logger.warning(f"Scheduled {label} Backup skipped: backup job {e.job.id} is still running")
+        return
+    await backup_jobs.manager.wait(job)
+    if job.status == "success":
+        logger.info(f"Scheduled {label} Backup completed: {job.result.get('remote_path') or job.result['filename']}")
+    else:
+        logger.error(f"Scheduled {label} Backup {job.status}: {job.error}")
 
 
 async def run_scheduled_local_backup():
     """模块级别的本地备份定时任务函数"""
     logger.info("Scheduled Local Backup: Task started")
-    try:
-        result = backup_module.backup_and_upload(script_ids=None, backup_type='local', cd2_config=None)
-        if result['success']:
-            logger.info(f"Scheduled Local Backup completed: {result['filename']}")
-        else:
-            logger.error(f"Scheduled Local Backup failed: {result.get('error')}")
-    except Exception as e:
-        logger.exception(f"Scheduled Local Backup error: {e}")
+    await run_scheduled_backup("Local", "local", settings.get_bool("local_backup_incremental"))
 
 
 async def run_scheduled_cd2_backup():
     """模块级别的 CD2 备份定时任务函数 - 从数据库读取最新配置"""
     logger.info("Scheduled CD2 Backup: Task started")
-    try:
-        db = SessionLocal()
-        try:
-            cd2_url = db.query(models.Setting).filter(models.Setting.key == "cd2_webdav_url").first()
-            cd2_username = db.query(models.Setting).filter(models.Setting.key == "cd2_username").first()
-            cd2_password = db.query(models.Setting).filter(models.Setting.key == "cd2_password").first()
-            cd2_path = db.query(models.Setting).filter(models.Setting.key == "cd2_backup_path").first()
-
-            if not cd2_url or not cd2_username or not cd2_password:
-                logger.warning("Scheduled CD2 Backup skipped: config incomplete")
-                return
-
-            cd2_config = {
-                'webdav_url': cd2_url.value,
-                'username': cd2_username.value,
-                'password': cd2_password.value,
-                'backup_path': cd2_path.value if cd2_path else '/ScriptBackups'
-            }
-        finally:
-            db.close()
-
-        result = backup_module.backup_and_upload(
-            script_ids=None,
-            backup_type='clouddrive',
-            cd2_config=cd2_config
-        )
-        if result['success']:
-            logger.info(f"Scheduled CD2 Backup completed: {result.get('remote_path')}")
-        else:
-            logger.error(f"Scheduled CD2 Backup failed: {result.get('error')}")
-    except Exception as e:
-        logger.exception(f"Scheduled CD2 Backup error: {e}")
+    cd2_config = settings.cd2_config()
+    if not cd2_config:
+        logger.warning("Scheduled CD2 Backup skipped: config incomplete")
+        return
+    await run_scheduled_backup("CD2", "clouddrive", settings.get_bool("cd2_backup_incremental"), cd2_config)
 
 
-def update_scheduled_backup(db=None):
+def update_scheduled_backup():
     """更新定时备份任务（可在运行时调用）"""
     from apscheduler.triggers.cron import CronTrigger
 
-    close_db = False
-    if db is None:
-        db = SessionLocal()
-        close_db = True
-
     try:
         # 清除旧的定时任务
         for job_id in ['scheduled_backup_job', 'scheduled_local_backup', 'scheduled_cd2_backup']:
@@ -85,100 +66,139 @@ def update_scheduled_backup(db=None):
                 scheduler.scheduler.remove_job(job_id)
 
         # === 1. 配置本地备份定时任务 ===
-        local_enabled = db.query(models.Setting).filter(models.Setting.key == "local_backup_enabled").first()
-        local_cron = db.query(models.Setting).filter(models.Setting.key == "local_backup_cron").first()
+        local_enabled = settings.get_bool("local_backup_enabled")
+        local_cron = settings.get("local_backup_cron")
 
-        if local_enabled and local_enabled.value == "true" and local_cron and local_cron.value:
+        if local_enabled and local_cron:
             scheduler.scheduler.add_job(
                 run_scheduled_local_backup,
-                CronTrigger.from_crontab(local_cron.value),
+                CronTrigger.from_crontab(local_cron),
                 id='scheduled_local_backup'
             )
-            logger.info(f"Registered Scheduled Local Backup: {local_cron.value}")
+            logger.info(f"Registered Scheduled Local Backup: {local_cron}")
         else:
-            logger.info(f"Local Backup not scheduled: enabled={local_enabled.value if local_enabled else None}, cron={local_cron.value if local_cron else None}")
+            logger.info(f"Local Backup not scheduled: enabled={local_enabled}, cron={local_cron}")
 
         # === 2. 配置CloudDrive2备份定时任务 ===
-        cd2_enabled = db.query(models.Setting).filter(models.Setting.key == "cd2_backup_enabled").first()
-        cd2_cron = db.query(models.Setting).filter(models.Setting.key == "cd2_backup_cron").first()
+        cd2_enabled = settings.get_bool("cd2_backup_enabled")
+        cd2_cron = settings.get("cd2_backup_cron")
 
-        if cd2_enabled and cd2_enabled.value == "true" and cd2_cron and cd2_cron.value:
+        if cd2_enabled and cd2_cron:
             # 检查配置是否完整
-            cd2_url = db.query(models.Setting).filter(models.Setting.key == "cd2_webdav_url").first()
-            cd2_username = db.query(models.Setting).filter(models.Setting.key == "cd2_username").first()
-            cd2_password = db.query(models.Setting).filter(models.Setting.key == "cd2_password").first()
-
-            if cd2_url and cd2_username and cd2_password:
+            if settings.cd2_config():
                 scheduler.scheduler.add_job(
                     run_scheduled_cd2_backup,
-                    CronTrigger.from_crontab(cd2_cron.value),
+                    CronTrigger.from_crontab(cd2_cron),
                     id='scheduled_cd2_backup'
                 )
-                logger.info(f"Registered Scheduled CD2 Backup: {cd2_cron.value}")
+                logger.info(f"Registered Scheduled CD2 Backup: {cd2_cron}")
             else:
                 logger.warning("Scheduled CD2 Backup enabled but config missing")
         else:
-            logger.info(f"CD2 Backup not scheduled: enabled={cd2_enabled.value if cd2_enabled else None}, cron={cd2_cron.value if cd2_cron else None}")
+            logger.info(f"CD2 Backup not scheduled: enabled={cd2_enabled}, cron={cd2_cron}")
 
     except Exception as e:
         logger.exception(f"Failed to update scheduled backup: {e}")
-    finally:
-        if close_db:
-            db.close()
 
 # 启动定时器
 @app.on_event("startup")
 async def startup_event():
     # 简单的数据库迁移
     from sqlalchemy import text
-    try:
-        with engine.connect() as conn:
-            conn.execute(text("ALTER TABLE scripts ADD COLUMN last_output TEXT"))
-            conn.commit()
-    except Exception:
-        pass
+    migrations = [
+        "ALTER TABLE scripts ADD COLUMN last_output TEXT",
+        "ALTER TABLE scripts ADD COLUMN overlap_policy VARCHAR DEFAULT 'skip'",
+        "ALTER TABLE scripts ADD COLUMN max_instances INTEGER DEFAULT 1",
+        "ALTER TABLE scripts ADD COLUMN warm_start BOOLEAN DEFAULT 0",
+        "ALTER TABLE scripts ADD COLUMN last_duration FLOAT",
+        "ALTER TABLE scripts ADD COLUMN last_cpu_time FLOAT",
+        "ALTER TABLE scripts ADD COLUMN last_max_rss_kb INTEGER",
+        "ALTER TABLE scripts ADD COLUMN timeout_seconds INTEGER",
+        "ALTER TABLE scripts ADD COLUMN cpu_limit_seconds INTEGER",
+        "ALTER TABLE scripts ADD COLUMN memory_limit_mb INTEGER",
+        "ALTER TABLE scripts ADD COLUMN max_open_files INTEGER",
+        "ALTER TABLE scripts ADD COLUMN nice_level INTEGER",
+        "ALTER TABLE scripts ADD COLUMN ionice_level INTEGER",
+        "ALTER TABLE script_runs ADD COLUMN limit_reason VARCHAR",
+        "ALTER TABLE script_runs ADD COLUMN source VARCHAR",
+        "ALTER TABLE script_runs ADD COLUMN log_offset INTEGER",
+        "ALTER TABLE script_runs ADD COLUMN log_end INTEGER",
+        "CREATE INDEX IF NOT EXISTS ix_script_runs_script_id_started_at ON script_runs (script_id, started_at)",
+        "CREATE INDEX IF NOT EXISTS ix_script_runs_status ON script_runs (status)",
+        "CREATE INDEX IF NOT EXISTS ix_scripts_last_status ON scripts (last_status)",
+        "CREATE INDEX IF NOT EXISTS ix_scripts_last_run ON scripts (last_run)",
+        "CREATE INDEX IF NOT EXISTS ix_scripts_enabled ON scripts (enabled)",
+        "CREATE INDEX IF NOT EXISTS ix_scripts_cron ON scripts (cron)",
+    ]
+    for statement in migrations:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text(statement))
+                conn.commit()
+        except Exception:
+            pass
 
     scheduler.scheduler.start()
+
+    # 加载设置项缓存 (异步查询)，之后事件循环中的设置读取都走内存
+    await settings.reload()
+
+    # 启动执行引擎、通知发送队列和状态写入缓冲
+    scheduler.apply_engine_settings()
+    scheduler.engine.start()
+    notifier.start()
+    status_buffer.start()
+
+    # 启动预热 forkserver (如已开启)
+    await warm_runner.apply_settings()
     
     # 启动 Telegram Bot
     await telegram_bot.start_bot()
     
     # 注册健康检查任务 (每5分钟)
     # 先检查是否开启
-    db = SessionLocal()
-    hc_setting = db.query(models.Setting).filter(models.Setting.key == "enable_health_check").first()
-    if hc_setting and hc_setting.value == "true":
+    if settings.get_bool("enable_health_check"):
         scheduler.scheduler.add_job(scheduler.health_check, 'interval', minutes=5, id='health_check_job')
 
+    # 运行历史清理任务 (每小时)
+    scheduler.scheduler.add_job(scheduler.prune_run_history, 'interval', hours=1, id='run_history_prune_job',
+                                replace_existing=True)
+    await scheduler.prune_run_history()
+
     # 注册定时备份任务
     from . import backup as backup_module
-    update_scheduled_backup(db)  # 使用共享函数
+    update_scheduled_backup()  # 使用共享函数
 
-    db.close()
-    
-    # 同步所有启用的脚本到调度器
-    db = SessionLocal()
+    # 备份目录补录已有的备份文件 (升级前的备份、手动放入的文件)
     try:
-        # 0. 重置所有处于 'running' 状态的脚本为 'idle' (因为容器重启了)
-        running_scripts = db.query(models.Script).filter(models.Script.last_status == 'running').all()
+        await asyncio.to_thread(backup_catalog.sync_local, backup_module.BACKUP_DIR)
+    except Exception as e:
+        logger.error(f"Backup catalog sync failed: {e}")
+
+    # 同步所有启用的脚本到调度器
+    async with AsyncSessionLocal() as db:
+        # 0. 重置所有处于 'running' / 'queued' 状态的脚本为 'idle' (因为容器重启了)
+        running_scripts = (await db.scalars(
+            select(models.Script).where(models.Script.last_status.in_(['running', 'queued']))
+        )).all()
         for script in running_scripts:
+            print(f"Reset script '{script.name}' status from '{script.last_status}' to 'idle' (container restart)")
             script.last_status = 'idle'
-            print(f"Reset script '{script.name}' status from 'running' to 'idle' (container restart)")
-        db.commit()
+        # 未正常结束的运行记录标记为失败
+        await db.execute(
+            update(models.ScriptRun).where(models.ScriptRun.status == 'running').values(status='failed')
+        )
+        await db.commit()
 
         # 1. 先同步磁盘文件
-        sync_scripts_from_disk(db)
+        await sync_scripts_from_disk(db)
         
         # 2. 获取所有脚本配置调度
-        scripts = db.query(models.Script).all()
+        scripts = (await db.scalars(select(models.Script))).all()
         print(f"Startup: Loaded {len(scripts)} scripts from database.")
         
         # 获取 TG 配置
-        bot_token = db.query(models.Setting).filter(models.Setting.key == "tg_bot_token").first()
-        chat_id = db.query(models.Setting).filter(models.Setting.key == "tg_chat_id").first()
-        
-        token_val = bot_token.value if bot_token else None
-        chat_val = chat_id.value if chat_id else None
+        token_val, chat_val = settings.telegram()
 
         for script in scripts:
             print(f" - Script: {script.name}, Enabled: {script.enabled}, AutoStart: {script.run_on_startup}, Cron: {script.cron}")
@@ -192,7 +212,9 @@ async def startup_event():
                     script.name,
                     token_val,
                     chat_val,
-                    script.arguments
+                    script.arguments,
+                    overlap_policy=script.overlap_policy,
+                    max_instances=script.max_instances
                 )
             
             # 处理开机自启 (即使 enabled=False，只要 run_on_startup=True 也可以启动，或者逻辑上强制 enabled)
@@ -200,18 +222,32 @@ async def startup_event():
             # 但用户反馈希望重启能记忆。如果他在前端只勾了 run_on_startup，那不管 enabled 怎么样都该跑。
             if script.run_on_startup:
                 is_daemon = (script.cron == "@daemon")
-                import asyncio
-                asyncio.create_task(scheduler.run_script(
+                scheduler.engine.submit(
                     script.id, 
                     script.path, 
                     script.name,
                     token_val,
                     chat_val,
                     script.arguments,
-                    is_daemon=is_daemon
-                ))
-    finally:
-        db.close()
+                    is_daemon=is_daemon,
+                    priority=scheduler.PRIORITY_STARTUP,
+                    source="startup",
+                    overlap_policy=script.overlap_policy,
+                    max_instances=script.max_instances
+                )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 取消正在运行的备份任务 (需在关闭 WebDAV 连接之前)
+    await backup_jobs.manager.stop()
+    # 发出积压的通知后关闭 Telegram / WebDAV 长连接
+    await notifier.stop()
+    await http_clients.close()
+    # 写入缓冲中的脚本状态
+    await status_buffer.stop()
+    await async_engine.dispose()
+    # 写完积压的脚本日志
+    log_writer.writer.close()
 
 # 允许跨域（虽然合并后不再必须，但保留以防万一）
 app.add_middleware(
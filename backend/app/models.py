@@ -1,9 +1,16 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Index
 from datetime import datetime
 from .database import Base
 
 class Script(Base):
     __tablename__ = "scripts"
+    __table_args__ = (
+        # 脚本列表的筛选 / 排序 (script_query)；单列索引隐含 rowid，可直接用于 (列, id) 的游标分页
+        Index("ix_scripts_last_status", "last_status"),
+        Index("ix_scripts_last_run", "last_run"),
+        Index("ix_scripts_enabled", "enabled"),
+        Index("ix_scripts_cron", "cron"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
@@ -16,10 +23,74 @@ class Script(Base):
     description = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_run = Column(DateTime, nullable=True)
-    last_status = Column(String, nullable=True)  # 'success', 'failed', 'running'
+    last_status = Column(String, nullable=True)  # 'success', 'failed', 'running', 'queued', 'stopped', 'limit_exceeded'
     last_output = Column(String, nullable=True)  # 存储脚本运行的输出日志
+    overlap_policy = Column(String, default='skip')  # 重叠运行策略: 'skip' / 'queue' / 'parallel'
+    max_instances = Column(Integer, default=1)  # parallel 策略下的最大并行实例数
+    warm_start = Column(Boolean, default=False)  # Python 脚本是否从预热的 forkserver 启动
+    # 资源限制 (为空表示不限制)
+    timeout_seconds = Column(Integer, nullable=True)  # 最大墙钟运行时间 (秒)
+    cpu_limit_seconds = Column(Integer, nullable=True)  # CPU 时间上限 (秒, RLIMIT_CPU)
+    memory_limit_mb = Column(Integer, nullable=True)  # 进程组常驻内存上限 (MB)
+    max_open_files = Column(Integer, nullable=True)  # 最大打开文件数 (RLIMIT_NOFILE)
+    nice_level = Column(Integer, nullable=True)  # CPU 调度优先级 (-20 ~ 19)
+    ionice_level = Column(Integer, nullable=True)  # I/O 优先级 (best-effort 0 ~ 7)
+    # 最近一次运行的资源占用摘要（完整记录见 ScriptRun）
+    last_duration = Column(Float, nullable=True)  # 墙钟耗时 (秒)
+    last_cpu_time = Column(Float, nullable=True)  # 用户态 + 内核态 CPU 时间 (秒)
+    last_max_rss_kb = Column(Integer, nullable=True)  # 峰值内存 (KB)
 
 class Setting(Base):
     __tablename__ = "settings"
     key = Column(String, primary_key=True)
-    value = Column(String)
\ No newline at end of file
+    value = Column(String)
+
+class ScriptRun(Base):
+    """每次运行的记录及资源占用"""
+    __tablename__ = "script_runs"
+    __table_args__ = (
+        # 按脚本分页查询运行历史
+        Index("ix_script_runs_script_id_started_at", "script_id", "started_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    script_id = Column(Integer)
+    started_at = Column(DateTime, default=datetime.now)  # 本地时间
+    finished_at = Column(DateTime, nullable=True)
+    status = Column(String, nullable=True, index=True)  # 'running', 'success', 'failed', 'stopped', 'limit_exceeded'
+    source = Column(String, nullable=True)  # 触发来源: 'manual' / 'cron' / 'startup' / 'telegram'
+    log_offset = Column(Integer, nullable=True)  # 本次运行日志的起始字节 (按运行分段存储后恒为 0)
+    log_end = Column(Integer, nullable=True)  # 本次运行日志的结束字节 (即各分段解压后的总长度)
+    limit_reason = Column(String, nullable=True)  # 被资源限制终止时的原因
+    exit_code = Column(Integer, nullable=True)
+    duration = Column(Float, nullable=True)  # 墙钟耗时 (秒)
+    cpu_user = Column(Float, nullable=True)  # 用户态 CPU 时间 (秒)
+    cpu_system = Column(Float, nullable=True)  # 内核态 CPU 时间 (秒)
+    max_rss_kb = Column(Integer, nullable=True)  # 峰值常驻内存 (KB)
+    io_read_blocks = Column(Integer, nullable=True)  # 块设备读次数
+    io_write_blocks = Column(Integer, nullable=True)  # 块设备写次数
+    ctx_voluntary = Column(Integer, nullable=True)  # 自愿上下文切换
+    ctx_involuntary = Column(Integer, nullable=True)  # 非自愿上下文切换
+
+class BackupRecord(Base):
+    """备份目录：每个备份归档一条记录 (backup_catalog)"""
+    __tablename__ = "backup_catalog"
+    __table_args__ = (
+        # 备份历史按时间倒序分页，保留策略按系列逐个计算
+        Index("ix_backup_catalog_created_at", "created_at"),
+        Index("ix_backup_catalog_series_created_at", "series", "backup_type", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, unique=True)
+    series = Column(String)  # 文件名中时间戳之前的前缀，如 scripts_backup / scripts_backup_incr / script_<名称>
+    backup_type = Column(String)  # 'local' / 'clouddrive'
+    incremental = Column(Boolean, default=False)
+    created_at = Column(DateTime)  # 本地时间，保留策略按本地日期划分每日 / 每周 / 每月
+    size = Column(Integer)  # 归档大小 (字节)
+    script_count = Column(Integer)
+    checksum = Column(String, nullable=True)  # 归档的 SHA-256
+    local_path = Column(String, nullable=True)  # 本地文件 (已删除时为空)
+    remote_url = Column(String, nullable=True)  # 上传到的 WebDAV 地址
+    remote_path = Column(String, nullable=True)  # WebDAV 上的路径 (未上传或已删除时为空)
+    chunks = Column(String, nullable=True)  # 增量快照引用的块 (JSON 列表)，用于清理远程不再被引用的块
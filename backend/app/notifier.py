@@ -0,0 +1,220 @@
+"""
+Telegram 通知发送队列：run_script / 健康检查只把消息放入队列，由后台协程负责发送，脚本收尾不再等待 Telegram。
+
+- 按 chat 限速 (TG_CHAT_MIN_INTERVAL_MS)，遇到 429 按 retry_after 等待后重试，网络错误和 5xx 指数退避重试
+- 运行结果通知在 tg_digest_window_seconds 秒窗口内合并：窗口内只有一条时原样发送，多条时发送一条汇总
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from . import http_clients
+from .settings_cache import settings
+
+logger = logging.getLogger(__name__)
+
+# 同一 chat 两条消息之间的最小间隔 (Telegram 对单个 chat 约每秒 1 条)
+CHAT_MIN_INTERVAL = int(os.getenv("TG_CHAT_MIN_INTERVAL_MS", "1000")) / 1000
+# 单条消息最多重试次数
+MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "5"))
+# 队列中最多积压的消息数，超出后丢弃新消息
+QUEUE_MAX = int(os.getenv("TG_QUEUE_MAX", "1000"))
+# 运行结果合并窗口默认值，可通过设置项 tg_digest_window_seconds 覆盖 (0 表示不合并)
+DEFAULT_DIGEST_WINDOW_SECONDS = 10
+# Telegram 单条消息长度上限 4096，留出余量
+MESSAGE_LIMIT = 4000
+
+
+@dataclass
+class Notification:
+    bot_token: str
+    chat_id: str
+    text: str
+    # 以下字段仅运行结果通知有，用于合并汇总
+    script_name: Optional[str] = None
+    status: Optional[str] = None
+    duration: Optional[str] = None
+
+    @property
+    def digestable(self) -> bool:
+        return self.status is not None
+
+
+def build_digest(items: List[Notification]) -> str:
+    """把窗口内的多条运行结果合并成一条汇总消息"""
+    succeeded = [n for n in items if n.status == "success"]
+    failed = [n for n in items if n.status != "success"]
+    lines = [f"📊 脚本运行汇总 ({len(items)} 次)", f"✅ 成功 {len(succeeded)} 个，❌ 失败 {len(failed)} 个"]
+    if failed:
+        lines.append("")
+        lines.append("失败:")
+        lines.extend(f"• {n.script_name}: {n.status} ({n.duration})" for n in failed)
+    if succeeded:
+        lines.append("")
+        lines.append("成功: " + ", ".join(n.script_name for n in succeeded))
+    text = "\n".join(lines)
+    if len(text) > MESSAGE_LIMIT:
+        text = text[:MESSAGE_LIMIT - 20] + "\n... (已截断)"
+    return text
+
+
+class Notifier:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+        # (bot_token, chat_id) -> (窗口截止时间, 待合并的运行结果)
+        self._digests: Dict[Tuple[str, str], Tuple[float, List[Notification]]] = {}
+        self._next_send: Dict[Tuple[str, str], float] = {}  # (bot_token, chat_id) -> 下一条允许发送的时间
+        self.queued = 0
+        self.sent = 0
+        self.digests = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        """在事件循环中启动发送协程"""
+        if self._sender and not self._sender.done():
+            return
+        self._queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        self._sender = asyncio.create_task(self._send_loop())
+
+    async def stop(self, timeout: float = 5.0):
+        """发出已合并的汇总和队列中剩余的消息 (最多等待 timeout 秒) 后停止"""
+        if not self._sender:
+            return
+        self._sender.cancel()
+        try:
+            await self._sender
+        except asyncio.CancelledError:
+            pass
+        self._sender = None
+        pending = [self._queue.get_nowait() for _ in range(self._queue.qsize())]
+        try:
+            await asyncio.wait_for(self._drain(pending), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Notifier stopped with undelivered Telegram messages")
+
+    async def _drain(self, pending: List[Notification]):
+        for key in list(self._digests):
+            await self._flush(key)
+        for item in pending:
+            await self._deliver(item.bot_token, item.chat_id, item.text)
+
+    def enqueue(self, text: str, bot_token: str, chat_id: str, script_name: str = None,
+                status: str = None, duration: str = None):
+        """放入发送队列 (非阻塞)；带 status 的运行结果通知参与合并"""
+        if not bot_token or not chat_id:
+            return
+        self.start()
+        try:
+            self._queue.put_nowait(Notification(bot_token, chat_id, text, script_name, status, duration))
+            self.queued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Telegram notification queue full, message dropped")
+
+    async def _send_loop(self):
+        while True:
+            try:
+                timeout = None
+                if self._digests:
+                    timeout = max(0.0, min(deadline for deadline, _ in self._digests.values()) - time.monotonic())
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    item = None
+
+                if item is not None:
+                    window = settings.get_int("tg_digest_window_seconds", DEFAULT_DIGEST_WINDOW_SECONDS)
+                    if item.digestable and window > 0:
+                        key = (item.bot_token, item.chat_id)
+                        if key not in self._digests:
+                            self._digests[key] = (time.monotonic() + window, [])
+                        self._digests[key][1].append(item)
+                    else:
+                        await self._deliver(item.bot_token, item.chat_id, item.text)
+
+                now = time.monotonic()
+                for key in [k for k, (deadline, _) in self._digests.items() if deadline <= now]:
+                    await self._flush(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notifier loop error: {e}")
+
+    async def _flush(self, key: Tuple[str, str]):
+        _, items = self._digests.pop(key)
+        if len(items) == 1:
+            await self._deliver(*key, items[0].text)
+            return
+        self.digests += 1
+        self.coalesced += len(items)
+        await self._deliver(*key, build_digest(items))
+
+    async def _deliver(self, bot_token: str, chat_id: str, text: str) -> bool:
+        """按 chat 限速发送一条消息，处理 429 和临时错误"""
+        key = (bot_token, chat_id)
+        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        backoff = 1.0
+        for attempt in range(MAX_RETRIES + 1):
+            wait = self._next_send.get(key, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_send[key] = time.monotonic() + CHAT_MIN_INTERVAL
+            if attempt:
+                self.retries += 1
+
+            client = http_clients.telegram.get(settings.get("tg_proxy"))
+            try:
+                resp = await client.post(url, json={"chat_id": chat_id, "text": text})
+            except Exception as e:
+                logger.warning(f"Failed to send TG notification (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(backoff)
+                backoff *= 2
+                continue
+
+            if resp.status_code == 200:
+                self.sent += 1
+                return True
+            if resp.status_code == 429:
+                self.rate_limited += 1
+                try:
+                    retry_after = float(resp.json().get("parameters", {}).get("retry_after", 1))
+                except Exception:
+                    retry_after = backoff
+                logger.warning(f"TG rate limited, retrying after {retry_after}s")
+                self._next_send[key] = time.monotonic() + retry_after
+                continue
+            if resp.status_code >= 500:
+                await asyncio.sleep(backoff)
+                backoff *= 2
+                continue
+            # 其他 4xx (token / chat 错误等) 重试无意义
+            logger.error(f"TG notification rejected: {resp.status_code} {resp.text[:200]}")
+            break
+
+        self.failed += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "pending_digest": sum(len(items) for _, items in self._digests.values()),
+            "queued": self.queued,
+            "sent": self.sent,
+            "digests": self.digests,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+notifier = Notifier()
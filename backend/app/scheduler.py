@@ -2,12 +2,21 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 import asyncio
 import os
+import signal
 import datetime
-import httpx
 import logging
 import shlex
-from .database import SessionLocal
-from . import models
+import time
+import itertools
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+from sqlalchemy import select, delete
+from .database import AsyncSessionLocal
+from . import models, warm_runner, spawner, log_writer, log_store, http_clients
+from .settings_cache import settings
+from .notifier import notifier
+from .status_buffer import status_buffer
 
 scheduler = AsyncIOScheduler(
     job_defaults={
@@ -17,11 +26,25 @@ scheduler = AsyncIOScheduler(
 )
 logger = logging.getLogger(__name__)
 
-# 全局字典存储运行中的进程: script_id -> subprocess.Process
+# 全局字典存储运行中的进程: script_id -> [subprocess.Process, ...] (允许并行实例)
 RUNNING_TASKS = {}
 
-# 日志目录
-LOG_DIR = "/data/logs"
+# 重叠运行策略: 上一次运行尚未结束时如何处理新的运行请求
+OVERLAP_SKIP = "skip"          # 直接跳过
+OVERLAP_QUEUE = "queue"        # 保留一个待运行请求，上一次结束后立即执行（多余请求合并）
+OVERLAP_PARALLEL = "parallel"  # 允许最多 max_instances 个实例并行，超出部分同 queue
+OVERLAP_POLICIES = (OVERLAP_SKIP, OVERLAP_QUEUE, OVERLAP_PARALLEL)
+
+# 旧版日志目录 (每个脚本一个 <basename>.log，现已改为 log_store 分段存储)
+LOG_DIR = log_store.LOG_DIR
+
+# 执行优先级：数值越小越先出队（手动触发可以插队到定时任务之前）
+PRIORITY_MANUAL = 0
+PRIORITY_STARTUP = 10
+PRIORITY_CRON = 20
+
+# 默认最大并发子进程数，可通过环境变量或设置项 max_concurrent_scripts 覆盖
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENT_SCRIPTS", str(max(2, os.cpu_count() or 2))))
 
 def get_log_filename(script_path: str) -> str:
     """根据脚本路径生成日志文件名（使用脚本文件名，去掉扩展名）"""
@@ -30,108 +53,134 @@ def get_log_filename(script_path: str) -> str:
     return f"{name_without_ext}.log"
 
 def get_log_path(script_path: str) -> str:
-    """获取脚本对应的日志文件完整路径"""
-    os.makedirs(LOG_DIR, exist_ok=True)
+    """旧版单文件日志的路径，仅用于清理升级前遗留的日志"""
     return os.path.join(LOG_DIR, get_log_filename(script_path))
 
-async def notify_telegram(message: str, bot_token: str, chat_id: str):
+def _append_log(script_id: int, text: str):
+    """向脚本正在运行的实例日志追加一段提示"""
+    log_store.append_note(script_id, text)
+
+async def notify_telegram(message: str, bot_token: str, chat_id: str, proxy: Optional[str] = None):
+    """
+    立即发送一条消息 (连通性测试等需要同步结果的场景)，其他通知走 notifier 队列。
+    发送失败 (网络错误或 Telegram 返回非 2xx) 时抛出异常；proxy 为 None 时使用设置中的代理
+    """
     if not bot_token or not chat_id:
-        return
-    
-    # 获取代理配置
-    db = SessionLocal()
-    proxy_setting = db.query(models.Setting).filter(models.Setting.key == "tg_proxy").first()
-    proxy = proxy_setting.value if proxy_setting and proxy_setting.value else None
-    db.close()
+        raise ValueError("Bot Token 和 Chat ID 不能为空")
+
+    if proxy is None:
+        proxy = settings.get("tg_proxy")
+    proxy = proxy or None
 
     url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    
-    # httpx proxy 参数
-    proxies = proxy if proxy else None
-    
-    logger.info(f"Sending TG message via proxy: {proxies}")
-    async with httpx.AsyncClient(proxy=proxies) as client:
+
+    logger.info(f"Sending TG message via proxy: {proxy}")
+    client = http_clients.telegram.get(proxy)
+    resp = await client.post(url, json={"chat_id": chat_id, "text": message})
+    if not resp.is_success:
         try:
-            await client.post(url, json={"chat_id": chat_id, "text": message})
-        except Exception as e:
-            logger.error(f"Failed to send TG notification: {e}")
+            description = resp.json().get("description")
+        except Exception:
+            description = resp.text[:200]
+        logger.error(f"TG message rejected: {resp.status_code} {description}")
+        raise RuntimeError(f"Telegram API {resp.status_code}: {description}")
+
+async def _terminate_process_group(script_id: int, process) -> bool:
+    """向进程组发送 SIGTERM，3 秒未退出则升级为 SIGKILL"""
+    # 检查进程是否仍在运行
+    if process.returncode is not None:
+        logger.info(f"Script {script_id} already finished with code {process.returncode}")
+        return True
+
+    # 获取进程组ID (等于进程PID，因为我们使用了 start_new_session=True)
+    pgid = process.pid
+
+    # 发送 SIGTERM 到整个进程组，一次性终止所有子进程
+    logger.info(f"Sending SIGTERM to process group {pgid} for script {script_id}")
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        logger.info(f"Process group {pgid} already terminated")
+        return True
+
+    # 等待进程结束，最多3秒
+    try:
+        await asyncio.wait_for(process.wait(), timeout=3.0)
+        logger.info(f"Script {script_id} terminated gracefully")
+        return True
+    except asyncio.TimeoutError:
+        # 强制杀死整个进程组
+        logger.warning(f"Script {script_id} did not terminate, sending SIGKILL to process group")
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), timeout=2.0)
+        except Exception as kill_err:
+            logger.error(f"Error force killing script {script_id}: {kill_err}")
+        return True
+
+# 脚本资源限制字段 (models.Script 上的同名列，None 表示不限制)
+LIMIT_FIELDS = ("timeout_seconds", "cpu_limit_seconds", "memory_limit_mb", "max_open_files", "nice_level", "ionice_level")
+
+def script_limits(script) -> dict:
+    if script is None:
+        return {}
+    return {field: getattr(script, field, None) for field in LIMIT_FIELDS}
+
+async def _enforce_timeout(script_id: int, process, timeout: float, violation: dict):
+    """看门狗：超过墙钟时间时，复用 stop_script 的 SIGTERM → SIGKILL 流程终止进程组"""
+    await asyncio.sleep(max(0, timeout - (time.monotonic() - process.started_at)))
+    if process.returncode is None and not violation:
+        violation["reason"] = f"wall time exceeded {timeout}s"
+        logger.warning(f"Script {script_id} killed by resource limit: {violation['reason']}")
+        await _terminate_process_group(script_id, process)
 
 async def stop_script(script_id: int):
-    """停止正在运行的脚本"""
-    import signal
+    """停止正在运行的脚本（包括所有并行实例和排队中的请求）"""
+    # 先取消尚在排队的请求
+    cancelled = engine.cancel(script_id)
 
-    if script_id not in RUNNING_TASKS:
+    processes = list(RUNNING_TASKS.get(script_id, []))
+    if not processes:
+        if cancelled:
+            return True
         logger.warning(f"Script {script_id} not found in RUNNING_TASKS")
         return False
 
     try:
-        process = RUNNING_TASKS[script_id]
-
-        # 检查进程是否仍在运行
-        if process.returncode is not None:
-            logger.info(f"Script {script_id} already finished with code {process.returncode}")
-            return True
-
-        # 获取进程组ID (等于进程PID，因为我们使用了 start_new_session=True)
-        pgid = process.pid
-
-        # 发送 SIGTERM 到整个进程组，一次性终止所有子进程
-        logger.info(f"Sending SIGTERM to process group {pgid} for script {script_id}")
-        try:
-            os.killpg(pgid, signal.SIGTERM)
-        except ProcessLookupError:
-            logger.info(f"Process group {pgid} already terminated")
-            return True
-
-        # 等待进程结束，最多3秒
-        try:
-            await asyncio.wait_for(process.wait(), timeout=3.0)
-            logger.info(f"Script {script_id} terminated gracefully")
-            return True
-        except asyncio.TimeoutError:
-            # 强制杀死整个进程组
-            logger.warning(f"Script {script_id} did not terminate, sending SIGKILL to process group")
-            try:
-                os.killpg(pgid, signal.SIGKILL)
-            except ProcessLookupError:
-                pass
-            try:
-                await asyncio.wait_for(process.wait(), timeout=2.0)
-            except Exception as kill_err:
-                logger.error(f"Error force killing script {script_id}: {kill_err}")
-            return True
+        results = await asyncio.gather(*[_terminate_process_group(script_id, p) for p in processes])
+        return all(results)
     except Exception as e:
         logger.error(f"Error stopping script {script_id}: {type(e).__name__}: {e}")
         import traceback
         traceback.print_exc()
         return False
 
-async def run_script(script_id: int, script_path: str, script_name: str, bot_token: str = None, chat_id: str = None, arguments: str = None, is_daemon: bool = False):
-    # 准备日志文件 - 使用脚本文件名作为日志名
-    log_file_path = get_log_path(script_path)
-    start_time = datetime.datetime.now()
+def running_instances(script_id: int, exclude=None) -> int:
+    """某脚本当前存活的进程数 (exclude 为不计入的进程)"""
+    return sum(1 for p in RUNNING_TASKS.get(script_id, []) if p.returncode is None and p is not exclude)
 
-    # 立即创建/更新日志文件，记录启动信息
-    with open(log_file_path, "a") as log_file:
-        log_file.write(f"\n\n{'='*20} Starting at {start_time} {'='*20}\n")
-        log_file.flush()
-
-    # 如果已经在运行，先不重复启动（或者是重启？这里策略是单实例运行）
-    if script_id in RUNNING_TASKS:
-        if RUNNING_TASKS[script_id].returncode is None:
-            logger.warning(f"Script {script_name} is already running.")
-            with open(log_file_path, "a") as log_file:
-                log_file.write(f"Error: Script is already running, skipped.\n")
-            return
+async def run_script(script_id: int, script_path: str, script_name: str, bot_token: str = None, chat_id: str = None, arguments: str = None, is_daemon: bool = False, source: str = "manual"):
+    start_time = datetime.datetime.now()
 
     logger.info(f"Starting script: {script_name} (Daemon: {is_daemon})")
-
-    db = SessionLocal()
-    script = db.query(models.Script).filter(models.Script.id == script_id).first()
-    if script:
-        script.last_status = "running"
-        script.last_run = start_time
-        db.commit()
+    process = None
+
+    async with AsyncSessionLocal() as db:
+        script = await db.get(models.Script, script_id)
+        # 记录本次运行 (需要立即拿到 run_id)，脚本状态交给 status_buffer 批量写入
+        run = models.ScriptRun(script_id=script_id, started_at=start_time, status="running", source=source,
+                               log_offset=0)
+        db.add(run)
+        await db.commit()
+        run_id = run.id
+    status_buffer.update_script(script_id, last_status="running", last_run=start_time)
+
+    # 每次运行写入独立的日志分段，由 log_writer 后台线程批量落盘
+    run_log = log_store.open_run(script_id, run_id)
+    run_log.write(f"\n\n{'='*20} Starting at {start_time} {'='*20}\n")
 
     try:
         # 检查脚本文件是否存在
@@ -150,118 +199,488 @@ async def run_script(script_id: int, script_path: str, script_name: str, bot_tok
             program = "stdbuf"
             cmd_args.extend(["-oL", "-eL", "bash", script_path])
 
-        if arguments:
-            args_list = shlex.split(arguments)
-            cmd_args.extend(args_list)
+        args_list = shlex.split(arguments) if arguments else []
+        cmd_args.extend(args_list)
 
-        logger.info(f"Executing command: {program} {' '.join(cmd_args)}")
+        # Python 脚本开启预热启动且 forkserver 可用时，从 forkserver fork 运行
+        use_warm = (script_path.endswith('.py') and script is not None and script.warm_start
+                    and warm_runner.runner.available)
+        mode = " (warm runner)" if use_warm else ""
+
+        logger.info(f"Executing command: {program} {' '.join(cmd_args)}{mode}")
 
         # 记录执行命令到日志
-        with open(log_file_path, "a") as log_file:
-            log_file.write(f"Command: {program} {' '.join(cmd_args)}\n")
-            log_file.flush()
-            
-        # 启动进程，重定向 stdout 和 stderr 到 PIPE
-        # 使用 start_new_session=True 创建新的进程组，便于一次性终止所有子进程
-        process = await asyncio.create_subprocess_exec(
-            program, *cmd_args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,  # 合并 stderr 到 stdout
-            start_new_session=True  # 创建新会话/进程组
-        )
-        
-        RUNNING_TASKS[script_id] = process
+        run_log.write(f"Command: {program} {' '.join(cmd_args)}{mode}\n")
 
-        # 检查日志文件大小，如果超过 1MB 则截断清理旧日志
-        if os.path.exists(log_file_path) and os.path.getsize(log_file_path) > 1 * 1024 * 1024:
-            with open(log_file_path, "w") as f:
-                f.write(f"=== Log rotated at {start_time} ===\n")
+        limits = script_limits(script)
 
-        # 实时读取日志并写入文件 (使用追加模式)
-        with open(log_file_path, "a", buffering=1) as log_file: # Line buffering
-            log_file.write(f"Process started (PID: {process.pid})\n")
-            
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
-                decoded_line = line.decode('utf-8', errors='replace')
-                log_file.write(decoded_line)
-                # 可以在这里做 WebSocket 广播，但更简单的是前端通过 WS 读取文件
+        if use_warm:
+            try:
+                process = await warm_runner.runner.spawn(script_path, args_list, limits)
+            except Exception as e:
+                warm_runner.runner.fallbacks += 1
+                logger.warning(f"Warm start of {script_name} failed, falling back to cold start: {e}")
+
+        if process is None:
+            # 启动进程，stdout 和 stderr 合并到管道，并创建新的进程组，便于一次性终止所有子进程
+            # 由 spawner 自行回收进程，以便拿到整个进程组的 rusage
+            # 资源限制在 exec 前设置 (见 spawner.limit_prefix)
+            process = await spawner.spawn(program, cmd_args, limits)
+        
+        RUNNING_TASKS.setdefault(script_id, []).append(process)
+
+        # 峰值内存和内存上限由所有运行共用的 spawner.monitor 采样，墙钟超时由看门狗协程监控，超限时终止整个进程组
+        violation = {}
+        terminating = []
+        memory_limit_mb = limits.get("memory_limit_mb")
+
+        def on_memory_exceeded(rss_kb: int):
+            if violation:
+                return
+            violation["reason"] = f"memory {rss_kb // 1024} MB exceeded {memory_limit_mb} MB"
+            logger.warning(f"Script {script_id} killed by resource limit: {violation['reason']}")
+            terminating.append(asyncio.ensure_future(_terminate_process_group(script_id, process)))
+
+        spawner.monitor.track(process, memory_limit_mb * 1024 if memory_limit_mb else None, on_memory_exceeded)
+        watchdog = None
+        if limits.get("timeout_seconds"):
+            watchdog = asyncio.create_task(_enforce_timeout(script_id, process, limits["timeout_seconds"], violation))
+
+        # 按块读取输出交给后台线程批量写盘，事件循环不做同步文件写入
+        run_log.write(f"Process started (PID: {process.pid})\n")
+        await log_writer.capture(process.stdout, run_log.write)
         
         await process.wait()
+        if watchdog is not None:
+            watchdog.cancel()
+        spawner.monitor.untrack(process)
+        if terminating:
+            await asyncio.gather(*terminating)
         
+        # 资源占用
+        finished_at = datetime.datetime.now()
+        usage = dict(process.rusage or {})
+        duration = process.wall_time if process.wall_time is not None else (finished_at - start_time).total_seconds()
+        cpu_time = usage.get("cpu_user", 0) + usage.get("cpu_system", 0) if usage else None
+        # 预热启动的子进程由 forkserver 回收，rusage 中的峰值内存准确；冷启动的 ru_maxrss 含父进程的内存，
+        # 只能取 spawner.monitor 的采样值 (近似值，结束前的短暂峰值可能漏掉)
+        rss_sampled = "max_rss_kb" not in usage
+        if usage:
+            usage["max_rss_kb"] = max(usage.get("max_rss_kb") or 0, process.peak_rss_kb or 0) or None
+
         # 进程结束
         return_code = process.returncode
         status = "success" if return_code == 0 else "failed"
         if return_code == -15: # SIGTERM
             status = "stopped"
 
+        # 超出 CPU 时间限制时内核发送 SIGXCPU，硬限制时 SIGKILL
+        cpu_limit = limits.get("cpu_limit_seconds")
+        if not violation and cpu_limit and (
+            return_code == -signal.SIGXCPU or (return_code == -signal.SIGKILL and (cpu_time or 0) >= cpu_limit)
+        ):
+            violation["reason"] = f"cpu time exceeded {cpu_limit}s"
+        if violation:
+            status = "limit_exceeded"
+
         # 再次写入结束标记
-        with open(log_file_path, "a") as log_file:
-            log_file.write(f"\n=== Finished at {datetime.datetime.now()} with status: {status} ===\n")
-
-        # 更新数据库
-        # 需要重新创建 session，因为之前的 session 可能太久了
-        db.close()
-        db = SessionLocal()
-        script = db.query(models.Script).filter(models.Script.id == script_id).first()
-        if script:
-            script.last_status = status
-            # 读取最后的日志存入 last_output (为了历史查看)
-            try:
-                with open(log_file_path, "r") as f:
-                    # 只存最后 5000 字符到数据库
-                    f.seek(0, 2)
-                    size = f.tell()
-                    f.seek(max(size - 5000, 0))
-                    script.last_output = f.read()
-            except:
-                pass
-            db.commit()
+        footer = ""
+        if violation:
+            footer += f"\n=== Killed by resource limit: {violation['reason']} ==="
+        footer += f"\n=== Finished at {finished_at} with status: {status} ===\n"
+        if usage:
+            rss_label = "sampled peak rss" if rss_sampled else "max rss"
+            footer += (f"=== Resources: wall {duration:.2f}s, cpu {cpu_time:.2f}s, "
+                       f"{rss_label} {usage.get('max_rss_kb') or 0} KB ===\n")
+        run_log.write(footer)
+        log_end = await run_log.sync()
+        # 最后 5000 字节存入 last_output (为了历史查看)，直接取自内存尾部缓冲
+        last_output = (await log_store.read_tail(script_id, 5000, run_id)).decode("utf-8", errors="replace")
+
+        # 更新数据库 (由 status_buffer 与其他运行的状态变化合并写入)
+        status_buffer.update_run(
+            run_id, finished_at=finished_at, status=status, exit_code=return_code, duration=round(duration, 3),
+            limit_reason=violation.get("reason"), log_end=log_end, **usage
+        )
+        status_buffer.update_script(
+            script_id,
+            # 还有其他并行实例在运行时保持 running 状态
+            last_status="running" if running_instances(script_id) > 0 else status,
+            last_duration=round(duration, 3),
+            last_cpu_time=round(cpu_time, 3) if cpu_time is not None else None,
+            last_max_rss_kb=usage.get("max_rss_kb"),
+            last_output=last_output,
+        )
             
         logger.info(f"Script {script_name} finished with status: {status}")
 
         if bot_token and chat_id and not is_daemon:
             # 检查是否仅失败时通知
-            notify_on_failure_only_setting = db.query(models.Setting).filter(
-                models.Setting.key == "tg_notify_on_failure_only"
-            ).first()
-            notify_on_failure_only = notify_on_failure_only_setting and notify_on_failure_only_setting.value == 'true'
+            notify_on_failure_only = settings.get_bool("tg_notify_on_failure_only")
 
             # 如果开启了仅失败通知，且状态是成功，则跳过通知
             if notify_on_failure_only and status == "success":
                 logger.info(f"Skipping success notification for {script_name} (notify_on_failure_only enabled)")
             else:
-                msg = f"🚀 脚本: {script_name}\n状态: {status}\n耗时: {datetime.datetime.now() - start_time}"
-                await notify_telegram(msg, bot_token, chat_id)
+                elapsed = datetime.datetime.now() - start_time
+                msg = f"🚀 脚本: {script_name}\n状态: {status}\n耗时: {elapsed}"
+                notifier.enqueue(msg, bot_token, chat_id, script_name=script_name, status=status,
+                                 duration=str(elapsed))
             
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         logger.error(f"Error running script {script_name}: {e}\n{error_details}")
         # 写入错误日志
-        with open(log_file_path, "a") as log_file:
-            log_file.write(f"\n=== Internal Error ===\n")
-            log_file.write(f"Error: {e}\n")
-            log_file.write(f"Details:\n{error_details}\n")
-            log_file.flush()
+        run_log.write(f"\n=== Internal Error ===\nError: {e}\nDetails:\n{error_details}\n")
+        log_end = await run_log.sync()
 
         # 更新数据库状态
-        try:
-            db.rollback()  # 回滚可能的未提交事务
-            script = db.query(models.Script).filter(models.Script.id == script_id).first()
-            if script:
-                script.last_status = "failed"
-                db.commit()
-        except Exception as db_err:
-            logger.error(f"Failed to update script status: {db_err}")
+        finished_at = datetime.datetime.now()
+        # 与正常结束一致：还有其他并行实例在运行时保持 running 状态 (本次进程可能尚未退出，不计入)
+        status_buffer.update_script(
+            script_id, last_status="running" if running_instances(script_id, exclude=process) > 0 else "failed"
+        )
+        status_buffer.update_run(run_id, status="failed", finished_at=finished_at, log_end=log_end,
+                                 duration=round((finished_at - start_time).total_seconds(), 3))
     finally:
-        if script_id in RUNNING_TASKS:
-            del RUNNING_TASKS[script_id]
-        db.close()
+        if process is not None:
+            spawner.monitor.untrack(process)
+        if process is not None and process in RUNNING_TASKS.get(script_id, []):
+            RUNNING_TASKS[script_id].remove(process)
+            if not RUNNING_TASKS[script_id]:
+                del RUNNING_TASKS[script_id]
+        # 关闭并压缩最后一个日志分段
+        await run_log.close()
+
+@dataclass
+class RunRequest:
+    """一次待执行的运行请求"""
+    script_id: int
+    script_path: str
+    script_name: str
+    bot_token: Optional[str] = None
+    chat_id: Optional[str] = None
+    arguments: Optional[str] = None
+    is_daemon: bool = False
+    overlap_policy: str = OVERLAP_SKIP
+    max_instances: int = 1
+    priority: int = PRIORITY_CRON
+    source: str = "cron"  # 'cron' / 'manual' / 'telegram' / 'startup'
+    enqueued_at: float = field(default_factory=time.monotonic)
+    cancelled: bool = False
+    queued: bool = False  # 提交时并发已满，脚本状态已标记为 queued
+
+
+class ExecutionEngine:
+    """
+    全局执行引擎：所有运行请求先进入优先级队列，再由单个分发协程按并发上限派发给 run_script。
+
+    常驻脚本 (@daemon) 会一直运行，不占用执行槽位，直接启动。
+
+    脚本的 queued / running 状态由引擎在提交和派发时更新 (status_buffer)，HTTP、Telegram 和定时触发的运行都一样。
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.active = 0
+        self.active_daemons = 0
+        self.total_dispatched = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._slot_freed: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._seq = itertools.count()
+        self._pending = {}  # script_id -> [RunRequest]
+        self._running = {}  # script_id -> 已派发且未结束的实例数
+        self._deferred = {}  # script_id -> RunRequest，等待上一实例结束的唯一待运行请求
+        self.skipped = 0
+        self.coalesced = 0
+        self._wait_times = deque(maxlen=200)  # 最近派发请求的排队耗时 (秒)
+
+    def start(self):
+        """在事件循环中启动分发协程"""
+        if self._dispatcher and not self._dispatcher.done():
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._slot_freed = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        logger.info(f"Execution engine started (max concurrency: {self.max_concurrency})")
+
+    async def stop(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    def set_max_concurrency(self, value: int):
+        self.max_concurrency = max(1, int(value))
+        logger.info(f"Execution engine max concurrency set to {self.max_concurrency}")
+        if self._slot_freed:
+            self._slot_freed.set()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(reqs) for reqs in self._pending.values())
+
+    def is_saturated(self) -> bool:
+        """当前提交的请求是否需要排队"""
+        return self.active >= self.max_concurrency or self.queue_depth > 0
+
+    def submit(self, script_id: int, script_path: str, script_name: str, bot_token: str = None,
+               chat_id: str = None, arguments: str = None, is_daemon: bool = False,
+               priority: int = PRIORITY_CRON, source: str = "cron",
+               overlap_policy: str = OVERLAP_SKIP, max_instances: int = 1) -> RunRequest:
+        """提交运行请求（非阻塞）"""
+        if overlap_policy not in OVERLAP_POLICIES:
+            overlap_policy = OVERLAP_SKIP
+        req = RunRequest(script_id, script_path, script_name, bot_token, chat_id, arguments,
+                         is_daemon, overlap_policy, max(1, max_instances or 1), priority, source)
+
+        if is_daemon:
+            # 常驻脚本不进入队列，避免长期占用执行槽位
+            if self._admit(req):
+                self._running[script_id] = self._running.get(script_id, 0) + 1
+                status_buffer.update_script(script_id, last_status="running")
+                asyncio.create_task(self._execute(req, uses_slot=False))
+            return req
+
+        # 排队中的请求同样计入，避免并发已满时同一脚本在队列里无限堆积
+        limit = req.max_instances if req.overlap_policy == OVERLAP_PARALLEL else 1
+        outstanding = (self._running.get(script_id, 0) + len(self._pending.get(script_id, []))
+                       + (1 if script_id in self._deferred else 0))
+        if outstanding >= limit:
+            if req.overlap_policy == OVERLAP_SKIP:
+                self.skipped += 1
+                logger.warning(f"Script {script_name} is already running or queued, skipped.")
+                _append_log(script_id, "Error: Script is already running, skipped.\n")
+                return req
+            if outstanding > limit:
+                self.coalesced += 1
+                logger.info(f"Script {script_name} already has a pending run, coalesced.")
+                return req
+
+        self._enqueue(req)
+        return req
+
+    def _enqueue(self, req: RunRequest):
+        if self._queue is None:
+            self.start()
+
+        # 并发未满时请求马上会被派发，直接标记为 running，避免界面先闪一下 queued；已有实例在运行时保持 running
+        if not self._running.get(req.script_id):
+            req.queued = self.is_saturated()
+            status_buffer.update_script(req.script_id, last_status="queued" if req.queued else "running")
+        self._pending.setdefault(req.script_id, []).append(req)
+        self._queue.put_nowait((req.priority, next(self._seq), req))
+        logger.info(f"Queued script {req.script_name} (source: {req.source}, priority: {req.priority}, depth: {self.queue_depth})")
+
+    def _admit(self, req: RunRequest) -> bool:
+        """按重叠策略判断请求能否立即启动；不能启动时跳过或合并为一个待运行请求"""
+        running = self._running.get(req.script_id, 0)
+        limit = req.max_instances if req.overlap_policy == OVERLAP_PARALLEL else 1
+        if running < limit:
+            return True
+
+        if req.overlap_policy == OVERLAP_SKIP:
+            self.skipped += 1
+            logger.warning(f"Script {req.script_name} is already running, skipped.")
+            _append_log(req.script_id, "Error: Script is already running, skipped.\n")
+        elif req.script_id in self._deferred:
+            # 已有待运行请求，新的请求与之合并
+            self.coalesced += 1
+            logger.info(f"Script {req.script_name} already has a pending run, coalesced.")
+        else:
+            self._deferred[req.script_id] = req
+            logger.info(f"Script {req.script_name} is running, deferred until the current run finishes.")
+        return False
+
+    def cancel(self, script_id: int) -> int:
+        """取消某脚本所有尚未开始的排队/待运行请求，返回取消数量"""
+        reqs = self._pending.pop(script_id, [])
+        deferred = self._deferred.pop(script_id, None)
+        if deferred:
+            reqs.append(deferred)
+        for req in reqs:
+            req.cancelled = True
+        if reqs:
+            logger.info(f"Cancelled {len(reqs)} queued run(s) of script {script_id}")
+            if not self._running.get(script_id):
+                status_buffer.update_script(script_id, last_status="stopped")
+        return len(reqs)
+
+    def is_queued(self, script_id: int) -> bool:
+        return bool(self._pending.get(script_id)) or script_id in self._deferred
+
+    async def _dispatch_loop(self):
+        while True:
+            # 先等空闲槽位，再出队，保证出队时拿到的是当下优先级最高的请求
+            while self.active >= self.max_concurrency:
+                self._slot_freed.clear()
+                await self._slot_freed.wait()
+
+            _, _, req = await self._queue.get()
+            if req.cancelled:
+                continue
+
+            pending = self._pending.get(req.script_id)
+            if pending and req in pending:
+                pending.remove(req)
+                if not pending:
+                    del self._pending[req.script_id]
+
+            if not self._admit(req):
+                continue
+
+            self.active += 1
+            self._running[req.script_id] = self._running.get(req.script_id, 0) + 1
+            if req.queued:
+                status_buffer.update_script(req.script_id, last_status="running")
+            asyncio.create_task(self._execute(req, uses_slot=True))
+
+    async def _execute(self, req: RunRequest, uses_slot: bool):
+        wait = time.monotonic() - req.enqueued_at
+        self._wait_times.append(wait)
+        self.total_dispatched += 1
+        if not uses_slot:
+            self.active_daemons += 1
+        try:
+            await run_script(req.script_id, req.script_path, req.script_name, req.bot_token,
+                             req.chat_id, req.arguments, is_daemon=req.is_daemon, source=req.source)
+        except Exception as e:
+            logger.error(f"Execution engine: run of {req.script_name} raised {type(e).__name__}: {e}")
+        finally:
+            if uses_slot:
+                self.active -= 1
+                if self._slot_freed:
+                    self._slot_freed.set()
+            else:
+                self.active_daemons -= 1
+
+            remaining = self._running.get(req.script_id, 1) - 1
+            if remaining > 0:
+                self._running[req.script_id] = remaining
+            else:
+                self._running.pop(req.script_id, None)
+
+            # 上一实例结束，释放等待中的请求
+            deferred = self._deferred.pop(req.script_id, None)
+            if deferred and not deferred.cancelled:
+                if deferred.is_daemon:
+                    self.submit(deferred.script_id, deferred.script_path, deferred.script_name,
+                                deferred.bot_token, deferred.chat_id, deferred.arguments, True,
+                                deferred.priority, deferred.source, deferred.overlap_policy,
+                                deferred.max_instances)
+                else:
+                    self._enqueue(deferred)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        waits = list(self._wait_times)
+        oldest = min((r.enqueued_at for reqs in self._pending.values() for r in reqs), default=None)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active_slots": self.active,
+            "free_slots": max(0, self.max_concurrency - self.active),
+            "active_daemons": self.active_daemons,
+            "queue_depth": self.queue_depth,
+            "oldest_wait_seconds": round(now - oldest, 3) if oldest is not None else 0,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0,
+            "total_dispatched": self.total_dispatched,
+            "deferred": len(self._deferred),
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+        }
+
+
+engine = ExecutionEngine()
+
+
+def apply_engine_settings():
+    """从设置表读取执行引擎配置"""
+    limit = settings.get_int("max_concurrent_scripts", 0)
+    if limit:
+        engine.set_max_concurrency(limit)
+
+
+# 运行历史保留策略默认值，可通过设置项 run_history_retention_days / run_history_max_per_script 覆盖 (0 表示不限制)
+DEFAULT_RUN_HISTORY_RETENTION_DAYS = 30
+DEFAULT_RUN_HISTORY_MAX_PER_SCRIPT = 1000
+# 日志分段保留策略默认值，可通过设置项 log_retention_days / log_max_runs_per_script / log_max_total_mb 覆盖
+DEFAULT_LOG_RETENTION_DAYS = 30
+DEFAULT_LOG_MAX_RUNS_PER_SCRIPT = 100
+DEFAULT_LOG_MAX_TOTAL_MB = 1024
+
+async def prune_run_history():
+    """按保留天数和每个脚本的最大条数清理运行历史 (正在运行的记录不受影响)，以及已删除脚本遗留的记录，随后清理日志分段"""
+    async with AsyncSessionLocal() as db:
+        try:
+            retention_days = settings.get_int("run_history_retention_days", DEFAULT_RUN_HISTORY_RETENTION_DAYS)
+            max_per_script = settings.get_int("run_history_max_per_script", DEFAULT_RUN_HISTORY_MAX_PER_SCRIPT)
+            finished = models.ScriptRun.status != "running"
+            deleted = 0
+
+            # 删除脚本时会一并删除运行历史，这里清理之前遗留的记录
+            deleted += (await db.execute(delete(models.ScriptRun).where(
+                models.ScriptRun.script_id.not_in(select(models.Script.id))
+            ))).rowcount
+
+            if retention_days > 0:
+                cutoff = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+                deleted += (await db.execute(delete(models.ScriptRun).where(
+                    finished, models.ScriptRun.started_at < cutoff
+                ))).rowcount
+
+            if max_per_script > 0:
+                script_ids = (await db.scalars(select(models.ScriptRun.script_id).distinct())).all()
+                for script_id in script_ids:
+                    # 找到第 max_per_script + 1 新的记录，删除它及更早的记录
+                    boundary = await db.scalar(select(models.ScriptRun.id).where(
+                        models.ScriptRun.script_id == script_id
+                    ).order_by(models.ScriptRun.id.desc()).offset(max_per_script).limit(1))
+                    if boundary is not None:
+                        deleted += (await db.execute(delete(models.ScriptRun).where(
+                            models.ScriptRun.script_id == script_id, models.ScriptRun.id <= boundary, finished
+                        ))).rowcount
+
+            await db.commit()
+            if deleted:
+                logger.info(f"Pruned {deleted} run history records")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Failed to prune run history: {e}")
+            deleted = 0
+
+    await prune_logs()
+    return deleted
+
+async def prune_logs():
+    """按保留天数 / 每个脚本保留的运行数 / 总大小清理日志分段"""
+    retention_days = settings.get_int("log_retention_days", DEFAULT_LOG_RETENTION_DAYS)
+    max_runs = settings.get_int("log_max_runs_per_script", DEFAULT_LOG_MAX_RUNS_PER_SCRIPT)
+    max_total_mb = settings.get_int("log_max_total_mb", DEFAULT_LOG_MAX_TOTAL_MB)
+    try:
+        result = await asyncio.to_thread(log_store.prune, retention_days, max_runs, max_total_mb * 1024 * 1024)
+        if result["runs_removed"]:
+            logger.info(f"Pruned logs of {result['runs_removed']} runs, freed {result['bytes_freed']} bytes")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to prune logs: {e}")
+        return None
 
-def update_scheduler(script_id, cron_expr, script_path, script_name, bot_token=None, chat_id=None, arguments=None):
+
+async def enqueue_script(script_id, script_path, script_name, bot_token=None, chat_id=None, arguments=None, is_daemon=False,
+                         overlap_policy=OVERLAP_SKIP, max_instances=1):
+    """定时任务入口：提交到执行引擎而不是直接运行"""
+    engine.submit(script_id, script_path, script_name, bot_token, chat_id, arguments, is_daemon,
+                  priority=PRIORITY_CRON, source="cron",
+                  overlap_policy=overlap_policy, max_instances=max_instances)
+
+def update_scheduler(script_id, cron_expr, script_path, script_name, bot_token=None, chat_id=None, arguments=None,
+                     overlap_policy=OVERLAP_SKIP, max_instances=1):
     job_id = f"script_{script_id}"
     if scheduler.get_job(job_id):
         scheduler.remove_job(job_id)
@@ -273,50 +692,40 @@ def update_scheduler(script_id, cron_expr, script_path, script_name, bot_token=N
     if cron_expr:
         try:
             scheduler.add_job(
-                run_script,
+                enqueue_script,
                 CronTrigger.from_crontab(cron_expr),
                 id=job_id,
-                args=[script_id, script_path, script_name, bot_token, chat_id, arguments, False]
+                args=[script_id, script_path, script_name, bot_token, chat_id, arguments, False,
+                      overlap_policy, max_instances]
             )
         except Exception as e:
             logger.error(f"Failed to add cron job for {script_name}: {e}")
 
 async def health_check():
     issues = []
-    db = SessionLocal()
     
     # 获取 TG 配置用于通知
-    proxy_setting = db.query(models.Setting).filter(models.Setting.key == "tg_proxy").first()
-    token_setting = db.query(models.Setting).filter(models.Setting.key == "tg_bot_token").first()
-    chat_setting = db.query(models.Setting).filter(models.Setting.key == "tg_chat_id").first()
-    
-    token = token_setting.value if token_setting else None
-    chat_id = chat_setting.value if chat_setting else None
+    token, chat_id = settings.telegram()
     
     # 1. 检查常驻脚本
     # 查找数据库中认为是 'running' 且是 daemon 的脚本
-    running_daemons = db.query(models.Script).filter(
-        models.Script.last_status == 'running', 
-        models.Script.cron == '@daemon'
-    ).all()
+    async with AsyncSessionLocal() as db:
+        running_daemons = (await db.scalars(select(models.Script).where(
+            models.Script.last_status == 'running', 
+            models.Script.cron == '@daemon'
+        ))).all()
     
     for script in running_daemons:
         # 检查 RUNNING_TASKS 中是否存在且存活
-        proc = RUNNING_TASKS.get(script.id)
-        is_alive = False
-        if proc and proc.returncode is None:
-            is_alive = True
+        is_alive = running_instances(script.id) > 0
             
         if not is_alive:
-            script.last_status = 'failed'
+            status_buffer.update_script(script.id, last_status='failed')
             issues.append(f"🔴 守护脚本 [{script.name}] 意外停止")
             logger.warning(f"Health Check: Daemon script {script.name} found dead. Updating status to failed.")
-            
-    db.commit()
-    db.close()
     
     if issues and token and chat_id:
         msg = "🏥 *健康检查警报*\n\n" + "\n".join(issues)
-        await notify_telegram(msg, token, chat_id)
+        notifier.enqueue(msg, token, chat_id)
     
     return issues
\ No newline at end of file
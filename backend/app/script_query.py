@@ -0,0 +1,183 @@
+"""
+脚本列表的筛选、排序和游标分页，供 GET /api/scripts、/api/scripts/summary 和 Telegram 脚本菜单共用。
+
+分页使用 keyset 游标 (上一页最后一行的排序键 + id)，翻页代价与页码无关，翻页期间插入 / 删除脚本也不会重复或跳过。
+排序键 NULL 值的位置与 SQLite 一致：升序在最前，降序在最后。
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Select, and_, case, false, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+
+from . import models
+
+Script = models.Script
+
+MAX_PAGE_SIZE = 500
+
+# 按状态排序时的先后顺序，未运行过的排在最后
+STATUS_ORDER = ("running", "queued", "success", "failed", "limit_exceeded", "stopped")
+CRON_TYPES = ("scheduled", "daemon", "manual")
+FILE_TYPES = {"py": ".py", "sh": ".sh"}
+
+SORT_KEYS = {
+    "name": Script.name,
+    "last_run": Script.last_run,
+    "status": case(*((Script.last_status == s, i) for i, s in enumerate(STATUS_ORDER)), else_=len(STATUS_ORDER)),
+    "id": Script.id,
+}
+# 运行中的脚本排在最前 (running_first)
+RUNNING_FIRST = case((Script.last_status == "running", 0), else_=1)
+
+
+class InvalidQuery(ValueError):
+    """筛选 / 排序参数或游标无效"""
+
+
+@dataclass
+class ScriptQuery:
+    status: Optional[str] = None  # 逗号分隔的 last_status，idle 表示从未运行
+    enabled: Optional[bool] = None
+    cron_type: Optional[str] = None  # scheduled (定时) / daemon (常驻) / manual (无 cron)
+    file_type: Optional[str] = None  # py / sh
+    q: Optional[str] = None  # 名称包含的文本 (不区分大小写)
+    sort: str = "name"
+    order: str = "asc"
+    running_first: bool = False
+
+    def validate(self):
+        if self.sort not in SORT_KEYS:
+            raise InvalidQuery(f"Invalid sort: {self.sort}, expected one of {', '.join(SORT_KEYS)}")
+        if self.order not in ("asc", "desc"):
+            raise InvalidQuery("order must be asc or desc")
+        if self.cron_type is not None and self.cron_type not in CRON_TYPES:
+            raise InvalidQuery(f"Invalid cron_type: {self.cron_type}, expected one of {', '.join(CRON_TYPES)}")
+        if self.file_type is not None and self.file_type not in FILE_TYPES:
+            raise InvalidQuery(f"Invalid file_type: {self.file_type}, expected py or sh")
+
+    def conditions(self) -> list:
+        conditions = []
+        if self.status:
+            statuses = [s.strip() for s in self.status.split(",") if s.strip()]
+            named = [s for s in statuses if s != "idle"]
+            matches = [Script.last_status.in_(named)] if named else []
+            if "idle" in statuses:
+                matches.append(Script.last_status.is_(None))
+            conditions.append(or_(*matches))
+        if self.enabled is not None:
+            conditions.append(Script.enabled == self.enabled)
+        if self.cron_type == "daemon":
+            conditions.append(Script.cron == "@daemon")
+        elif self.cron_type == "scheduled":
+            conditions.append(and_(Script.cron.is_not(None), Script.cron != "", Script.cron != "@daemon"))
+        elif self.cron_type == "manual":
+            conditions.append(or_(Script.cron.is_(None), Script.cron == ""))
+        if self.file_type:
+            conditions.append(Script.path.endswith(FILE_TYPES[self.file_type]))
+        if self.q:
+            escaped = self.q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append(Script.name.ilike(f"%{escaped}%", escape="\\"))
+        return conditions
+
+    def sort_keys(self) -> List[Tuple[object, bool]]:
+        """(排序表达式, 是否降序)，最后以 id 兜底保证顺序唯一"""
+        desc = self.order == "desc"
+        keys = [(RUNNING_FIRST, False)] if self.running_first else []
+        if self.sort != "id":
+            keys.append((SORT_KEYS[self.sort], desc))
+        keys.append((Script.id, desc))
+        return keys
+
+
+def _after(expr, value, desc: bool):
+    """排序在 value 之后的行"""
+    if value is None:
+        return false() if desc else expr.is_not(None)
+    return or_(expr < value, expr.is_(None)) if desc else expr > value
+
+
+def _equal(expr, value):
+    return expr.is_(None) if value is None else expr == value
+
+
+def _cursor_values(script: Script, query: ScriptQuery) -> list:
+    values = []
+    if query.running_first:
+        values.append(0 if script.last_status == "running" else 1)
+    if query.sort == "name":
+        values.append(script.name)
+    elif query.sort == "last_run":
+        values.append(script.last_run.isoformat() if script.last_run else None)
+    elif query.sort == "status":
+        values.append(STATUS_ORDER.index(script.last_status) if script.last_status in STATUS_ORDER
+                      else len(STATUS_ORDER))
+    values.append(script.id)
+    return values
+
+
+def encode_cursor(script: Script, query: ScriptQuery) -> str:
+    payload = json.dumps([query.sort, query.order, query.running_first, _cursor_values(script, query)])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, query: ScriptQuery) -> list:
+    try:
+        sort, order, running_first, values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise InvalidQuery("Invalid cursor")
+    if (sort, order, running_first) != (query.sort, query.order, query.running_first) \
+            or len(values) != len(query.sort_keys()):
+        raise InvalidQuery("Cursor does not match the current sort")
+    if query.sort == "last_run" and values[-2] is not None:
+        values[-2] = datetime.fromisoformat(values[-2])
+    return values
+
+
+def build(query: ScriptQuery, cursor: Optional[str] = None, columns=None) -> Select:
+    """筛选 + 排序 (+ 游标之后) 的查询；columns 为需要加载的列 (load_only)"""
+    query.validate()
+    stmt = select(Script).where(*query.conditions())
+    if columns is not None:
+        stmt = stmt.options(load_only(*columns))
+    keys = query.sort_keys()
+    if cursor:
+        values = decode_cursor(cursor, query)
+        stmt = stmt.where(or_(*(
+            and_(*(_equal(expr, value) for (expr, _), value in zip(keys[:i], values[:i])),
+                 _after(keys[i][0], values[i], keys[i][1]))
+            for i in range(len(keys))
+        )))
+    return stmt.order_by(*(expr.desc() if desc else expr.asc() for expr, desc in keys))
+
+
+async def fetch_page(db: AsyncSession, query: ScriptQuery, limit: Optional[int] = None, cursor: Optional[str] = None,
+                     columns=None) -> Tuple[List[Script], Optional[str]]:
+    """返回一页脚本和下一页的游标 (没有更多时为 None)；limit 为空时返回全部"""
+    stmt = build(query, cursor, columns)
+    if limit is None:
+        return list((await db.scalars(stmt)).all()), None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    scripts = list((await db.scalars(stmt.limit(limit + 1))).all())
+    if len(scripts) <= limit:
+        return scripts, None
+    scripts = scripts[:limit]
+    return scripts, encode_cursor(scripts[-1], query)
+
+
+async def count(db: AsyncSession, query: ScriptQuery) -> int:
+    return await db.scalar(select(func.count()).select_from(Script).where(*query.conditions()))
+
+
+async def status_counts(db: AsyncSession, query: ScriptQuery) -> Dict[str, int]:
+    """符合筛选条件的脚本按 last_status 计数，从未运行过的计为 idle"""
+    rows = await db.execute(select(Script.last_status, func.count()).where(*query.conditions())
+                            .group_by(Script.last_status))
+    counts: Dict[str, int] = {}
+    for status, n in rows:
+        counts[status or "idle"] = counts.get(status or "idle", 0) + n
+    return counts
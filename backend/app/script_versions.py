@@ -0,0 +1,59 @@
+"""
+脚本列表的版本号：每次脚本信息变化 (增删改、扫描、运行状态) 版本号加一，并记录每个脚本最后一次变化时的版本，
+供 GET /api/scripts/summary 生成 ETag (未变化时返回 304) 和 since=<版本号> 增量查询。
+
+每次变化同时作为事件发布到 status_events (事件 ID 即版本号)，供 WebSocket 实时推送。
+
+版本号只保存在内存中，起始值取启动时的微秒时间戳，重启后的版本号总是大于重启前客户端持有的版本号，
+旧版本号会被判定为过期而返回全量列表。
+"""
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import status_events
+
+
+class ScriptVersions:
+    def __init__(self):
+        self.version = time.time_ns() // 1000
+        # 早于该版本的 since 无法给出增量 (启动前 / 全量失效)，只能返回全量
+        self._floor = self.version
+        self._changed: Dict[int, int] = {}  # script_id -> 最后一次变化时的版本
+        self._deleted: Dict[int, int] = {}  # 已删除的 script_id -> 删除时的版本
+        status_events.hub.reset_horizon(self.version)
+
+    def touch(self, script_id: int, **fields):
+        """记录脚本发生变化：带状态字段时为状态变化 (status 事件)，否则为新增 / 修改 (changed 事件)"""
+        self.version += 1
+        self._changed[script_id] = self.version
+        self._deleted.pop(script_id, None)
+        status_events.hub.publish(self.version, "status" if fields else "changed", script_id, **fields)
+
+    def remove(self, script_id: int):
+        """记录脚本已删除"""
+        self.version += 1
+        self._changed.pop(script_id, None)
+        self._deleted[script_id] = self.version
+        status_events.hub.publish(self.version, "deleted", script_id)
+
+    def invalidate_all(self):
+        """无法逐个记录的批量变化 (如从备份恢复) 后调用，之后的增量查询都返回全量"""
+        self.version += 1
+        self._floor = self.version
+        self._changed.clear()
+        self._deleted.clear()
+        status_events.hub.publish(self.version, "reset")
+
+    def changes_since(self, since: int) -> Optional[Tuple[Set[int], List[int]]]:
+        """返回 since 之后变化的脚本和删除的脚本；since 无效或已过期时返回 None (需要全量)"""
+        if since < self._floor or since > self.version:
+            return None
+        changed = {script_id for script_id, v in self._changed.items() if v > since}
+        deleted = [script_id for script_id, v in self._deleted.items() if v > since]
+        return changed, deleted
+
+    def etag(self) -> str:
+        return f'W/"{self.version}"'
+
+
+script_versions = ScriptVersions()
@@ -0,0 +1,110 @@
+"""
+设置项缓存：一次查询加载 settings 表全部键值，之后的读取都走内存。
+启动时和写入设置的接口 (save_setting / save_backup_config) 提交后调用 reload，用异步会话重新加载，
+事件循环中的读取不会执行同步查询；线程中读取时缓存为空 (invalidate 之后) 才用同步会话加载。
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from .database import SessionLocal, AsyncSessionLocal
+from . import models
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsCache:
+    def __init__(self):
+        self._values: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def _load(self) -> Dict[str, str]:
+        db = SessionLocal()
+        try:
+            return {key: value for key, value in db.query(models.Setting.key, models.Setting.value).all()}
+        finally:
+            db.close()
+
+    def _data(self) -> Dict[str, str]:
+        values = self._values
+        if values is not None:
+            self.hits += 1
+            return values
+        with self._lock:
+            if self._values is None:
+                self._values = self._load()
+                self.loads += 1
+            return self._values
+
+    async def reload(self):
+        """用异步会话重新加载；加载完成前读取方继续使用旧值"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(models.Setting.key, models.Setting.value))).all()
+        self._values = {key: value for key, value in rows}
+        self.loads += 1
+
+    def invalidate(self):
+        self._values = None
+        self.invalidations += 1
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """原始字符串值，未设置时返回 default"""
+        value = self._data().get(key)
+        return default if value is None else value
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self.get(key)
+        return default if value is None else value == "true"
+
+    def get_int(self, key: str, default: int) -> int:
+        value = self.get(key)
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            logger.error(f"Invalid {key} setting: {value}")
+            return default
+
+    def get_list(self, key: str) -> List[str]:
+        """逗号分隔的列表"""
+        return [item.strip() for item in (self.get(key) or "").split(",") if item.strip()]
+
+    def telegram(self) -> Tuple[Optional[str], Optional[str]]:
+        """(tg_bot_token, tg_chat_id)"""
+        return self.get("tg_bot_token"), self.get("tg_chat_id")
+
+    def cd2_config(self) -> Optional[Dict[str, str]]:
+        """CloudDrive2 WebDAV 备份配置 (backup_and_upload 的 cd2_config 参数)，配置不完整时返回 None"""
+        url, username, password = self.get("cd2_webdav_url"), self.get("cd2_username"), self.get("cd2_password")
+        if not url or not username or not password:
+            return None
+        return {
+            "webdav_url": url,
+            "username": username,
+            "password": password,
+            "backup_path": self.get("cd2_backup_path") or "/ScriptBackups",
+            "keep_local": self.get_bool("cd2_keep_local"),
+        }
+
+    def backup_retention(self) -> Dict[str, int]:
+        """备份保留策略 (backup_catalog.apply_retention 的 policy 参数)，未设置的项为 0 (不按该项保留)"""
+        return {tier: max(0, self.get_int(f"backup_keep_{tier}", 0)) for tier in ("last", "daily", "weekly", "monthly")}
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.loads
+        return {
+            "keys": len(self._values) if self._values is not None else None,
+            "hits": self.hits,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+settings = SettingsCache()
@@ -0,0 +1,279 @@
+"""
+脚本子进程的启动与回收
+
+asyncio 的子进程接口由 child watcher 调用 waitpid 回收进程，拿不到 rusage。
+这里用 posix_spawn 启动进程（新会话，pgid == pid），再由专用线程调用 os.wait4 回收，
+从而获得进程组组长及其已回收子进程的资源占用 (CPU 时间、块 I/O、上下文切换)。
+
+峰值内存不取 rusage (见 forkserver.rusage_to_dict)，由 MemoryMonitor 采样：所有运行中的进程组共用一个采样协程，
+每个周期只扫描一次 /proc 并按进程组汇总；刚启动的进程在第一秒内密集读取组长的 VmHWM，
+几百毫秒就结束的脚本也能记录到峰值。采样值是近似值，两次采样之间结束的短暂峰值 (子进程、最后一次采样后的分配) 会漏掉。
+"""
+import asyncio
+import logging
+import os
+import resource
+import shutil
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .forkserver import rusage_to_dict
+
+logger = logging.getLogger(__name__)
+
+# RLIMIT_CPU 软限制到达时进程收到 SIGXCPU，留几秒余量再由硬限制 SIGKILL
+CPU_HARD_LIMIT_GRACE = 5
+# exec 前设置资源限制用到的命令 (util-linux / coreutils)
+PRLIMIT = shutil.which("prlimit")
+NICE = shutil.which("nice")
+IONICE = shutil.which("ionice")
+
+# 扫描 /proc 汇总进程组内存 (峰值、内存上限检查) 的间隔 (秒)
+MEMORY_SAMPLE_INTERVAL = 1.0
+# 进程启动后的这段时间内 (秒)，每隔 DENSE_SAMPLE_INTERVAL 读取一次组长的 VmHWM
+DENSE_SAMPLE_SECONDS = 1.0
+DENSE_SAMPLE_INTERVAL = 0.05
+
+
+class ScriptProcess:
+    """与 asyncio.subprocess.Process 接口兼容 (pid / returncode / stdout / wait)，并额外提供 rusage"""
+
+    def __init__(self, pid: int, stdout: asyncio.StreamReader):
+        self.pid = pid
+        self.stdout = stdout
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[dict] = None
+        self.peak_rss_kb: Optional[int] = None  # MemoryMonitor 采样到的峰值内存
+        self.started_at = time.monotonic()
+        self.wall_time: Optional[float] = None
+        loop = asyncio.get_running_loop()
+        self._exited = loop.create_future()
+        threading.Thread(target=self._reap, args=(loop,), name=f"reap-{pid}", daemon=True).start()
+
+    def _reap(self, loop: asyncio.AbstractEventLoop):
+        # 每个进程一个守护线程阻塞在 wait4 上，避免占满默认线程池
+        try:
+            _, status, rusage = os.wait4(self.pid, 0)
+            result = (os.waitstatus_to_exitcode(status), rusage_to_dict(rusage))
+        except ChildProcessError:
+            result = (-9, None)
+        loop.call_soon_threadsafe(self._set_exited, result)
+
+    def _set_exited(self, result):
+        self.returncode, self.rusage = result
+        self.wall_time = time.monotonic() - self.started_at
+        if not self._exited.done():
+            self._exited.set_result(self.returncode)
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+
+async def spawn(program: str, args: List[str], limits: Optional[dict] = None) -> ScriptProcess:
+    """
+    启动子进程：stdout/stderr 合并到一个管道，创建新会话/进程组 (等价于 start_new_session=True)
+
+    limits 中的 CPU 时间、打开文件数、nice、ionice 通过 limit_prefix 在 exec 脚本前设置
+    """
+    argv = [*limit_prefix(limits or {}), program, *args]
+    read_fd, write_fd = os.pipe()
+    try:
+        pid = os.posix_spawnp(
+            argv[0], argv, os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, write_fd, 1),
+                (os.POSIX_SPAWN_DUP2, write_fd, 2),
+            ],
+            setsid=True,
+            # 与 subprocess 的 restore_signals 一致，恢复 Python 忽略掉的信号
+            setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+        )
+    except BaseException:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+
+    pipe = os.fdopen(read_fd, "rb", 0)
+    stdout = asyncio.StreamReader(limit=2 ** 16)
+    loop = asyncio.get_running_loop()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdout), pipe)
+    return ScriptProcess(pid, stdout)
+
+
+def _clamp_to_hard_limit(rlimit: int, value: int) -> int:
+    """子进程继承服务进程的 rlimit，非特权进程不能调高硬限制，超出时取当前硬限制"""
+    _, hard = resource.getrlimit(rlimit)
+    return value if hard == resource.RLIM_INFINITY else min(value, hard)
+
+
+def limit_prefix(limits: dict) -> List[str]:
+    """
+    生成在 exec 脚本之前设置资源限制的命令前缀：prlimit (RLIMIT_CPU / RLIMIT_NOFILE)、nice、ionice 依次设置后 exec 下一个命令
+
+    posix_spawn 不支持为子进程设置 rlimit 和优先级，放在 exec 前设置，脚本从启动起就受限制，之后 fork 的子进程也会继承。
+    limits: cpu_limit_seconds / max_open_files / nice_level / ionice_level，值为 None 表示不限制
+    """
+    prefix: List[str] = []
+    rlimits = []
+    if limits.get("cpu_limit_seconds"):
+        cpu = int(limits["cpu_limit_seconds"])
+        soft = _clamp_to_hard_limit(resource.RLIMIT_CPU, cpu)
+        hard = _clamp_to_hard_limit(resource.RLIMIT_CPU, cpu + CPU_HARD_LIMIT_GRACE)
+        rlimits.append(f"--cpu={soft}:{hard}")
+    if limits.get("max_open_files"):
+        nofile = _clamp_to_hard_limit(resource.RLIMIT_NOFILE, int(limits["max_open_files"]))
+        rlimits.append(f"--nofile={nofile}:{nofile}")
+    if rlimits:
+        if PRLIMIT:
+            prefix += [PRLIMIT, *rlimits, "--"]
+        else:
+            logger.warning("prlimit not found, cpu_limit_seconds / max_open_files are not applied")
+
+    if limits.get("nice_level") is not None:
+        if NICE:
+            prefix += [NICE, "-n", str(int(limits["nice_level"])), "--"]
+        else:
+            logger.warning("nice not found, nice_level is not applied")
+
+    if limits.get("ionice_level") is not None:
+        if IONICE:
+            # -t: 设置失败 (如内核不支持) 时仍然运行脚本
+            prefix += [IONICE, "-c", "2", "-n", str(int(limits["ionice_level"])), "-t", "--"]
+        else:
+            logger.warning("ionice not found, ionice_level is not applied")
+    return prefix
+
+
+def _leader_hwm_kb(pid: int) -> int:
+    """进程的峰值常驻内存 VmHWM (KB)，exec 时重新计算；进程已退出时为 0"""
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def sample_memory(pgids: Iterable[int], scan_groups: bool) -> Dict[int, Tuple[int, int]]:
+    """
+    pgid -> (进程组内所有存活进程的常驻内存之和, 组长的 VmHWM)，单位 KB。
+    scan_groups 为 False 时只读取组长的 VmHWM，常驻内存之和为 0
+    """
+    result = {pgid: [0, _leader_hwm_kb(pgid)] for pgid in pgids}
+    if scan_groups and result:
+        page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # comm 字段可能包含空格，从最后一个 ')' 之后解析
+            fields = stat[stat.rfind(b")") + 2:].split()
+            # fields[2] = pgrp, fields[21] = rss (页)
+            if len(fields) > 21:
+                group = result.get(int(fields[2]))
+                if group is not None:
+                    group[0] += int(fields[21]) * page_kb
+    return {pgid: (rss, hwm) for pgid, (rss, hwm) in result.items()}
+
+
+@dataclass
+class _Tracked:
+    process: object
+    memory_limit_kb: Optional[int]
+    on_exceed: Optional[Callable[[int], None]]
+    exceeded: bool = False
+
+
+class MemoryMonitor:
+    """
+    所有运行中进程组共用的内存采样协程：更新各进程的 peak_rss_kb，进程组常驻内存超过上限时调用 on_exceed(rss_kb)。
+    内存上限每 MEMORY_SAMPLE_INTERVAL 秒检查一次，两次检查之间进程组可以短暂超过上限。
+    """
+
+    def __init__(self):
+        self._tracked: Dict[int, _Tracked] = {}  # pid (pgid) -> 监控项
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.samples = 0
+        self.group_scans = 0
+        self.limit_kills = 0
+
+    def track(self, process, memory_limit_kb: Optional[int] = None,
+              on_exceed: Optional[Callable[[int], None]] = None):
+        """开始采样进程 (ScriptProcess / WarmProcess，需有 pid / returncode / started_at / peak_rss_kb)"""
+        self._tracked[process.pid] = _Tracked(process, memory_limit_kb, on_exceed)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        # 立即采样一次并进入密集采样
+        self._wakeup.set()
+
+    def untrack(self, process):
+        tracked = self._tracked.get(process.pid)
+        if tracked is not None and tracked.process is process:
+            del self._tracked[process.pid]
+
+    async def _run(self):
+        next_scan = 0.0
+        while True:
+            entries = [t for t in self._tracked.values() if t.process.returncode is None]
+            if not entries:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            scan_groups = now >= next_scan
+            if scan_groups:
+                next_scan = now + MEMORY_SAMPLE_INTERVAL
+                self.group_scans += 1
+            self.samples += 1
+            try:
+                samples = await asyncio.to_thread(sample_memory, [t.process.pid for t in entries], scan_groups)
+            except Exception as e:
+                logger.error(f"Memory sampling failed: {e}")
+                samples = {}
+
+            for tracked in entries:
+                process = tracked.process
+                if process.returncode is not None or process.pid not in samples:
+                    continue
+                rss_kb, hwm_kb = samples[process.pid]
+                peak = max(rss_kb, hwm_kb)
+                if peak > (process.peak_rss_kb or 0):
+                    process.peak_rss_kb = peak
+                if (scan_groups and tracked.memory_limit_kb and rss_kb > tracked.memory_limit_kb
+                        and not tracked.exceeded and tracked.on_exceed is not None):
+                    tracked.exceeded = True
+                    self.limit_kills += 1
+                    tracked.on_exceed(rss_kb)
+
+            now = time.monotonic()
+            young = any(now - t.process.started_at < DENSE_SAMPLE_SECONDS for t in entries)
+            delay = DENSE_SAMPLE_INTERVAL if young else max(0.0, next_scan - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._tracked),
+            "samples": self.samples,
+            "group_scans": self.group_scans,
+            "limit_kills": self.limit_kills,
+        }
+
+
+monitor = MemoryMonitor()
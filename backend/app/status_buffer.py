@@ -0,0 +1,132 @@
+"""
+脚本状态的写入缓冲 (write-behind)：run_script / API 产生的 last_status、last_run 等状态变化先合并在内存中，
+由后台协程每 STATUS_FLUSH_MS 毫秒在一个事务里批量写入 scripts 和 script_runs 表。
+
+大量脚本同时启动 / 结束时，原本每次状态变化一个事务 (每次提交一次 fsync)，现在合并为每个周期一个事务；
+同一脚本在一个周期内的多次变化只写最后的值。返回脚本信息的接口用 overlay() 叠加尚未落盘的状态，保证读到最新值。
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+from sqlalchemy import update
+
+from . import models
+from .database import AsyncSessionLocal
+from .script_versions import script_versions
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = int(os.getenv("STATUS_FLUSH_MS", "250")) / 1000
+
+
+class StatusBuffer:
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        self.interval = interval
+        self._scripts: Dict[int, dict] = {}  # script_id -> 待写入的 Script 字段
+        self._runs: Dict[int, dict] = {}  # run_id -> 待写入的 ScriptRun 字段
+        self._writing: Dict[int, dict] = {}  # 正在写入 (事务尚未提交) 的 Script 字段
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+
+    def start(self):
+        """在事件循环中启动后台写入协程"""
+        if self._flusher and not self._flusher.done():
+            return
+        self._wakeup = asyncio.Event()
+        if self._scripts or self._runs:
+            self._wakeup.set()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止后台协程并写入剩余的状态"""
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def update_script(self, script_id: int, **fields):
+        """记录脚本字段的变化 (last_status / last_run / last_duration ...)"""
+        self._scripts.setdefault(script_id, {}).update(fields)
+        script_versions.touch(script_id, **fields)
+        self._touch()
+
+    def update_run(self, run_id: int, **fields):
+        """记录运行记录字段的变化 (finished_at / status / exit_code ...)"""
+        self._runs.setdefault(run_id, {}).update(fields)
+        self._touch()
+
+    def _touch(self):
+        self.updates += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def overlay(self, script_id: int, data: dict) -> dict:
+        """在接口返回的脚本数据上叠加尚未写入数据库的状态"""
+        for buffered in (self._writing, self._scripts):
+            pending = buffered.get(script_id)
+            if pending:
+                data.update(pending)
+        return data
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # 等待一个周期，让同时发生的状态变化合并到同一事务
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            # stop() 取消本协程时不能打断进行中的事务，否则已取出的这批状态会丢失
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """把当前缓冲的全部状态写入数据库 (一个事务)"""
+        async with self._lock:
+            if not self._scripts and not self._runs:
+                return
+            scripts, self._scripts = self._scripts, {}
+            runs, self._runs = self._runs, {}
+            self._writing = scripts
+            try:
+                async with AsyncSessionLocal() as db:
+                    for run_id, fields in runs.items():
+                        await db.execute(update(models.ScriptRun).where(models.ScriptRun.id == run_id).values(**fields))
+                    for script_id, fields in scripts.items():
+                        await db.execute(update(models.Script).where(models.Script.id == script_id).values(**fields))
+                    await db.commit()
+                self.flushes += 1
+                self.rows_written += len(scripts) + len(runs)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Failed to flush script status: {e}")
+                # 放回缓冲，之后产生的新值优先
+                for script_id, fields in scripts.items():
+                    self._scripts[script_id] = {**fields, **self._scripts.get(script_id, {})}
+                for run_id, fields in runs.items():
+                    self._runs[run_id] = {**fields, **self._runs.get(run_id, {})}
+                if self._wakeup is not None:
+                    self._wakeup.set()
+            finally:
+                self._writing = {}
+
+    def stats(self) -> dict:
+        return {
+            "pending_scripts": len(self._scripts),
+            "pending_runs": len(self._runs),
+            "updates": self.updates,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "errors": self.errors,
+        }
+
+
+status_buffer = StatusBuffer()
@@ -0,0 +1,120 @@
+"""
+脚本状态事件推送：脚本状态变化 (queued / running / 结束 / stopped)、增删改时发布事件，
+由 WebSocket /api/scripts/events 实时推送给前端，替代每 3 秒轮询脚本列表。
+
+事件 ID 即 script_versions 的版本号 (单调递增)。最近的事件保存在环形缓冲中，客户端重连时带上最后收到的事件 ID
+即可补发断线期间的事件；ID 早于缓冲 (或服务已重启) 时发送 reset，由客户端重新拉取列表。
+慢消费者积压超过上限时断开，客户端重连后按事件 ID 续传。
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 环形缓冲保留的事件数
+BUFFER_EVENTS = int(os.getenv("STATUS_EVENTS_BUFFER", "1000"))
+# 每个订阅者允许积压的事件数
+CLIENT_BUFFER_EVENTS = 1000
+
+# 状态事件携带的字段 (与精简脚本列表一致，不含 last_output 等大字段)
+EVENT_FIELDS = ("last_status", "last_run", "last_duration")
+
+
+class SlowConsumer(Exception):
+    """订阅者积压超过缓冲上限，已被断开"""
+
+
+class Subscription:
+    def __init__(self, hub: "StatusEventHub", max_events: int):
+        self.hub = hub
+        self.max_events = max_events
+        self.dropped = False
+        self._events = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, event: dict):
+        if self.dropped:
+            return
+        if len(self._events) >= self.max_events:
+            self.dropped = True
+            self._events.clear()
+            self.hub.dropped += 1
+            self.hub.unsubscribe(self)
+            self._ready.set()
+            return
+        self._events.append(event)
+        self._ready.set()
+
+    async def get(self) -> List[dict]:
+        """等待并取出当前积压的全部事件"""
+        await self._ready.wait()
+        if self.dropped:
+            raise SlowConsumer()
+        events = list(self._events)
+        self._events.clear()
+        self._ready.clear()
+        return events
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class StatusEventHub:
+    def __init__(self, max_events: int = BUFFER_EVENTS):
+        self._recent = deque(maxlen=max_events)
+        self._subscribers: Set[Subscription] = set()
+        # 已移出缓冲的最大事件 ID，不大于它的 ID 之后的事件不再完整
+        self._horizon = 0
+        self.published = 0
+        self.dropped = 0
+
+    def reset_horizon(self, event_id: int):
+        """设置可续传的起点 (启动时的版本号)，更早的事件 ID 一律需要 reset"""
+        self._horizon = event_id
+
+    def publish(self, event_id: int, event_type: str, script_id: Optional[int] = None, **fields):
+        """发布事件：status (状态变化，携带 EVENT_FIELDS)、changed (配置变化)、deleted、reset (需要全量刷新)"""
+        event = {"id": event_id, "type": event_type}
+        if script_id is not None:
+            event["script_id"] = script_id
+        for key in EVENT_FIELDS:
+            if key in fields:
+                value = fields[key]
+                event[key] = value.isoformat() if isinstance(value, datetime) else value
+        if len(self._recent) == self._recent.maxlen:
+            self._horizon = self._recent[0]["id"]
+        self._recent.append(event)
+        self.published += 1
+        for sub in list(self._subscribers):
+            sub.push(event)
+
+    def subscribe(self, max_events: int = CLIENT_BUFFER_EVENTS) -> Subscription:
+        sub = Subscription(self, max_events)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+    def events_after(self, last_event_id: int) -> Optional[List[dict]]:
+        """缓冲中 last_event_id 之后的事件；无法完整续传时返回 None"""
+        if last_event_id < self._horizon:
+            return None
+        if self._recent and last_event_id > self._recent[-1]["id"]:
+            return None
+        return [event for event in self._recent if event["id"] > last_event_id]
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "buffered_events": len(self._recent),
+            "published": self.published,
+            "dropped_slow_consumers": self.dropped,
+        }
+
+
+hub = StatusEventHub()
@@ -1,10 +1,13 @@
 import asyncio
-import httpx
 import logging
-from . import scheduler, models, database
+from . import scheduler, models, database, http_clients, script_query, log_store
+from .settings_cache import settings
 
 logger = logging.getLogger(__name__)
 
+# 脚本菜单每页的脚本数
+MENU_PAGE_SIZE = 20
+
 class TelegramBot:
     def __init__(self, token, chat_id, proxy=None):
         self.token = token
@@ -17,20 +20,19 @@ class TelegramBot:
     async def get_updates(self):
         url = f"{self.base_url}/getUpdates"
         params = {"offset": self.offset, "timeout": 30}
-        proxies = self.proxy if self.proxy else None
-        async with httpx.AsyncClient(proxy=proxies, timeout=40) as client:
-            try:
-                resp = await client.get(url, params=params)
-                if resp.status_code == 200:
-                    return resp.json()
-                elif resp.status_code == 409:
-                    return {"conflict": True}
-                else:
-                    logger.warning(f"TG Polling failed: {resp.status_code}")
-                    return None
-            except Exception as e:
-                logger.error(f"TG Polling Error: {e}")
+        client = http_clients.telegram.get(self.proxy)
+        try:
+            resp = await client.get(url, params=params, timeout=40)
+            if resp.status_code == 200:
+                return resp.json()
+            elif resp.status_code == 409:
+                return {"conflict": True}
+            else:
+                logger.warning(f"TG Polling failed: {resp.status_code}")
                 return None
+        except Exception as e:
+            logger.error(f"TG Polling Error: {e}")
+            return None
 
     async def send_message(self, text, reply_markup=None):
         url = f"{self.base_url}/sendMessage"
@@ -38,14 +40,13 @@ class TelegramBot:
         if reply_markup:
             data["reply_markup"] = reply_markup
 
-        proxies = self.proxy if self.proxy else None
-        async with httpx.AsyncClient(proxy=proxies, timeout=10.0) as client:
-            try:
-                await client.post(url, json=data)
-            except asyncio.TimeoutError:
-                logger.error(f"TG Send timeout: message not delivered")
-            except Exception as e:
-                logger.error(f"TG Send Error: {e}")
+        client = http_clients.telegram.get(self.proxy)
+        try:
+            await client.post(url, json=data)
+        except asyncio.TimeoutError:
+            logger.error(f"TG Send timeout: message not delivered")
+        except Exception as e:
+            logger.error(f"TG Send Error: {e}")
 
     async def handle_update(self, update):
         update_id = update.get("update_id")
@@ -88,12 +89,18 @@ class TelegramBot:
             data = callback_query.get("data")
             await self.handle_callback(data)
 
-    async def show_scripts_menu(self):
-        db = database.SessionLocal()
-        try:
-            scripts = db.query(models.Script).all()
-        finally:
-            db.close()
+    async def show_scripts_menu(self, cursor=None):
+        # 与 /api/scripts 相同的分页查询，按 ID 排序，游标足够短，可以放进 callback_data (上限 64 字节)
+        query = script_query.ScriptQuery(sort="id")
+        if cursor:
+            try:
+                script_query.decode_cursor(cursor, query)
+            except script_query.InvalidQuery:
+                cursor = None  # 旧版本消息里的按钮，回到第一页
+        async with database.AsyncSessionLocal() as db:
+            scripts, next_cursor = await script_query.fetch_page(
+                db, query, MENU_PAGE_SIZE, cursor, [models.Script.name, models.Script.last_status])
+            total = await script_query.count(db, query) if cursor or next_cursor else len(scripts)
 
         keyboard = []
         keyboard.append([{"text": "🏥 立即执行全系统体检", "callback_data": "manual_health_check"}])
@@ -106,7 +113,15 @@ class TelegramBot:
             status = "🟢" if s.last_status == "running" else "⚫"
             keyboard.append([{"text": f"{status} {s.name}", "callback_data": f"menu_{s.id}"}])
 
-        await self.send_message("📂 *请选择需要管理的脚本：*", {"inline_keyboard": keyboard})
+        navigation = []
+        if cursor:
+            navigation.append({"text": "⏮ 第一页", "callback_data": "back_list"})
+        if next_cursor:
+            navigation.append({"text": "➡️ 下一页", "callback_data": f"page_{next_cursor}"})
+        if navigation:
+            keyboard.append(navigation)
+
+        await self.send_message(f"📂 *请选择需要管理的脚本：* (共 {total} 个)", {"inline_keyboard": keyboard})
 
     async def handle_callback(self, data):
         try:
@@ -142,6 +157,8 @@ class TelegramBot:
                     await self.send_message("❌ 无效的请求，请返回重试。")
             elif data == "back_list":
                 await self.show_scripts_menu()
+            elif data.startswith("page_"):
+                await self.show_scripts_menu(data[len("page_"):])
             else:
                 logger.warning(f"Unknown callback data: {data}")
         except Exception as e:
@@ -149,11 +166,8 @@ class TelegramBot:
             await self.send_message("❌ 处理请求时出错，请稍后重试。")
 
     async def show_script_actions(self, script_id):
-        db = database.SessionLocal()
-        try:
-            script = db.query(models.Script).filter(models.Script.id == script_id).first()
-        finally:
-            db.close()
+        async with database.AsyncSessionLocal() as db:
+            script = await db.get(models.Script, script_id)
 
         if not script:
             logger.warning(f"Script {script_id} not found in database")
@@ -171,24 +185,28 @@ class TelegramBot:
         await self.send_message(f"🛠 *正在管理：*{script.name}\n路径：`{script.path}`", {"inline_keyboard": keyboard})
 
     async def run_script_bg(self, script_id):
-        db = database.SessionLocal()
         try:
-            script = db.query(models.Script).filter(models.Script.id == script_id).first()
+            async with database.AsyncSessionLocal() as db:
+                script = await db.get(models.Script, script_id)
             if not script:
                 await self.send_message(f"❌ 脚本 (ID: {script_id}) 不存在。")
                 return
 
             is_daemon = (script.cron == "@daemon")
-            asyncio.create_task(scheduler.run_script(
+            queued = not is_daemon and scheduler.engine.is_saturated()
+            scheduler.engine.submit(
                 script.id, script.path, script.name,
-                self.token, self.chat_id, script.arguments, is_daemon
-            ))
-            await self.send_message(f"✅ 已发送启动指令：*{script.name}*")
+                self.token, self.chat_id, script.arguments, is_daemon,
+                priority=scheduler.PRIORITY_MANUAL, source="telegram",
+                overlap_policy=script.overlap_policy, max_instances=script.max_instances
+            )
+            if queued:
+                await self.send_message(f"⏳ 已加入执行队列：*{script.name}*")
+            else:
+                await self.send_message(f"✅ 已发送启动指令：*{script.name}*")
         except Exception as e:
             logger.error(f"Error in run_script_bg: {e}")
             await self.send_message(f"❌ 启动脚本失败：{str(e)}")
-        finally:
-            db.close()
 
     async def stop_script_bg(self, script_id):
         success = await scheduler.stop_script(script_id)
@@ -204,32 +222,25 @@ class TelegramBot:
             await self.send_message(f"⚠️ *异常警报：* 发现 {len(issues)} 个常驻脚本已失效。" )
 
     async def show_script_log(self, script_id):
-        import os
-
-        # 从数据库获取脚本路径
-        db = database.SessionLocal()
-        try:
-            script = db.query(models.Script).filter(models.Script.id == script_id).first()
-            if not script:
-                await self.send_message("❌ 脚本不存在。")
-                return
-            log_path = scheduler.get_log_path(script.path)
-        finally:
-            db.close()
+        async with database.AsyncSessionLocal() as db:
+            script = await db.get(models.Script, script_id)
+        if not script:
+            await self.send_message("❌ 脚本不存在。")
+            return
 
         content = "🏮 尚未产生日志文件。"
         try:
-            if os.path.exists(log_path):
+            if log_store.list_segments(script_id):
                 try:
-                    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
-                        lines = f.readlines()
-                        last_50 = "".join(lines[-50:]) if lines else "无日志内容"
-                        content = f"📜 *最近 50 条日志记录：*\n\n```\n{last_50}\n```"
+                    # 优先从内存尾部缓冲读取，缓冲未命中时从文件末尾向前读取
+                    data = await log_store.read_tail_lines(script_id, 50)
+                    last_50 = data.decode("utf-8", errors="replace") or "无日志内容"
+                    content = f"📜 *最近 50 条日志记录：*\n\n```\n{last_50}\n```"
                 except IOError as io_err:
                     logger.error(f"IO Error reading log {script_id}: {io_err}")
                     content = f"❌ 日志读取失败 (IO错误): {io_err}"
             else:
-                logger.info(f"Log file not found: {log_path}")
+                logger.info(f"No log segments for script {script_id}")
         except Exception as e:
             logger.error(f"Error in show_script_log: {e}")
             content = f"❌ 日志读取失败: {e}"
@@ -246,15 +257,14 @@ class TelegramBot:
             {"command": "menu", "description": "📂 打开主菜单"},
             {"command": "start", "description": "🔄 重启机器人交互"}
         ]
-        proxies = self.proxy if self.proxy else None
-        async with httpx.AsyncClient(proxy=proxies, timeout=10.0) as client:
-            try:
-                await client.post(url, json={"commands": commands})
-                logger.info("Bot commands menu set successfully.")
-            except asyncio.TimeoutError:
-                logger.error("Timeout setting bot commands")
-            except Exception as e:
-                logger.error(f"Failed to set bot commands: {e}")
+        client = http_clients.telegram.get(self.proxy)
+        try:
+            await client.post(url, json={"commands": commands})
+            logger.info("Bot commands menu set successfully.")
+        except asyncio.TimeoutError:
+            logger.error("Timeout setting bot commands")
+        except Exception as e:
+            logger.error(f"Failed to set bot commands: {e}")
 
     async def start_polling(self):
         self.is_running = True
@@ -302,17 +312,8 @@ async def stop_bot():
 async def start_bot():
     global bot_instance, bot_task
     await stop_bot()
-    db = database.SessionLocal()
-    try:
-        token_setting = db.query(models.Setting).filter(models.Setting.key == "tg_bot_token").first()
-        chat_setting = db.query(models.Setting).filter(models.Setting.key == "tg_chat_id").first()
-        proxy_setting = db.query(models.Setting).filter(models.Setting.key == "tg_proxy").first()
-    finally:
-        db.close()
-
-    token = token_setting.value if token_setting else None
-    chat_id = chat_setting.value if chat_setting else None
-    proxy = proxy_setting.value if proxy_setting and proxy_setting.value else None
+    token, chat_id = settings.telegram()
+    proxy = settings.get("tg_proxy") or None
 
     # 验证token和chat_id格式
     if not token or not chat_id:
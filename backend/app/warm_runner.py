@@ -0,0 +1,177 @@
+"""
+Warm runner：维护一个预热的 forkserver 进程，Python 脚本可从中 fork 启动，省去解释器冷启动开销。
+
+fork 出的子进程同样是新会话的进程组组长 (pgid == pid)，输出通过管道交给 run_script 读取，
+因此 stop_script 的 os.killpg 逻辑和日志采集逻辑无需区分冷启动/预热启动。
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+FORKSERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "forkserver.py")
+
+
+class WarmProcess:
+    """
+    由 forkserver 启动的进程，提供与 spawner.ScriptProcess 相同的接口
+    (pid / returncode / stdout / wait / rusage)。
+    """
+
+    def __init__(self, pid: int, stdout: asyncio.StreamReader, control_reader: asyncio.StreamReader,
+                 control_writer: asyncio.StreamWriter):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[dict] = None
+        self.peak_rss_kb: Optional[int] = None  # spawner.monitor 采样到的峰值内存
+        self.stdout = stdout
+        self.started_at = time.monotonic()
+        self.wall_time: Optional[float] = None
+        self._control_reader = control_reader
+        self._control_writer = control_writer
+        self._waiter = asyncio.ensure_future(self._read_exit())
+
+    async def _read_exit(self):
+        try:
+            line = await self._control_reader.readline()
+            message = json.loads(line) if line else {}
+            # forkserver 异常退出时拿不到退出码，按被 SIGKILL 处理
+            self.returncode = message.get("returncode", -9)
+            self.rusage = message.get("rusage")
+        except Exception as e:
+            logger.error(f"Warm runner: lost exit status of pid {self.pid}: {e}")
+            self.returncode = -9
+        finally:
+            self.wall_time = time.monotonic() - self.started_at
+            self._control_writer.close()
+        return self.returncode
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._waiter)
+
+
+class WarmRunner:
+    def __init__(self):
+        self.enabled = False
+        self.preload: List[str] = []
+        self.socket_path = f"/tmp/scriptsmanager-forkserver-{os.getpid()}.sock"
+        self._server: Optional[asyncio.subprocess.Process] = None
+        self._lock = asyncio.Lock()
+        self.warm_starts = 0
+        self.fallbacks = 0
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and self._server is not None and self._server.returncode is None
+
+    async def configure(self, enabled: bool, preload: List[str]):
+        """应用配置：启用时(重新)启动 forkserver，禁用时关闭"""
+        async with self._lock:
+            changed = preload != self.preload
+            self.enabled = enabled
+            self.preload = preload
+            if not enabled:
+                await self._shutdown()
+            elif changed or not self.available:
+                await self._shutdown()
+                await self._start()
+
+    async def _start(self):
+        try:
+            self._server = await asyncio.create_subprocess_exec(
+                sys.executable, "-u", FORKSERVER_SCRIPT,
+                "--socket", self.socket_path,
+                "--preload", ",".join(self.preload),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+            # 预加载大型模块可能较慢，等待 READY 信号
+            line = await asyncio.wait_for(self._server.stdout.readline(), timeout=120)
+            if line.strip() != b"READY":
+                raise RuntimeError(f"unexpected forkserver output: {line!r}")
+            logger.info(f"Warm runner started (pid: {self._server.pid}, preload: {self.preload})")
+        except Exception as e:
+            logger.error(f"Failed to start warm runner: {e}")
+            await self._shutdown()
+
+    async def _shutdown(self):
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        if server.returncode is None:
+            try:
+                # 关闭 stdin 即通知 forkserver 退出；已 fork 的脚本不受影响
+                server.stdin.close()
+                await asyncio.wait_for(server.wait(), timeout=5)
+            except Exception:
+                server.kill()
+        logger.info("Warm runner stopped")
+
+    def _handshake(self, request: dict, write_fd: int) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(10)
+            sock.connect(self.socket_path)
+            socket.send_fds(sock, [json.dumps(request).encode("utf-8")], [write_fd])
+            return sock
+        except Exception:
+            sock.close()
+            raise
+
+    async def spawn(self, script_path: str, args: List[str], limits: Optional[dict] = None) -> WarmProcess:
+        """从 forkserver fork 一个子进程运行脚本，limits 在子进程内 exec 脚本前生效"""
+        read_fd, write_fd = os.pipe()
+        try:
+            request = {"path": script_path, "args": args, "cwd": os.getcwd(), "limits": limits or {}}
+            sock = await asyncio.to_thread(self._handshake, request, write_fd)
+        finally:
+            # 写端已交给 forkserver（或握手失败），本进程不再持有，保证子进程退出后能读到 EOF
+            os.close(write_fd)
+
+        pipe = os.fdopen(read_fd, "rb", 0)
+        try:
+            sock.setblocking(False)
+            control_reader, control_writer = await asyncio.open_unix_connection(sock=sock)
+            reply = json.loads(await asyncio.wait_for(control_reader.readline(), timeout=10))
+            if "pid" not in reply:
+                raise RuntimeError(reply.get("error", "forkserver did not return a pid"))
+
+            loop = asyncio.get_running_loop()
+            stdout = asyncio.StreamReader(limit=2 ** 16)
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdout), pipe)
+        except Exception:
+            pipe.close()
+            sock.close()
+            raise
+
+        self.warm_starts += 1
+        return WarmProcess(reply["pid"], stdout, control_reader, control_writer)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "available": self.available,
+            "pid": self._server.pid if self._server else None,
+            "preload": self.preload,
+            "warm_starts": self.warm_starts,
+            "fallbacks": self.fallbacks,
+        }
+
+
+runner = WarmRunner()
+
+
+async def apply_settings():
+    """从设置表读取 warm runner 配置并应用"""
+    from .settings_cache import settings
+
+    await runner.configure(
+        enabled=settings.get_bool("warm_runner_enabled"),
+        preload=settings.get_list("warm_runner_preload"),
+    )
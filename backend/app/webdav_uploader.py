@@ -0,0 +1,326 @@
+"""
+WebDAV 上传器：CloudDrive2 备份 (完整备份流式上传、增量备份的块和快照) 共用。
+
+- 每个 WebDAV 地址 + 账号一个上传器，请求都走 http_clients 的共享客户端，复用同一个认证过的长连接会话
+- 记住已确认存在的远程目录，只对未知的目录发送 MKCOL；PUT 返回 409 (目录已被删除) 时清除缓存、重建目录后重试
+- upload_many 以 WEBDAV_UPLOAD_CONCURRENCY 个线程并发上传多个文件
+- 上传后用 PROPFIND 查询远程文件的大小和 ETag 校验，不只看 PUT 的状态码；大小不符视为失败并重试
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import httpx
+
+from . import http_clients
+
+logger = logging.getLogger(__name__)
+
+# 并发上传的文件数
+UPLOAD_CONCURRENCY = max(1, int(os.getenv("WEBDAV_UPLOAD_CONCURRENCY", "4")))
+# 上传失败后的重试次数，重试间隔从 1 秒开始翻倍，最长 30 秒
+RETRIES = int(os.getenv("BACKUP_UPLOAD_RETRIES", "3"))
+RETRY_MAX_DELAY = 30
+# 上传时每次读取的字节数，同时是进度更新和取消检查的粒度
+READ_CHUNK_BYTES = 256 * 1024
+
+
+class UploadError(Exception):
+    """不可重试的上传错误 (如认证失败、重试次数用完)"""
+
+
+class _Retry(Exception):
+    """可重试的上传失败"""
+
+
+def check_status(resp: httpx.Response) -> bool:
+    """2xx 返回 True；可重试的错误 (5xx / 408 / 429) 返回 False；其余抛出 UploadError"""
+    if resp.status_code in (200, 201, 204):
+        return True
+    if resp.status_code >= 500 or resp.status_code in (408, 429):
+        return False
+    raise UploadError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+
+
+def remote_props(client: httpx.Client, url: str) -> Optional[Tuple[int, Optional[str]]]:
+    """用 PROPFIND 查询远程文件的 (大小, ETag)，不存在或查询失败时返回 None"""
+    try:
+        resp = client.request("PROPFIND", url, headers={"Depth": "0"}, timeout=30)
+    except httpx.HTTPError:
+        return None
+    if resp.status_code != 207:
+        return None
+    size = re.search(r"<(?:\w+:)?getcontentlength[^>]*>\s*(\d+)\s*<", resp.text)
+    if not size:
+        return None
+    etag = re.search(r"<(?:\w+:)?getetag[^>]*>\s*([^<]+?)\s*<", resp.text)
+    return int(size.group(1)), etag.group(1).replace("&quot;", '"') if etag else None
+
+
+def _etag(value: str) -> str:
+    value = value.strip()
+    return (value[2:] if value.startswith("W/") else value).strip('"')
+
+
+def verify(client: httpx.Client, url: str, size: int, resp: httpx.Response) -> Optional[bool]:
+    """
+    校验上传结果：远程大小等于 size，且 PUT 响应带 ETag 时与 PROPFIND 返回的一致。
+    返回 True (一致) / False (不一致) / None (服务端不支持 PROPFIND，无法校验)
+    """
+    props = remote_props(client, url)
+    if props is None:
+        return None
+    remote_size, remote_etag = props
+    if remote_size != size:
+        logger.warning(f"Upload verification failed for {url}: remote size {remote_size}, expected {size}")
+        return False
+    put_etag = resp.headers.get("ETag")
+    if put_etag and remote_etag and _etag(put_etag) != _etag(remote_etag):
+        logger.warning(f"Upload verification failed for {url}: ETag {remote_etag}, PUT returned {put_etag}")
+        return False
+    return True
+
+
+def read_file(path: str, offset: int, progress):
+    """按块读取文件作为请求体，汇报进度并在每块之前检查是否取消"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            progress.check_cancelled()
+            chunk = f.read(READ_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+            progress.advance(len(chunk))
+
+
+def sleep_cancellable(seconds: float, progress):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        progress.check_cancelled()
+        time.sleep(max(0, min(0.2, deadline - time.monotonic())))
+
+
+class _AttemptProgress:
+    """一次上传尝试的进度：记录已汇报的字节数，重试前退回，重新上传时进度不会超过 100%"""
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.reported = 0
+
+    def advance(self, nbytes: int):
+        self.reported += nbytes
+        self.progress.advance(nbytes)
+
+    def check_cancelled(self):
+        self.progress.check_cancelled()
+
+    def rollback(self):
+        if self.reported:
+            self.progress.advance(-self.reported)
+            self.reported = 0
+
+
+class _SharedProgress:
+    """并发上传共用一个进度阶段：汇总各线程的字节数，忽略单个文件的 set_phase"""
+
+    def __init__(self, progress):
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def set_phase(self, phase: str, total_bytes: int):
+        pass
+
+    def advance(self, nbytes: int):
+        with self._lock:
+            self.progress.advance(nbytes)
+
+    def check_cancelled(self):
+        self.progress.check_cancelled()
+
+
+class WebDAVUploader:
+    def __init__(self, webdav_url: str, username: str, password: str):
+        self.base_url = webdav_url.strip().rstrip("/")
+        self.username = username.strip()
+        self.password = password.strip()
+        self._dirs = set()  # 已确认存在的远程目录
+        self._lock = threading.Lock()  # 保护目录缓存和统计计数 (upload_many 的多个线程同时更新)
+        self.mkcol_sent = 0
+        self.mkcol_skipped = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.verified = 0
+        self.unverified = 0
+        self.verify_failures = 0
+        self.retries = 0
+
+    @property
+    def client(self) -> httpx.Client:
+        return http_clients.webdav.get(self.base_url, self.username, self.password)
+
+    def url(self, remote_path: str) -> str:
+        return f"{self.base_url}{remote_path}"
+
+    def ensure_dir(self, remote_dir: str):
+        """逐级创建远程目录，已知存在的目录不再发送 MKCOL"""
+        path = ""
+        for part in [p for p in remote_dir.strip("/").split("/") if p]:
+            path += "/" + part
+            if path in self._dirs:
+                with self._lock:
+                    self.mkcol_skipped += 1
+                continue
+            with self._lock:
+                self.mkcol_sent += 1
+            try:
+                resp = self.client.request("MKCOL", f"{self.base_url}{path}/", timeout=30)
+            except httpx.HTTPError as e:
+                logger.debug(f"MKCOL {path} error: {e}")
+                continue
+            # 201 新建，405 已存在 (部分服务端对已存在的目录返回 301/302)
+            if resp.status_code in (201, 301, 302, 405):
+                if resp.status_code == 201:
+                    logger.info(f"Created directory: {path}")
+                with self._lock:
+                    self._dirs.add(path)
+            else:
+                logger.debug(f"MKCOL {path} returned {resp.status_code}")
+
+    def forget_dir(self, remote_dir: str):
+        """目录可能已被删除：清除它及其子目录的缓存"""
+        remote_dir = "/" + remote_dir.strip("/")
+        with self._lock:
+            self._dirs = {d for d in self._dirs if d != remote_dir and not d.startswith(remote_dir + "/")}
+
+    def upload_file(self, local_path: str, remote_path: str, progress, retries: int = RETRIES) -> dict:
+        """上传单个文件并校验，可重试的失败按指数退避重试；返回 {remote_path, size, verified}"""
+        remote_dir = os.path.dirname(remote_path)
+        size = os.path.getsize(local_path)
+        delay = 1
+        for attempt in range(1, retries + 2):
+            progress.check_cancelled()
+            attempt_progress = _AttemptProgress(progress)
+            try:
+                self.ensure_dir(remote_dir)
+                resp = self.client.put(self.url(remote_path), content=read_file(local_path, 0, attempt_progress),
+                                       headers={"Content-Length": str(size)})
+                if resp.status_code == 409:
+                    # 父目录不存在：缓存过期 (目录在别处被删除)
+                    self.forget_dir(remote_dir)
+                    raise _Retry("HTTP 409, remote directory missing")
+                if not check_status(resp):
+                    raise _Retry(f"HTTP {resp.status_code}")
+                verified = verify(self.client, self.url(remote_path), size, resp)
+                if verified is False:
+                    with self._lock:
+                        self.verify_failures += 1
+                    raise _Retry("remote size / ETag mismatch")
+                with self._lock:
+                    if verified:
+                        self.verified += 1
+                    else:
+                        self.unverified += 1
+                    self.uploads += 1
+                    self.uploaded_bytes += size
+                return {"remote_path": remote_path, "size": size, "verified": bool(verified)}
+            except (_Retry, httpx.TransportError) as e:
+                # 重试会从头重新发送文件，退回本次尝试已汇报的进度
+                attempt_progress.rollback()
+                if attempt > retries:
+                    raise UploadError(f"上传 {remote_path} 失败，已重试 {retries} 次: {e}")
+                with self._lock:
+                    self.retries += 1
+                logger.warning(f"Upload {remote_path} attempt {attempt} failed ({e}), retrying in {delay}s")
+                sleep_cancellable(delay, progress)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    def upload_many(self, items: List[Tuple[str, str]], progress, concurrency: int = UPLOAD_CONCURRENCY) -> List[dict]:
+        """
+        并发上传多个文件 [(local_path, remote_path)]，进度按总字节数汇报。
+        任一文件最终失败 (或取消) 时不再开始剩余的文件，并抛出该异常。
+        """
+        if not items:
+            return []
+        progress.set_phase("uploading", sum(os.path.getsize(local) for local, _ in items))
+        # 先串行创建目录，避免多个线程同时对同一目录发送 MKCOL
+        for remote_dir in sorted({os.path.dirname(remote) for _, remote in items}):
+            self.ensure_dir(remote_dir)
+        shared = _SharedProgress(progress)
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="webdav-upload") as pool:
+            futures = [pool.submit(self.upload_file, local, remote, shared) for local, remote in items]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+            for future in done:
+                if future.exception() is not None:
+                    raise future.exception()
+        return [future.result() for future in futures]
+
+    def delete(self, remote_path: str) -> bool:
+        """删除远程文件，已删除或本就不存在时返回 True"""
+        try:
+            resp = self.client.request("DELETE", self.url(remote_path), timeout=30)
+        except httpx.HTTPError as e:
+            logger.warning(f"DELETE {remote_path} error: {e}")
+            return False
+        if resp.status_code in (200, 204, 404):
+            return True
+        logger.warning(f"DELETE {remote_path} returned {resp.status_code}")
+        return False
+
+    def list_dir(self, remote_dir: str) -> Optional[List[str]]:
+        """用 PROPFIND (Depth: 1) 列出远程目录下的文件名，目录不存在返回 []，查询失败返回 None"""
+        remote_dir = "/" + remote_dir.strip("/")
+        try:
+            resp = self.client.request("PROPFIND", self.url(remote_dir + "/"), headers={"Depth": "1"}, timeout=30)
+        except httpx.HTTPError as e:
+            logger.warning(f"PROPFIND {remote_dir} error: {e}")
+            return None
+        if resp.status_code == 404:
+            return []
+        if resp.status_code != 207:
+            return None
+        names = []
+        for href in re.findall(r"<(?:\w+:)?href[^>]*>\s*([^<]+?)\s*<", resp.text):
+            name = unquote(href.rstrip("/").rsplit("/", 1)[-1])
+            if name and name != remote_dir.rsplit("/", 1)[-1]:
+                names.append(name)
+        return names
+
+    def stats(self) -> dict:
+        return {
+            "known_dirs": len(self._dirs),
+            "mkcol_sent": self.mkcol_sent,
+            "mkcol_skipped": self.mkcol_skipped,
+            "uploads": self.uploads,
+            "uploaded_bytes": self.uploaded_bytes,
+            "verified": self.verified,
+            "unverified": self.unverified,
+            "verify_failures": self.verify_failures,
+            "retries": self.retries,
+        }
+
+
+_uploaders: Dict[Tuple[str, str], WebDAVUploader] = {}
+_uploaders_lock = threading.Lock()
+
+
+def get(webdav_url: str, username: str, password: str) -> WebDAVUploader:
+    """按 WebDAV 地址和用户名复用上传器 (目录缓存随之保留)，密码变化时更新"""
+    key = (webdav_url.strip().rstrip("/"), username.strip())
+    with _uploaders_lock:
+        uploader = _uploaders.get(key)
+        if uploader is None:
+            uploader = _uploaders[key] = WebDAVUploader(webdav_url, username, password)
+        uploader.password = password.strip()
+        return uploader
+
+
+def stats() -> dict:
+    return {f"{username}@{url}": uploader.stats() for (url, username), uploader in _uploaders.items()}
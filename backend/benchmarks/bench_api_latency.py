@@ -0,0 +1,151 @@
+"""
+并发运行脚本时的 API 延迟
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_api_latency [--scripts 50] [--duration 20] [--port 18765]
+
+在临时目录中启动一个独立的服务实例 (uvicorn 子进程，临时 SQLite 数据库)，注册 N 个短脚本，
+先测空闲时的 API 延迟，再让 N 个脚本不断重复运行 (每次运行都会写入 running / 结束状态和运行记录)，
+同时测量 GET /api/scripts、GET /api/scripts/{id}/runs、GET /api/engine/stats 的延迟分布。
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REQUEST_TIMEOUT = 10.0
+
+# shell 脚本启动开销小，负载以状态写入为主而不是进程启动的 CPU 开销
+SCRIPT = """for i in $(seq 20); do echo "line $i"; done
+sleep 1
+"""
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+ENDPOINTS = ("/api/scripts", "/api/scripts/{id}/runs?limit=20", "/api/engine/stats")
+
+
+def report(phase, samples, errors):
+    for endpoint in ENDPOINTS:
+        values = samples[endpoint]
+        if not values:
+            print(f"{phase:<5} {endpoint:<32} no successful requests")
+            continue
+        print(f"{phase:<5} {endpoint:<32} {len(values):5d} req   p50 {percentile(values, 0.5) * 1000:8.1f} ms   "
+              f"p99 {percentile(values, 0.99) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+    if errors[0]:
+        print(f"{phase:<5} {errors[0]} requests failed or timed out ({REQUEST_TIMEOUT:.0f}s)")
+
+
+async def probe(client, script_ids, stop: asyncio.Event, samples: dict, errors: list):
+    i = 0
+    while not stop.is_set():
+        script_id = script_ids[i % len(script_ids)]
+        for endpoint in ENDPOINTS:
+            start = time.perf_counter()
+            try:
+                resp = await client.get(endpoint.format(id=script_id))
+                resp.raise_for_status()
+                samples[endpoint].append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors[0] += 1
+        i += 1
+
+
+async def keep_running(client, script_id, stop: asyncio.Event, counter: list):
+    while not stop.is_set():
+        try:
+            await client.post(f"/api/scripts/{script_id}/run")
+            counter[0] += 1
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+
+
+async def wait_ready(client, proc):
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            await client.get("/api/engine/stats")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def main(opts):
+    with tempfile.TemporaryDirectory() as tmp:
+        script_root = os.path.join(tmp, "scripts")
+        os.makedirs(script_root)
+        for i in range(opts.scripts):
+            with open(os.path.join(script_root, f"bench_{i:03d}.sh"), "w") as f:
+                f.write(SCRIPT)
+
+        env = dict(os.environ, SCRIPT_ROOT=script_root, DATABASE_URL=f"sqlite:///{tmp}/bench.db",
+                   MAX_CONCURRENT_SCRIPTS=str(opts.scripts))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(opts.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base_url = f"http://127.0.0.1:{opts.port}"
+            async with httpx.AsyncClient(base_url=base_url, timeout=REQUEST_TIMEOUT) as client:
+                await wait_ready(client, proc)
+                scripts = (await client.get("/api/scripts")).json()
+                script_ids = [s["id"] for s in scripts if s["path"].startswith(script_root)]
+                print(f"{len(script_ids)} scripts, {opts.duration}s per phase")
+
+                stop = asyncio.Event()
+                idle, idle_errors = {e: [] for e in ENDPOINTS}, [0]
+                prober = asyncio.create_task(probe(client, script_ids, stop, idle, idle_errors))
+                await asyncio.sleep(min(5, opts.duration))
+                stop.set()
+                await prober
+
+                stop = asyncio.Event()
+                busy, busy_errors = {e: [] for e in ENDPOINTS}, [0]
+                runs = [0]
+                async with httpx.AsyncClient(base_url=base_url, timeout=REQUEST_TIMEOUT) as runner:
+                    workers = [asyncio.create_task(keep_running(runner, sid, stop, runs)) for sid in script_ids]
+                    await asyncio.sleep(1)
+                    prober = asyncio.create_task(probe(client, script_ids, stop, busy, busy_errors))
+                    await asyncio.sleep(opts.duration)
+                    stop.set()
+                    await asyncio.gather(prober, *workers)
+
+                report("idle", idle, idle_errors)
+                report("busy", busy, busy_errors)
+                print(f"run requests accepted: {runs[0]}")
+
+                # 等待排队的运行结束，删除脚本的同时删除它们的日志
+                await asyncio.sleep(3)
+                try:
+                    for script_id in script_ids:
+                        await client.delete(f"/api/scripts/{script_id}", timeout=60)
+                except httpx.HTTPError:
+                    print("cleanup timed out, logs of benchmark scripts may remain")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scripts", type=int, default=50)
+    parser.add_argument("--duration", type=int, default=20)
+    parser.add_argument("--port", type=int, default=18765)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""
+备份历史：每次列出并 stat 备份目录 vs 查询备份目录表 (按 created_at 索引)
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_backup_history [--backups 5000] [--limit 20] [--rounds 50]
+
+在临时备份目录中生成 N 个小的备份归档，用 sync_local 补录到备份目录表，
+再分别测量旧的 listdir + stat 实现和 get_backup_history 的平均耗时。
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def list_dir_history(backup_dir, limit):
+    """调优前的实现"""
+    files = [f for f in os.listdir(backup_dir) if f.endswith('.zip')]
+    files.sort(reverse=True)
+    backups = []
+    for filename in files[:limit]:
+        filepath = os.path.join(backup_dir, filename)
+        stat = os.stat(filepath)
+        backups.append({
+            'filename': filename,
+            'size': stat.st_size,
+            'created_at': datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'path': filepath
+        })
+    return backups
+
+
+def bench(opts, tmp):
+    from app import backup, backup_catalog
+    from app.database import Base, engine
+
+    backup.BACKUP_DIR = os.path.join(tmp, "backups")
+    os.makedirs(backup.BACKUP_DIR)
+    Base.metadata.create_all(bind=engine)
+    start_time = datetime.datetime(2024, 1, 1)
+    for i in range(opts.backups):
+        created = start_time + datetime.timedelta(hours=i)
+        path = os.path.join(backup.BACKUP_DIR, f"scripts_backup_{created:%Y%m%d_%H%M%S}.zip")
+        with zipfile.ZipFile(path, "w") as zipf:
+            zipf.writestr("a_metadata.json", "{}")
+        os.utime(path, (created.timestamp(), created.timestamp()))
+
+    start = time.perf_counter()
+    synced = backup_catalog.sync_local(backup.BACKUP_DIR)
+    print(f"{opts.backups} backups, catalog sync {(time.perf_counter() - start) * 1000:.0f} ms ({synced['added']} added)")
+
+    for label, fn in (("listdir + stat", lambda: list_dir_history(backup.BACKUP_DIR, opts.limit)),
+                      ("catalog query", lambda: backup.get_backup_history(opts.limit))):
+        result = fn()
+        start = time.perf_counter()
+        for _ in range(opts.rounds):
+            fn()
+        elapsed = (time.perf_counter() - start) / opts.rounds
+        print(f"{label:<16} {elapsed * 1000:8.2f} ms per call   newest {result[0]['filename']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backups", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 数据库配置在 import app 时读取
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        bench(opts, tmp)
@@ -0,0 +1,94 @@
+"""
+完整备份 vs 增量备份：耗时、写入磁盘的字节数和相比完整备份节省的字节数
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_backup_incremental [--scripts 200] [--size-kb 256] [--changed 5] [--rounds 3]
+
+在临时目录中创建 N 个脚本文件，先做一次完整备份和一次首次增量备份，之后每轮修改 --changed 个脚本，
+再分别做一次完整备份和增量备份，最后用 restore_from_backup 恢复最新的增量快照并校验文件内容。
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def bench(opts, tmp):
+    from app import backup, models
+    from app.database import Base, SessionLocal, engine
+
+    backup.BACKUP_DIR = os.path.join(tmp, "backups")
+    os.makedirs(backup.BACKUP_DIR)
+    script_dir = os.path.join(tmp, "scripts")
+    os.makedirs(script_dir)
+    Base.metadata.create_all(bind=engine)
+
+    paths = []
+    with SessionLocal() as db:
+        for i in range(opts.scripts):
+            path = os.path.join(script_dir, f"bench_{i:04d}.py")
+            with open(path, "w") as f:
+                # 类似真实脚本的可压缩文本
+                f.write("".join(f"print('line {j} of script {i}')  # {os.urandom(8).hex()}\n"
+                                for j in range(opts.size_kb * 1024 // 64)))
+            paths.append(path)
+            db.add(models.Script(name=os.path.basename(path), path=path))
+        db.commit()
+
+    def run(label, incremental):
+        before = dir_size(backup.BACKUP_DIR)
+        start = time.perf_counter()
+        result = backup.backup_and_upload(incremental=incremental)
+        elapsed = time.perf_counter() - start
+        assert result["success"], result["error"]
+        written = dir_size(backup.BACKUP_DIR) - before
+        stats = result["stats"] or {}
+        saved = f"saved {stats['bytes_saved'] / 1024 / 1024:8.2f} MB" if stats else ""
+        print(f"{label:<26} {elapsed * 1000:8.1f} ms   disk +{written / 1024:9.1f} KB   {saved}")
+        return result
+
+    total = sum(os.path.getsize(p) for p in paths)
+    print(f"{opts.scripts} scripts, {total / 1024 / 1024:.1f} MB, {opts.changed} changed per round")
+    run("full", False)
+    result = run("incremental (first)", True)
+    for n in range(opts.rounds):
+        for path in paths[n * opts.changed:(n + 1) * opts.changed]:
+            with open(path, "a") as f:
+                f.write(f"print('round {n}')\n")
+        run(f"full (round {n + 1})", False)
+        result = run(f"incremental (round {n + 1})", True)
+
+    # 恢复最新的增量快照并校验 (先清空脚本记录，恢复到新目录)
+    expected = {os.path.basename(p): hashlib.sha256(open(p, "rb").read()).hexdigest() for p in paths}
+    with SessionLocal() as db:
+        db.query(models.Script).delete()
+        db.commit()
+    os.environ["SCRIPT_ROOT"] = restore_root = os.path.join(tmp, "restored")
+    os.makedirs(restore_root)
+    restored = backup.restore_from_backup(result["local_path"])
+    actual = {f: hashlib.sha256(open(os.path.join(restore_root, f), "rb").read()).hexdigest()
+              for f in os.listdir(restore_root)}
+    print(f"restore: success {restored['success']}, {restored['restored_count']} restored, "
+          f"{restored['skipped_count']} skipped, content {'OK' if actual == expected else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scripts", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--changed", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 数据库配置在 import app 时读取
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        bench(opts, tmp)
@@ -0,0 +1,162 @@
+"""
+完整备份上传到 WebDAV：先写本地 ZIP 再上传 vs 边打包边流式上传 (耗时、吞吐、本地磁盘写入)
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_backup_stream [--scripts 100] [--size-kb 512] [--fail-first 0] [--no-chunked] [--ranged]
+
+内置一个最小的 WebDAV 服务 (PUT / MKCOL / PROPFIND / DELETE)，可以模拟故障：
+--fail-first N 前 N 次上传在收到一半数据后断开连接 (保留已收到的部分文件)，--no-chunked 拒绝 chunked 上传 (411)，
+--ranged 支持 Content-Range 续传。最后校验服务端收到的 ZIP 完整可读。
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeWebDAV(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    files = {}
+    opts = None
+    puts = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self, limit=None):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            data = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(data)
+                data += self.rfile.read(size)
+                self.rfile.readline()
+                if limit is not None and len(data) >= limit:
+                    return bytes(data)
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(min(length, limit) if limit is not None else length)
+
+    def do_MKCOL(self):
+        self._reply(201)
+
+    def do_DELETE(self):
+        self.files.pop(self.path, None)
+        self._reply(204)
+
+    def do_PROPFIND(self):
+        if self.path not in self.files:
+            return self._reply(404)
+        body = (f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:"><d:response><d:propstat><d:prop>'
+                f'<d:getcontentlength>{len(self.files[self.path])}</d:getcontentlength>'
+                f'</d:prop></d:propstat></d:response></d:multistatus>').encode()
+        self._reply(207, body)
+
+    def do_PUT(self):
+        chunked = self.headers.get("Transfer-Encoding", "").lower() == "chunked"
+        if chunked and self.opts.no_chunked:
+            self.close_connection = True
+            return self._reply(411)
+        cls = type(self)
+        cls.puts += 1
+        if cls.puts <= self.opts.fail_first:
+            # 收到约一半数据后断开，保留部分文件
+            partial = self._read_body(limit=self.opts.size_kb * 1024 * self.opts.scripts // 4)
+            self.files[self.path] = partial
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        data = self._read_body()
+        content_range = self.headers.get("Content-Range")
+        if content_range:
+            if not self.opts.ranged:
+                return self._reply(501)
+            start = int(content_range.split()[1].split("-")[0])
+            data = self.files.get(self.path, b"")[:start] + data
+        self.files[self.path] = data
+        self._reply(201)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def bench(opts, tmp):
+    from app import backup, http_clients, models
+    from app.database import Base, SessionLocal, engine
+
+    backup.BACKUP_DIR = os.path.join(tmp, "backups")
+    os.makedirs(backup.BACKUP_DIR)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        for i in range(opts.scripts):
+            path = os.path.join(tmp, f"bench_{i:04d}.py")
+            with open(path, "w") as f:
+                f.write("".join(f"print({j})  # {os.urandom(8).hex()}\n" for j in range(opts.size_kb * 1024 // 40)))
+            db.add(models.Script(name=os.path.basename(path), path=path))
+        db.commit()
+
+    FakeWebDAV.opts = opts
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWebDAV)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cd2 = {"webdav_url": f"http://127.0.0.1:{server.server_port}", "username": "u", "password": "p",
+           "backup_path": "/bench", "keep_local": opts.keep_local}
+
+    # 调优前：先写出完整的本地 ZIP 再上传
+    start = time.perf_counter()
+    local_path, filename = backup.backup_scripts_to_zip()
+    size = os.path.getsize(local_path)
+    ok = backup.upload_to_clouddrive(local_path, f"/bench/{filename}", cd2["webdav_url"], "u", "p")
+    os.remove(local_path)
+    elapsed = time.perf_counter() - start
+    print(f"{'write zip, then PUT':<22} {elapsed * 1000:8.1f} ms   ok {ok}   local disk write {size / 1024:9.1f} KB")
+
+    FakeWebDAV.puts = 0
+    start = time.perf_counter()
+    result = backup.backup_and_upload(backup_type="clouddrive", cd2_config=cd2)
+    elapsed = time.perf_counter() - start
+    assert result["success"], result["error"]
+    stats = result["stats"]
+    local = dir_size(backup.BACKUP_DIR)
+    print(f"{'stream':<22} {elapsed * 1000:8.1f} ms   attempts {stats['attempts']}   "
+          f"{stats['throughput_mb_s']} MB/s   sent {stats['bytes_sent'] / 1024:.1f} KB   "
+          f"resumed_from {stats['resumed_from']}   chunked_fallback {stats['chunked_fallback']}   "
+          f"local copy {local / 1024:.1f} KB")
+
+    data = FakeWebDAV.files[f"/bench/{result['filename']}"]
+    with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+        bad = zipf.testzip()
+        print(f"remote archive: {len(data) / 1024:.1f} KB, {len(zipf.namelist())} entries, "
+              f"{'OK' if bad is None else 'CORRUPT ' + bad}")
+    server.shutdown()
+    http_clients.webdav.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scripts", type=int, default=100)
+    parser.add_argument("--size-kb", type=int, default=512)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--no-chunked", action="store_true")
+    parser.add_argument("--ranged", action="store_true")
+    parser.add_argument("--keep-local", action="store_true")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 数据库配置在 import app 时读取
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        bench(opts, tmp)
@@ -0,0 +1,93 @@
+"""
+日志采集吞吐对比：逐行 readline + 同步写文件 (旧实现) vs 按块读取 + log_writer 后台批量写入
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_log_capture [--lines 500000] [--line-size 80]
+
+子进程尽可能快地输出指定行数，测量采集完成耗时、吞吐，以及同时运行的 10ms 定时任务
+观察到的事件循环最大延迟 (即 API 请求会感受到的卡顿)。
+"""
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import log_writer  # noqa: E402
+
+PRODUCER = """
+import sys
+line = ("x" * {size}) + "\\n"
+out = sys.stdout
+for i in range({lines}):
+    out.write(line)
+"""
+
+
+async def spawn(lines, size):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-c", PRODUCER.format(lines=lines, size=size - 1),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+
+
+async def legacy_capture(process, path):
+    with open(path, "a", buffering=1) as log_file:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            log_file.write(line.decode("utf-8", errors="replace"))
+
+
+async def batched_capture(process, path):
+    await log_writer.capture(process.stdout, functools.partial(log_writer.writer.write, path))
+    await log_writer.writer.sync(path)
+
+
+async def loop_lag(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(time.perf_counter() - start - 0.01)
+
+
+async def measure(label, capture, lines, size, workdir):
+    path = os.path.join(workdir, f"{label}.log")
+    stop = asyncio.Event()
+    lag = []
+    ticker = asyncio.create_task(loop_lag(stop, lag))
+
+    start = time.perf_counter()
+    process = await spawn(lines, size)
+    await capture(process, path)
+    await process.wait()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    written = os.path.getsize(path)
+    lag.sort()
+    p99 = lag[int(len(lag) * 0.99)] if lag else 0
+    print(f"{label:<8} {elapsed:7.2f} s   {lines / elapsed:12,.0f} lines/s   {written / elapsed / 1e6:7.1f} MB/s   "
+          f"loop lag p99 {p99 * 1000:6.1f} ms  max {max(lag or [0]) * 1000:6.1f} ms")
+
+
+async def main(opts):
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{opts.lines:,} lines x {opts.line_size} bytes")
+        await measure("legacy", legacy_capture, opts.lines, opts.line_size, workdir)
+        await measure("batched", batched_capture, opts.lines, opts.line_size, workdir)
+        print(f"log_writer: {log_writer.writer.stats()}")
+        log_writer.writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=500_000)
+    parser.add_argument("--line-size", type=int, default=80)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+"""
+脚本列表轮询的响应大小和耗时：完整列表 GET /api/scripts vs 精简列表 /api/scripts/summary (全量 / 304 / 增量)
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_script_list [--scripts 300] [--output-size 5000] [--requests 50]
+
+在临时数据库中创建 N 个 last_output 为 output-size 字符的脚本，模拟前端每 3 秒一次的轮询，
+统计每种方式的平均响应字节数和耗时；增量轮询期间每次有 1 个脚本状态变化。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(label, n, make_request):
+    sizes, elapsed = [], 0.0
+    statuses = set()
+    for i in range(n):
+        start = time.perf_counter()
+        resp = make_request(i)
+        elapsed += time.perf_counter() - start
+        sizes.append(len(resp.content))
+        statuses.add(resp.status_code)
+    print(f"{label:<28} status {sorted(statuses)}   avg {sum(sizes) / n / 1024:9.1f} KB   "
+          f"avg {elapsed / n * 1000:7.2f} ms")
+
+
+def bench(opts, tmp):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app import api, models
+    from app.database import Base, SessionLocal, engine
+    from app.status_buffer import status_buffer
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add_all(models.Script(name=f"bench_{i:04d}.py", path=f"/scripts/bench_{i:04d}.py", cron="*/5 * * * *",
+                                 last_status="success", last_output="x" * opts.output_size)
+                   for i in range(opts.scripts))
+        db.commit()
+
+    app = FastAPI()
+    app.include_router(api.router, prefix="/api")
+    print(f"{opts.scripts} scripts, last_output {opts.output_size} chars, {opts.requests} requests each")
+    with TestClient(app) as client:
+        measure("GET /api/scripts", opts.requests, lambda i: client.get("/api/scripts"))
+        measure("summary (full)", opts.requests, lambda i: client.get("/api/scripts/summary"))
+
+        etag = client.get("/api/scripts/summary").headers["etag"]
+        measure("summary (If-None-Match)", opts.requests,
+                lambda i: client.get("/api/scripts/summary", headers={"If-None-Match": etag}))
+
+        version = [client.get("/api/scripts/summary").json()["version"]]
+
+        def delta(i):
+            status_buffer.update_script(i % opts.scripts + 1, last_status="running")
+            resp = client.get(f"/api/scripts/summary?since={version[0]}")
+            version[0] = resp.json()["version"]
+            return resp
+
+        measure("summary (since, 1 change)", opts.requests, delta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scripts", type=int, default=300)
+    parser.add_argument("--output-size", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=50)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 数据库配置在 import app 时读取
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        bench(opts, tmp)
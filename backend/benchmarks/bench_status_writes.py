@@ -0,0 +1,104 @@
+"""
+大量短脚本并发运行时的状态写入压力测试
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_status_writes [--scripts 50] [--runs 400] [--concurrency 50] [--journal-mode WAL]
+
+在临时 SQLite 数据库中注册 N 个立即退出的 shell 脚本，以指定并发度共运行 --runs 次 run_script，
+统计总耗时、吞吐、database is locked 错误数和 status_buffer 合并写入情况，最后检查所有运行记录和
+脚本状态都已落盘。可用 --journal-mode DELETE / STATUS_FLUSH_MS=0 对比调优前的行为。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LockErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        if "database is locked" in record.getMessage():
+            self.count += 1
+
+
+async def bench(opts, tmp):
+    from sqlalchemy import func, select
+
+    from app import log_store, log_writer, models
+    from app.database import AsyncSessionLocal, Base, async_engine, engine
+    from app.scheduler import run_script
+    from app.status_buffer import status_buffer
+
+    log_store.LOG_DIR = os.path.join(tmp, "logs")
+    Base.metadata.create_all(bind=engine)
+
+    async with AsyncSessionLocal() as db:
+        scripts = []
+        for i in range(opts.scripts):
+            path = os.path.join(tmp, f"bench_{i:03d}.sh")
+            with open(path, "w") as f:
+                f.write("exit 0\n")
+            scripts.append(models.Script(name=os.path.basename(path), path=path))
+        db.add_all(scripts)
+        await db.commit()
+        targets = [(s.id, s.path, s.name) for s in scripts]
+
+    locked = LockErrorCounter()
+    logging.getLogger().addHandler(locked)
+    status_buffer.start()
+
+    semaphore = asyncio.Semaphore(opts.concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await run_script(*targets[i % len(targets)], source="bench")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(opts.runs)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await status_buffer.stop()
+    flushed = time.perf_counter() - start
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    locked.count += sum("database is locked" in str(r) for r in failures)
+
+    async with AsyncSessionLocal() as db:
+        finished = await db.scalar(select(func.count()).select_from(models.ScriptRun)
+                                   .where(models.ScriptRun.status == "success"))
+        stale = await db.scalar(select(func.count()).select_from(models.Script)
+                                .where(models.Script.last_status != "success"))
+
+    print(f"journal_mode {opts.journal_mode}, STATUS_FLUSH_MS {int(status_buffer.interval * 1000)}, "
+          f"{opts.runs} runs over {opts.scripts} scripts, concurrency {opts.concurrency}")
+    print(f"elapsed       {elapsed:8.2f} s   ({opts.runs / elapsed:7.1f} runs/s), all status flushed after {flushed:.2f} s")
+    print(f"exceptions    {len(failures):8d}   database is locked: {locked.count}")
+    print(f"status_buffer {status_buffer.stats()}")
+    print(f"consistency   {finished}/{opts.runs} runs recorded as success, {stale} scripts with stale last_status")
+
+    for script_id, _, _ in targets:
+        log_store.remove_script_logs(script_id)
+    log_writer.writer.close()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scripts", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--journal-mode", default="WAL")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 数据库配置在 import app 时读取
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        os.environ["SQLITE_JOURNAL_MODE"] = opts.journal_mode
+        asyncio.run(bench(opts, tmp))
@@ -0,0 +1,83 @@
+"""
+冷启动 vs 预热启动 (warm runner) 延迟对比
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_warm_start [--runs 20] [--preload json,asyncio,http.client,email.mime.text]
+
+测量两种方式从发起运行到子进程退出的耗时；脚本会 import 预加载列表中的模块，
+模拟真实脚本 import requests/pandas 的场景。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import warm_runner  # noqa: E402
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{label:<6} mean {statistics.mean(samples) * 1000:8.2f} ms   "
+          f"median {statistics.median(samples) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+async def cold_run(script_path):
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        "python3", "-u", script_path,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, start_new_session=True
+    )
+    await proc.stdout.read()
+    await proc.wait()
+    return time.perf_counter() - start
+
+
+async def warm_run(script_path):
+    start = time.perf_counter()
+    proc = await warm_runner.runner.spawn(script_path, [])
+    await proc.stdout.read()
+    await proc.wait()
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--preload", default="json,asyncio,http.client,email.mime.text,decimal,xml.etree.ElementTree")
+    opts = parser.parse_args()
+    modules = [m.strip() for m in opts.preload.split(",") if m.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        script_path = os.path.join(tmp, "bench_script.py")
+        with open(script_path, "w") as f:
+            f.write("".join(f"import {m}\n" for m in modules))
+            f.write("print('done')\n")
+
+        await warm_runner.runner.configure(enabled=True, preload=modules)
+        if not warm_runner.runner.available:
+            print("warm runner failed to start")
+            return
+
+        # 预热一次，排除首次磁盘缓存影响
+        await cold_run(script_path)
+        await warm_run(script_path)
+
+        cold = [await cold_run(script_path) for _ in range(opts.runs)]
+        warm = [await warm_run(script_path) for _ in range(opts.runs)]
+
+        await warm_runner.runner.configure(enabled=False, preload=modules)
+
+    print(f"preload: {', '.join(modules)}  runs: {opts.runs}")
+    summarize("cold", cold)
+    summarize("warm", warm)
+    print(f"speedup: {statistics.mean(cold) / statistics.mean(warm):.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+增量备份上传到 WebDAV：串行上传块文件 vs 并发上传，以及远程目录缓存省下的 MKCOL 请求
+
+用法 (在 backend 目录下):
+    python -m benchmarks.bench_webdav_upload [--files 2000] [--latency-ms 20] [--concurrency 1 4 8]
+
+内置一个最小的 WebDAV 服务 (PUT / MKCOL / PROPFIND)，每个请求固定延迟 --latency-ms 模拟网络往返。
+每种并发数都用新的上传器把同一批小文件上传到空的服务端，统计耗时和各类请求数，最后校验远程内容。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeWebDAV(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    files = {}
+    requests = {}
+    latency = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b""):
+        with self.lock:
+            self.requests[self.command] = self.requests.get(self.command, 0) + 1
+        time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_MKCOL(self):
+        self._reply(201)
+
+    def do_PROPFIND(self):
+        if self.path not in self.files:
+            return self._reply(404)
+        body = (f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:"><d:response><d:propstat><d:prop>'
+                f'<d:getcontentlength>{len(self.files[self.path])}</d:getcontentlength>'
+                f'</d:prop></d:propstat></d:response></d:multistatus>').encode()
+        self._reply(207, body)
+
+    def do_PUT(self):
+        self.files[self.path] = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply(201)
+
+
+def bench(opts, tmp):
+    from app import backup, http_clients, webdav_uploader
+
+    items = []
+    for i in range(opts.files):
+        digest = os.urandom(32).hex()
+        path = os.path.join(tmp, digest)
+        with open(path, "wb") as f:
+            f.write(os.urandom(opts.size_kb * 1024))
+        items.append((path, f"/bench/chunks/{digest[:2]}/{digest}"))
+
+    FakeWebDAV.latency = opts.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWebDAV)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    print(f"{opts.files} files x {opts.size_kb} KB, {opts.latency_ms} ms per request")
+
+    # 调优前：每个文件单独调用 upload_to_clouddrive，每次都逐级 MKCOL
+    if opts.baseline:
+        FakeWebDAV.files.clear()
+        FakeWebDAV.requests = {}
+        start = time.perf_counter()
+        for local, remote in items:
+            webdav_uploader._uploaders.clear()
+            assert backup.upload_to_clouddrive(local, remote, url, "u", "p")
+        elapsed = time.perf_counter() - start
+        print(f"{'no dir cache, serial':<22} {elapsed * 1000:9.1f} ms   requests {FakeWebDAV.requests}")
+
+    for concurrency in opts.concurrency:
+        FakeWebDAV.files.clear()
+        FakeWebDAV.requests = {}
+        uploader = webdav_uploader.WebDAVUploader(url, "u", "p")
+        start = time.perf_counter()
+        uploader.upload_many(items, backup.NO_PROGRESS, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        stats = uploader.stats()
+        ok = all(FakeWebDAV.files.get(remote) == open(local, "rb").read() for local, remote in items)
+        print(f"{f'concurrency {concurrency}':<22} {elapsed * 1000:9.1f} ms   requests {FakeWebDAV.requests}   "
+              f"mkcol skipped {stats['mkcol_skipped']}   verified {stats['verified']}   content {'OK' if ok else 'MISMATCH'}")
+
+    server.shutdown()
+    http_clients.webdav.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--size-kb", type=int, default=16)
+    parser.add_argument("--latency-ms", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--baseline", action="store_true", help="同时测量不缓存目录、逐个上传的耗时")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 数据库配置在 import app 时读取
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+        bench(opts, tmp)
@@ -5,7 +5,7 @@ import {
   LayoutDashboard, Terminal, Activity, Search,
   ChevronRight, Command, UploadCloud, Send, Save,
   Sun, Moon, RefreshCw, Square, Code2, FileCode, HeartPulse, RotateCw,
-  Database, Download, Cloud, HardDrive, BellOff, Menu
+  Database, Download, Cloud, HardDrive, BellOff, Menu, Layers, Archive
 } from 'lucide-react'
 import Editor from '@monaco-editor/react'
 import * as api from './api'
@@ -16,9 +16,9 @@ interface Script {
   path: string;
   cron: string;
   enabled: boolean;
-  last_status: 'success' | 'failed' | 'running' | 'stopped' | null;
+  last_status: 'success' | 'failed' | 'running' | 'queued' | 'stopped' | 'limit_exceeded' | null;
   last_run: string | null;
-  last_output: string | null;
+  last_duration: number | null;
   run_on_startup: boolean;
   arguments: string;
 }
@@ -42,6 +42,11 @@ function App() {
   const [isLogOpen, setIsLogOpen] = useState(false);
   const [viewingLogId, setViewingLogId] = useState<number | null>(null);
   const logEndRef = useRef<HTMLDivElement>(null);
+  const logSocketRef = useRef<WebSocket | null>(null);
+  // 回看位置：更早的日志从 (run_id, offset) 之前读取
+  const [logCursor, setLogCursor] = useState<{ run_id: number | null; offset: number; has_more: boolean }>({ run_id: null, offset: 0, has_more: false });
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  const logPrependRef = useRef(false);
 
   // 代码编辑器状态
   const [isEditorOpen, setIsEditorOpen] = useState(false);
@@ -77,6 +82,12 @@ function App() {
   const [filterEnabled, setFilterEnabled] = useState<'all' | 'enabled' | 'disabled'>('all');
   const [sortBy, setSortBy] = useState<'name' | 'lastRun' | 'status'>('name');
   const [sortOrder, setSortOrder] = useState<'asc' | 'desc'>('asc');
+  // 服务端分页结果：当前显示的脚本 ID (按服务端排序)、下一页游标和符合条件的总数
+  const [scriptPage, setScriptPage] = useState<{ ids: number[]; nextCursor: string | null; total: number }>({ ids: [], nextCursor: null, total: 0 });
+  const [isLoadingMoreScripts, setIsLoadingMoreScripts] = useState(false);
+  // 脚本增删改时递增，触发重新查询当前页
+  const [scriptListRefresh, setScriptListRefresh] = useState(0);
+  const [debouncedSearch, setDebouncedSearch] = useState('');
   const [viewMode, setViewMode] = useState<'grid' | 'table'>('grid');
   const [isMultiSelectMode, setIsMultiSelectMode] = useState(false);
   const [selectedScripts, setSelectedScripts] = useState<Set<number>>(new Set());
@@ -96,31 +107,66 @@ function App() {
   const [backupConfig, setBackupConfig] = useState({
     local_backup_enabled: false,
     local_backup_cron: '0 2 * * *',
+    local_backup_incremental: false,
     cd2_backup_enabled: false,
     cd2_backup_cron: '0 2 * * *',
+    cd2_backup_incremental: false,
     cd2_webdav_url: '',
     cd2_username: '',
     cd2_password: '',
-    cd2_backup_path: '/ScriptBackups'
+    cd2_backup_path: '/ScriptBackups',
+    cd2_keep_local: false,
+    backup_keep_last: 0,
+    backup_keep_daily: 0,
+    backup_keep_weekly: 0,
+    backup_keep_monthly: 0
   });
   const [backupHistory, setBackupHistory] = useState<any[]>([]);
   const [isBackingUpLocal, setIsBackingUpLocal] = useState(false);
   const [isBackingUpCD2, setIsBackingUpCD2] = useState(false);
+  // 正在运行的备份任务 (后台执行，轮询进度)
+  const [backupJob, setBackupJob] = useState<{ id: string; kind: string; percent: number | null } | null>(null);
   const [testingCloudDrive, setTestingCloudDrive] = useState(false);
   const [isRestoring, setIsRestoring] = useState(false);
+  const [restorePreview, setRestorePreview] = useState<{ file: File; data: any } | null>(null);
   const restoreFileInputRef = useRef<HTMLInputElement>(null);
 
 
+  // 脚本列表每页条数 (仪表盘首屏和脚本管理页)
+  const SCRIPT_PAGE_SIZE = 100;
+
+  // 脚本列表版本号，轮询时只拉取之后变化的脚本
+  const scriptsVersion = useRef<number | null>(null);
+  // 脚本总数和按状态的计数 (服务端返回)，列表只加载了第一页，统计不能按已加载的脚本计算
+  const [scriptsTotal, setScriptsTotal] = useState<number | null>(null);
+  const [statusCounts, setStatusCounts] = useState<Record<string, number> | null>(null);
+
+  // 初始加载 / 重置时只取第一页 (运行中的在前，按名称排序，与仪表盘一致)，之后按版本号增量同步
+  const syncScripts = async (full = false) => {
+    const res = await api.getScriptsSummary(full ? null : scriptsVersion.current,
+      { sort: 'name', running_first: true, limit: SCRIPT_PAGE_SIZE });
+    const { version, full: isFull, scripts: changed, deleted, total, status_counts } = res.data;
+    if (total != null) setScriptsTotal(total);
+    if (status_counts) setStatusCounts(status_counts);
+    setScripts(prev => {
+      if (isFull) return changed;
+      if (changed.length === 0 && deleted.length === 0) return prev;
+      const byId = new Map(prev.map(s => [s.id, s]));
+      changed.forEach((s: Script) => byId.set(s.id, s));
+      deleted.forEach((id: number) => byId.delete(id));
+      return Array.from(byId.values()).sort((a, b) => a.id - b.id);
+    });
+    scriptsVersion.current = version;
+  };
+
   // 初始化加载
   const fetchAllData = async () => {
     try {
-      const [scriptsRes, settingsRes] = await Promise.all([
-        api.getScripts(),
+      const [, settingsRes] = await Promise.all([
+        syncScripts(true),
         api.getSettings()
       ]);
 
-      setScripts(scriptsRes.data);
-
       // 填充设置
       const settings = settingsRes.data;
       setTgConfig({
@@ -137,8 +183,8 @@ function App() {
 
   const fetchScripts = async () => {
     try {
-      const res = await api.getScripts();
-      setScripts(res.data);
+      await syncScripts();
+      setScriptListRefresh(n => n + 1);
     } catch (err) {
       console.error("Failed to fetch scripts", err);
     }
@@ -146,70 +192,137 @@ function App() {
 
   useEffect(() => { 
     fetchAllData(); 
-    const interval = setInterval(async () => {
-       try {
-         const res = await api.getScripts();
-         setScripts(res.data);
-       } catch (e) {}
-    }, 3000);
-    return () => clearInterval(interval);
-  }, []);
 
-  // 过滤和排序脚本列表
-  const filteredAndSortedScripts = scripts
-    .filter(script => {
-      // 搜索过滤
-      if (searchTerm && !script.name.toLowerCase().includes(searchTerm.toLowerCase())) {
-        return false;
-      }
-      // 类型过滤
-      if (filterType !== 'all') {
-        const ext = script.path.endsWith('.py') ? 'py' : 'sh';
-        if (ext !== filterType) return false;
-      }
-      // 状态过滤
-      if (filterStatus !== 'all') {
-        if (filterStatus === 'idle' && script.last_status !== null) {
-          return false;
-        } else if (filterStatus !== 'idle' && script.last_status !== filterStatus) {
-          return false;
+    // 脚本状态由 WebSocket 实时推送；连接不可用时退回每 3 秒轮询，并按指数退避重连
+    let socket: WebSocket | null = null;
+    let pollTimer: ReturnType<typeof setInterval> | null = null;
+    // 状态事件只更新已加载的脚本，统计计数通过增量同步刷新 (合并 1 秒内的多个事件)
+    let countsTimer: ReturnType<typeof setTimeout> | null = null;
+    let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+    let reconnectDelay = 1000;
+    let lastEventId: number | null = null;
+    let closed = false;
+
+    const startPolling = () => {
+      if (pollTimer) return;
+      pollTimer = setInterval(async () => {
+        try {
+          await syncScripts();
+        } catch (e) {}
+      }, 3000);
+    };
+    const stopPolling = () => {
+      if (pollTimer) clearInterval(pollTimer);
+      pollTimer = null;
+    };
+
+    const connect = () => {
+      const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+      const query = lastEventId !== null ? `?last_event_id=${lastEventId}` : '';
+      socket = new WebSocket(`${protocol}//${window.location.host}/api/scripts/events${query}`);
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        lastEventId = message.id;
+        if (message.type === 'hello') {
+          reconnectDelay = 1000;
+          stopPolling();
+          // 无法续传时通过增量列表补齐断线期间的变化
+          if (!message.resumed) {
+            syncScripts().catch(() => {});
+            setScriptListRefresh(n => n + 1);
+          }
+        } else if (message.type === 'status') {
+          const { type, id, script_id, ...fields } = message;
+          setScripts(prev => prev.map(s => (s.id === script_id ? { ...s, ...fields } : s)));
+          if (!countsTimer) {
+            countsTimer = setTimeout(() => {
+              countsTimer = null;
+              syncScripts().catch(() => {});
+            }, 1000);
+          }
+        } else if (message.type === 'reset') {
+          syncScripts(true).catch(() => {});
+          setScriptListRefresh(n => n + 1);
+        } else {
+          syncScripts().catch(() => {});
+          setScriptListRefresh(n => n + 1);
         }
-      }
-      // 启用状态过滤
-      if (filterEnabled !== 'all') {
-        if (filterEnabled === 'enabled' && !script.enabled) return false;
-        if (filterEnabled === 'disabled' && script.enabled) return false;
-      }
-      return true;
-    })
-    .sort((a, b) => {
-      // 首先：运行中的脚本始终排在最前面
-      const aRunning = a.last_status === 'running' ? 0 : 1;
-      const bRunning = b.last_status === 'running' ? 0 : 1;
-      if (aRunning !== bRunning) {
-        return aRunning - bRunning;
-      }
+      };
+      socket.onclose = () => {
+        socket = null;
+        if (closed) return;
+        startPolling();
+        reconnectTimer = setTimeout(connect, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+      };
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      stopPolling();
+      if (reconnectTimer) clearTimeout(reconnectTimer);
+      if (countsTimer) clearTimeout(countsTimer);
+      if (socket) socket.close();
+    };
+  }, []);
 
-      // 其次：按用户选择的排序方式
-      let compareValue = 0;
-      if (sortBy === 'name') {
-        compareValue = a.name.localeCompare(b.name);
-      } else if (sortBy === 'lastRun') {
-        const aTime = a.last_run ? new Date(a.last_run).getTime() : 0;
-        const bTime = b.last_run ? new Date(b.last_run).getTime() : 0;
-        compareValue = aTime - bTime;
-      } else if (sortBy === 'status') {
-        const statusOrder: Record<string, number> = {
-          'running': 0,
-          'success': 1,
-          'failed': 2,
-          'stopped': 3,
-          null: 4
-        };
-        compareValue = (statusOrder[a.last_status] || 4) - (statusOrder[b.last_status] || 4);
-      }
-      return sortOrder === 'asc' ? compareValue : -compareValue;
+  // 脚本管理页：由服务端筛选、排序和分页，状态变化通过 scripts 实时更新
+
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedSearch(searchTerm.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
+  const scriptListParams = () => {
+    const params: Record<string, any> = {
+      sort: { name: 'name', lastRun: 'last_run', status: 'status' }[sortBy],
+      order: sortOrder,
+      running_first: true,
+      limit: SCRIPT_PAGE_SIZE,
+    };
+    if (debouncedSearch) params.q = debouncedSearch;
+    if (filterType !== 'all') params.file_type = filterType;
+    if (filterStatus !== 'all') params.status = filterStatus;
+    if (filterEnabled !== 'all') params.enabled = filterEnabled === 'enabled';
+    return params;
+  };
+
+  const fetchScriptPage = async (cursor: string | null = null) => {
+    const params = scriptListParams();
+    if (cursor) params.cursor = cursor;
+    const res = await api.getScriptsSummary(null, params);
+    const { scripts: pageScripts, next_cursor, total } = res.data;
+    setScripts(prev => {
+      const byId = new Map(prev.map(s => [s.id, s]));
+      pageScripts.forEach((s: Script) => byId.set(s.id, s));
+      return Array.from(byId.values()).sort((a, b) => a.id - b.id);
     });
+    const ids = pageScripts.map((s: Script) => s.id);
+    setScriptPage(prev => ({ ids: cursor ? [...prev.ids, ...ids] : ids, nextCursor: next_cursor, total }));
+  };
+
+  useEffect(() => {
+    if (activeTab !== 'scripts') return;
+    fetchScriptPage().catch(err => console.error("Failed to fetch script page", err));
+  }, [activeTab, debouncedSearch, filterType, filterStatus, filterEnabled, sortBy, sortOrder, scriptListRefresh]);
+
+  const loadMoreScripts = async () => {
+    if (!scriptPage.nextCursor || isLoadingMoreScripts) return;
+    setIsLoadingMoreScripts(true);
+    try {
+      await fetchScriptPage(scriptPage.nextCursor);
+    } catch (err) {
+      console.error("Failed to load more scripts", err);
+    } finally {
+      setIsLoadingMoreScripts(false);
+    }
+  };
+
+  const scriptsById = new Map(scripts.map(s => [s.id, s]));
+  const filteredAndSortedScripts = scriptPage.ids
+    .map(id => scriptsById.get(id))
+    .filter((s): s is Script => s !== undefined);
 
   // WebSocket Log Streaming
   useEffect(() => {
@@ -220,17 +333,49 @@ function App() {
         const host = window.location.host; 
         const wsUrl = `${protocol}//${host}/api/logs/${viewingLogId}/stream`;
         socket = new WebSocket(wsUrl);
+        logSocketRef.current = socket;
         socket.onopen = () => setLogContent(''); 
-        socket.onmessage = (event) => setLogContent(prev => prev + event.data);
+        socket.onmessage = (event) => {
+          const message = JSON.parse(event.data);
+          if (message.type === 'history' || message.type === 'older') {
+            setLogCursor({ run_id: message.run_id, offset: message.offset, has_more: message.has_more });
+          }
+          if (message.type === 'older') {
+            logPrependRef.current = true;
+            setIsLoadingOlder(false);
+            setLogContent(prev => message.data + prev);
+          } else if (message.type === 'error') {
+            setLogContent(prev => prev + `\n[Error] ${message.data}\n`);
+          } else {
+            setLogContent(prev => prev + message.data);
+          }
+        };
         socket.onerror = () => setLogContent(prev => prev + '\n[Error] Connection failed.\n');
     }
-    return () => { if (socket) socket.close(); };
+    return () => {
+      if (socket) socket.close();
+      logSocketRef.current = null;
+      setLogCursor({ run_id: null, offset: 0, has_more: false });
+      setIsLoadingOlder(false);
+    };
   }, [isLogOpen, viewingLogId]);
 
   useEffect(() => {
+      // 加载更早的日志时保持当前位置，不滚动到底部
+      if (logPrependRef.current) {
+        logPrependRef.current = false;
+        return;
+      }
       logEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [logContent]);
 
+  const loadOlderLogs = () => {
+    const socket = logSocketRef.current;
+    if (!socket || socket.readyState !== WebSocket.OPEN || logCursor.run_id === null || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    socket.send(JSON.stringify({ type: 'older', run_id: logCursor.run_id, offset: logCursor.offset }));
+  };
+
 
   const handleSaveScript = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -244,8 +389,7 @@ function App() {
       setNotification({ type: 'success', message: '保存成功' });
       closeModal();
       // 单独刷新脚本列表
-      const res = await api.getScripts();
-      setScripts(res.data);
+      await syncScripts();
     } catch (err) {
       setNotification({ type: 'error', message: '保存失败，请检查网络或日志' });
     }
@@ -282,8 +426,7 @@ function App() {
     if (!deleteConfirmId) return;
     try {
       await api.deleteScript(deleteConfirmId);
-      const res = await api.getScripts();
-      setScripts(res.data);
+      await syncScripts();
       setNotification({ type: 'success', message: '删除成功' });
     } catch (err) {
       setNotification({ type: 'error', message: '删除失败，请检查网络或日志' });
@@ -338,7 +481,7 @@ function App() {
       // 然后立即重启脚本（先停止后启动）
       const script = scripts.find(s => s.id === editingCodeId);
       if (script) {
-        if (script.last_status === 'running') {
+        if (isActiveStatus(script.last_status)) {
           await api.stopScript(editingCodeId);
         }
         await api.runScript(editingCodeId);
@@ -370,7 +513,7 @@ function App() {
 
   const handleRunToggle = async (script: Script) => {
     try {
-        if (script.last_status === 'running') {
+        if (isActiveStatus(script.last_status)) {
           const res = await api.stopScript(script.id);
           if (res.data) {
             setScripts(scripts.map(s => s.id === script.id ? res.data : s));
@@ -529,12 +672,19 @@ function App() {
       setBackupConfig({
         local_backup_enabled: res.data.local_backup_enabled === 'true',
         local_backup_cron: res.data.local_backup_cron || '0 2 * * *',
+        local_backup_incremental: res.data.local_backup_incremental === 'true',
         cd2_backup_enabled: res.data.cd2_backup_enabled === 'true',
         cd2_backup_cron: res.data.cd2_backup_cron || '0 2 * * *',
+        cd2_backup_incremental: res.data.cd2_backup_incremental === 'true',
         cd2_webdav_url: res.data.cd2_webdav_url || '',
         cd2_username: res.data.cd2_username || '',
         cd2_password: res.data.cd2_password || '',
-        cd2_backup_path: res.data.cd2_backup_path || '/ScriptBackups'
+        cd2_backup_path: res.data.cd2_backup_path || '/ScriptBackups',
+        cd2_keep_local: res.data.cd2_keep_local === 'true',
+        backup_keep_last: Number(res.data.backup_keep_last) || 0,
+        backup_keep_daily: Number(res.data.backup_keep_daily) || 0,
+        backup_keep_weekly: Number(res.data.backup_keep_weekly) || 0,
+        backup_keep_monthly: Number(res.data.backup_keep_monthly) || 0
       });
     } catch (err) {
       console.error('Failed to fetch backup config:', err);
@@ -551,17 +701,56 @@ function App() {
   };
 
   const handleManualBackup = async (type: 'local' | 'clouddrive') => {
+    // 备份进行中再次点击按钮即取消
+    if (backupJob && backupJob.kind === type) {
+      try {
+        await api.cancelBackupJob(backupJob.id);
+      } catch (err) {
+        console.error('Failed to cancel backup job:', err);
+      }
+      return;
+    }
+
     if (type === 'local') setIsBackingUpLocal(true);
     else setIsBackingUpCD2(true);
     
     try {
-      const res = await api.manualBackup(undefined, type);
-      
-      setNotification({ type: 'success', message: `备份成功: ${res.data.filename}` });
-      if (type === 'local') await fetchBackupHistory(); // Only refresh history for local backup
+      let job;
+      try {
+        const incremental = type === 'local' ? backupConfig.local_backup_incremental : backupConfig.cd2_backup_incremental;
+        job = (await api.manualBackup(undefined, type, incremental)).data;
+      } catch (err: any) {
+        // 已有备份在运行
+        if (err.response?.status === 409) {
+          setNotification({ type: 'error', message: err.response.data.detail.message });
+          return;
+        }
+        throw err;
+      }
+
+      // 备份在后台执行，轮询任务进度直到结束
+      while (job.status === 'pending' || job.status === 'running') {
+        setBackupJob({ id: job.id, kind: job.kind, percent: job.percent });
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        job = (await api.getBackupJob(job.id)).data;
+      }
+
+      if (job.status === 'success') {
+        // 增量备份显示相比完整备份节省的数据量，流式上传显示上传速度
+        let detail = '';
+        if (job.stats?.mode === 'incremental') detail = ` (增量，节省 ${(job.stats.bytes_saved / 1024 / 1024).toFixed(2)} MB)`;
+        else if (job.stats?.mode === 'stream') detail = ` (${job.stats.throughput_mb_s} MB/s)`;
+        setNotification({ type: 'success', message: `备份成功: ${job.filename}${detail}` });
+        if (type === 'local') await fetchBackupHistory(); // Only refresh history for local backup
+      } else if (job.status === 'cancelled') {
+        setNotification({ type: 'success', message: '备份已取消' });
+      } else {
+        setNotification({ type: 'error', message: job.error || '备份失败' });
+      }
     } catch (err: any) {
       setNotification({ type: 'error', message: err.response?.data?.detail || '备份失败' });
     } finally {
+      setBackupJob(null);
       if (type === 'local') setIsBackingUpLocal(false);
       else setIsBackingUpCD2(false);
     }
@@ -588,6 +777,25 @@ function App() {
       return;
     }
 
+    // 先预演，确认将要新增 / 更新的脚本后再恢复
+    setIsRestoring(true);
+    try {
+      const res = await api.uploadAndRestore(file, true);
+      setRestorePreview({ file, data: res.data });
+    } catch (err: any) {
+      setNotification({ type: 'error', message: err.response?.data?.detail || '读取备份失败' });
+    } finally {
+      setIsRestoring(false);
+      if (restoreFileInputRef.current) {
+        restoreFileInputRef.current.value = '';
+      }
+    }
+  };
+
+  const confirmRestore = async () => {
+    if (!restorePreview) return;
+    const { file } = restorePreview;
+    setRestorePreview(null);
     setIsRestoring(true);
     try {
       const res = await api.uploadAndRestore(file);
@@ -600,9 +808,6 @@ function App() {
       setNotification({ type: 'error', message: err.response?.data?.detail || '恢复失败' });
     } finally {
       setIsRestoring(false);
-      if (restoreFileInputRef.current) {
-        restoreFileInputRef.current.value = '';
-      }
     }
   };
 
@@ -632,9 +837,9 @@ function App() {
   }, [activeTab]);
 
   const stats = {
-    total: scripts.length,
-    running: scripts.filter(s => s.last_status === 'running').length,
-    failed: scripts.filter(s => s.last_status === 'failed').length,
+    total: scriptsTotal ?? scripts.length,
+    running: statusCounts ? (statusCounts.running ?? 0) : scripts.filter(s => s.last_status === 'running').length,
+    failed: statusCounts ? (statusCounts.failed ?? 0) : scripts.filter(s => s.last_status === 'failed').length,
   };
 
   const panelClass = theme === 'light' ? 'glass-panel' : 'glass-panel-dark';
@@ -838,7 +1043,7 @@ function App() {
 
                         {/* 结果统计 */}
                         <p className={`text-sm font-medium whitespace-nowrap ${theme === 'light' ? 'text-gray-600' : 'text-gray-400'}`}>
-                          共 {filteredAndSortedScripts.length} / {scripts.length} 个脚本
+                          共 {scriptPage.total} / {stats.total} 个脚本
                         </p>
 
                         {/* 批量操作按钮 */}
@@ -895,6 +1100,18 @@ function App() {
                     ))}
                   </div>
 
+                  {scriptPage.nextCursor && (
+                    <div className="text-center mt-6">
+                      <button
+                        onClick={loadMoreScripts}
+                        disabled={isLoadingMoreScripts}
+                        className={`px-6 py-3 rounded-xl text-sm font-medium transition-colors ${theme === 'light' ? 'bg-gray-100 text-gray-700 hover:bg-gray-200' : 'bg-white/10 text-gray-300 hover:bg-white/20'}`}
+                      >
+                        {isLoadingMoreScripts ? '加载中...' : `加载更多 (已显示 ${filteredAndSortedScripts.length} / ${scriptPage.total})`}
+                      </button>
+                    </div>
+                  )}
+
                   {filteredAndSortedScripts.length === 0 && (
                     <div className={`text-center py-12 ${panelClass} rounded-[24px]`}>
                       <p className={`text-lg font-medium ${theme === 'light' ? 'text-gray-500' : 'text-gray-400'}`}>
@@ -1007,6 +1224,41 @@ function App() {
                         theme={theme}
                       />
                     )}
+                    <div className="flex items-center justify-between">
+                      <div className="flex items-center gap-3">
+                        <Layers size={20} className="text-blue-500" />
+                        <span className={`font-semibold ${theme === 'light' ? 'text-gray-700' : 'text-gray-300'}`}>增量备份</span>
+                      </div>
+                      <label className="relative inline-flex items-center cursor-pointer">
+                        <input
+                          type="checkbox"
+                          className="sr-only peer"
+                          checked={backupConfig.local_backup_incremental}
+                          onChange={e => setBackupConfig({...backupConfig, local_backup_incremental: e.target.checked})}
+                        />
+                        <div className="w-11 h-6 bg-gray-200 peer-focus:outline-none peer-focus:ring-4 peer-focus:ring-blue-300 dark:peer-focus:ring-blue-800 rounded-full peer dark:bg-gray-700 peer-checked:after:translate-x-full peer-checked:after:border-white after:content-[''] after:absolute after:top-[2px] after:left-[2px] after:bg-white after:border-gray-300 after:border after:rounded-full after:h-5 after:w-5 after:transition-all peer-checked:bg-blue-600"></div>
+                      </label>
+                    </div>
+
+                    <div>
+                      <div className="flex items-center gap-3 mb-3">
+                        <Archive size={20} className="text-blue-500" />
+                        <span className={`font-semibold ${theme === 'light' ? 'text-gray-700' : 'text-gray-300'}`}>保留策略</span>
+                        <span className={`text-xs ${theme === 'light' ? 'text-gray-500' : 'text-gray-400'}`}>本地和 CD2 共用，0 表示不限</span>
+                      </div>
+                      <div className="grid grid-cols-4 gap-2">
+                        {([['backup_keep_last', '最近'], ['backup_keep_daily', '每日'], ['backup_keep_weekly', '每周'], ['backup_keep_monthly', '每月']] as const).map(([key, label]) => (
+                          <InputGroup
+                            key={key}
+                            label={label}
+                            type="number"
+                            value={backupConfig[key]}
+                            onChange={(v: string) => setBackupConfig({...backupConfig, [key]: Math.max(0, parseInt(v) || 0)})}
+                            theme={theme}
+                          />
+                        ))}
+                      </div>
+                    </div>
                   </div>
                   
                   <div className="flex gap-3 mt-8">
@@ -1020,11 +1272,11 @@ function App() {
                     </button>
                     <button
                       onClick={() => handleManualBackup('local')}
-                      disabled={isBackingUpLocal}
+                      disabled={isBackingUpLocal && backupJob?.kind !== 'local'}
                       className="flex-1 py-3 bg-blue-500 hover:bg-blue-600 text-white rounded-xl font-bold flex items-center justify-center gap-2 shadow-lg shadow-blue-500/20 disabled:opacity-50 disabled:cursor-not-allowed"
                     >
                       {isBackingUpLocal ? <Loader2 size={18} className="animate-spin" /> : <Play size={18} fill="currentColor" />}
-                      立即运行
+                      {backupJob?.kind === 'local' ? `取消 (${backupJob.percent ?? 0}%)` : '立即运行'}
                     </button>
                   </div>
                 </div>
@@ -1098,6 +1350,37 @@ function App() {
                         theme={theme}
                       />
                     )}
+                    <div className="flex items-center justify-between">
+                      <div className="flex items-center gap-3">
+                        <Layers size={20} className="text-purple-500" />
+                        <span className={`font-semibold ${theme === 'light' ? 'text-gray-700' : 'text-gray-300'}`}>增量备份</span>
+                      </div>
+                      <label className="relative inline-flex items-center cursor-pointer">
+                        <input
+                          type="checkbox"
+                          className="sr-only peer"
+                          checked={backupConfig.cd2_backup_incremental}
+                          onChange={e => setBackupConfig({...backupConfig, cd2_backup_incremental: e.target.checked})}
+                        />
+                        <div className="w-11 h-6 bg-gray-200 peer-focus:outline-none peer-focus:ring-4 peer-focus:ring-purple-300 dark:peer-focus:ring-purple-800 rounded-full peer dark:bg-gray-700 peer-checked:after:translate-x-full peer-checked:after:border-white after:content-[''] after:absolute after:top-[2px] after:left-[2px] after:bg-white after:border-gray-300 after:border after:rounded-full after:h-5 after:w-5 after:transition-all peer-checked:bg-purple-600"></div>
+                      </label>
+                    </div>
+
+                    <div className="flex items-center justify-between">
+                      <div className="flex items-center gap-3">
+                        <HardDrive size={20} className="text-purple-500" />
+                        <span className={`font-semibold ${theme === 'light' ? 'text-gray-700' : 'text-gray-300'}`}>保留本地副本</span>
+                      </div>
+                      <label className="relative inline-flex items-center cursor-pointer">
+                        <input
+                          type="checkbox"
+                          className="sr-only peer"
+                          checked={backupConfig.cd2_keep_local}
+                          onChange={e => setBackupConfig({...backupConfig, cd2_keep_local: e.target.checked})}
+                        />
+                        <div className="w-11 h-6 bg-gray-200 peer-focus:outline-none peer-focus:ring-4 peer-focus:ring-purple-300 dark:peer-focus:ring-purple-800 rounded-full peer dark:bg-gray-700 peer-checked:after:translate-x-full peer-checked:after:border-white after:content-[''] after:absolute after:top-[2px] after:left-[2px] after:bg-white after:border-gray-300 after:border after:rounded-full after:h-5 after:w-5 after:transition-all peer-checked:bg-purple-600"></div>
+                      </label>
+                    </div>
                   </div>
                   
                    <div className="flex gap-3 mt-8">
@@ -1122,11 +1405,11 @@ function App() {
                     </button>
                     <button
                       onClick={() => handleManualBackup('clouddrive')}
-                      disabled={isBackingUpCD2}
+                      disabled={isBackingUpCD2 && backupJob?.kind !== 'clouddrive'}
                       className="flex-1 py-3 bg-purple-500 hover:bg-purple-600 text-white rounded-xl font-bold flex items-center justify-center gap-2 shadow-lg shadow-purple-500/20 disabled:opacity-50 disabled:cursor-not-allowed"
                     >
                       {isBackingUpCD2 ? <Loader2 size={18} className="animate-spin" /> : <Cloud size={18} />}
-                      立即运行
+                      {backupJob?.kind === 'clouddrive' ? `取消 (${backupJob.percent ?? 0}%)` : '立即运行'}
                     </button>
                   </div>
                 </div>
@@ -1204,6 +1487,7 @@ function App() {
                                 <div className="font-semibold truncate">{backup.filename}</div>
                                 <div className={`text-xs ${theme === 'light' ? 'text-gray-500' : 'text-gray-400'}`}>
                                 {new Date(backup.created_at).toLocaleString('zh-CN')} · {(backup.size / 1024).toFixed(2)} KB
+                                {backup.script_count != null && ` · ${backup.script_count} 个脚本`}
                                 </div>
                             </div>
                             </div>
@@ -1246,7 +1530,14 @@ function App() {
               <h2 className="text-2xl font-bold flex items-center gap-2"><FileText size={24}/> 运行日志</h2>
               <button onClick={() => setIsLogOpen(false)} className={`p-2 rounded-full transition-colors ${theme === 'light' ? 'hover:bg-gray-100' : 'hover:bg-white/10'}`}><X size={24} /></button>
             </div>
-            <div className={`flex-1 rounded-2xl p-4 overflow-auto font-mono text-sm whitespace-pre-wrap ${theme === 'light' ? 'bg-gray-50 text-gray-800' : 'bg-black/30 text-gray-300'}`}>{logContent}<div ref={logEndRef} /></div>
+            <div className={`flex-1 rounded-2xl p-4 overflow-auto font-mono text-sm whitespace-pre-wrap ${theme === 'light' ? 'bg-gray-50 text-gray-800' : 'bg-black/30 text-gray-300'}`}>
+              {logCursor.has_more && (
+                <button onClick={loadOlderLogs} disabled={isLoadingOlder} className={`mb-2 text-xs px-3 py-1 rounded-full transition-colors ${theme === 'light' ? 'bg-gray-200 hover:bg-gray-300 text-gray-600' : 'bg-white/10 hover:bg-white/20 text-gray-300'}`}>
+                  {isLoadingOlder ? '加载中...' : '加载更早的日志'}
+                </button>
+              )}
+              {logContent}<div ref={logEndRef} />
+            </div>
           </div>
         </div>
       )}
@@ -1394,6 +1685,58 @@ function App() {
         </div>
       )}
 
+      {/* Restore Preview Modal */}
+      {restorePreview && (
+        <div className="fixed inset-0 bg-black/30 backdrop-blur-md flex items-center justify-center p-4 z-50 animate-in fade-in duration-200">
+          <div className={`${theme === 'light' ? 'bg-white' : 'bg-[#1c1c1e] text-white'} rounded-[32px] p-8 w-full max-w-md shadow-2xl scale-100 animate-in zoom-in-95 duration-200`}>
+            <div className="flex items-center gap-3 mb-6">
+              <div className="w-12 h-12 bg-blue-100 text-blue-500 rounded-full flex items-center justify-center">
+                <UploadCloud size={24} />
+              </div>
+              <div>
+                <h2 className="text-xl font-bold">确定要恢复？</h2>
+                <p className={`text-sm ${theme === 'light' ? 'text-gray-500' : 'text-gray-400'}`}>{restorePreview.data.message}</p>
+              </div>
+            </div>
+
+            <div className={`p-4 rounded-2xl mb-6 ${theme === 'light' ? 'bg-gray-50' : 'bg-white/5'}`}>
+              <div className="max-h-48 overflow-y-auto space-y-1">
+                {restorePreview.data.changes.map((change: any) => (
+                  <p key={change.path} className={`text-sm ${theme === 'light' ? 'text-gray-700' : 'text-gray-300'}`}>
+                    • {change.action === 'create' ? '新增' : '更新'} {change.name}
+                    {change.action === 'update' && change.fields.length > 0 && (
+                      <span className={theme === 'light' ? 'text-gray-400' : 'text-gray-500'}> ({change.fields.join(', ')})</span>
+                    )}
+                    {change.overwrite_file && <span className={theme === 'light' ? 'text-orange-600' : 'text-orange-400'}> 覆盖文件</span>}
+                  </p>
+                ))}
+                {restorePreview.data.details
+                  .filter((detail: string) => !detail.startsWith('将'))
+                  .map((detail: string) => (
+                    <p key={detail} className={`text-sm ${theme === 'light' ? 'text-red-600' : 'text-red-400'}`}>• {detail}</p>
+                  ))}
+              </div>
+            </div>
+
+            <div className="flex gap-3">
+              <button
+                onClick={() => setRestorePreview(null)}
+                className={`flex-1 py-3 rounded-xl font-bold transition-all ${theme === 'light' ? 'bg-gray-100 text-gray-700 hover:bg-gray-200' : 'bg-white/10 text-gray-300 hover:bg-white/20'}`}
+              >
+                取消
+              </button>
+              <button
+                onClick={confirmRestore}
+                disabled={restorePreview.data.restored_count === 0}
+                className="flex-1 py-3 rounded-xl font-bold bg-blue-500 hover:bg-blue-600 disabled:opacity-50 text-white transition-all"
+              >
+                确认恢复
+              </button>
+            </div>
+          </div>
+        </div>
+      )}
+
       {/* Backup Single Delete Confirm Modal */}
       {backupToDelete && (
         <div className="fixed inset-0 bg-black/30 backdrop-blur-md flex items-center justify-center p-4 z-50 animate-in fade-in duration-200">
@@ -1561,7 +1904,7 @@ const ScriptCard = ({ script, onRunToggle, onEdit, onDelete, onLog, onOpenEditor
           <div className="flex items-center justify-between text-sm px-1">
             <div className="flex items-center gap-1.5">
               <div className={`w-2.5 h-2.5 rounded-full ${script.last_status === 'running' ? 'bg-green-500 shadow-[0_0_8px_rgba(34,197,94,0.6)] animate-pulse' : 'bg-gray-300'}`} />
-              <span className={`font-medium ${getStatusColor(script.last_status)}`}>{script.last_status === 'success' ? '执行成功' : script.last_status === 'failed' ? '执行失败' : script.last_status === 'running' ? '运行中' : script.last_status === 'stopped' ? '已停止' : '未运行'}</span>
+              <span className={`font-medium ${getStatusColor(script.last_status)}`}>{script.last_status === 'success' ? '执行成功' : script.last_status === 'failed' ? '执行失败' : script.last_status === 'running' ? '运行中' : script.last_status === 'queued' ? '排队中' : script.last_status === 'stopped' ? '已停止' : script.last_status === 'limit_exceeded' ? '超出限制' : '未运行'}</span>
             </div>
             {duration && (
               <div className={`text-xs font-semibold px-3 py-1 rounded-full ${theme === 'light' ? 'bg-blue-50 text-blue-600' : 'bg-blue-500/20 text-blue-300'}`}>
@@ -1571,9 +1914,9 @@ const ScriptCard = ({ script, onRunToggle, onEdit, onDelete, onLog, onOpenEditor
           </div>
         </div>
         <div className={`flex items-center gap-3 pt-4 border-t mt-auto ${theme === 'light' ? 'border-gray-100' : 'border-white/5'}`}>
-          <button onClick={(e) => { e.stopPropagation(); onRunToggle(); }} className={`w-full flex items-center justify-center gap-1.5 px-4 py-3 text-sm font-bold rounded-xl transition-all active:scale-95 ${theme === 'light' ? (script.last_status === 'running' ? 'bg-red-500 hover:bg-red-600 text-white' : 'bg-black text-white hover:bg-gray-800') : (script.last_status === 'running' ? 'bg-red-500 hover:bg-red-600 text-white' : 'bg-white text-black hover:bg-gray-200')}`}>
-            {script.last_status === 'running' ? <Square size={16} fill="currentColor" /> : <Play size={16} fill="currentColor" />}
-            <span>{script.last_status === 'running' ? 'STOP' : 'RUN'}</span>
+          <button onClick={(e) => { e.stopPropagation(); onRunToggle(); }} className={`w-full flex items-center justify-center gap-1.5 px-4 py-3 text-sm font-bold rounded-xl transition-all active:scale-95 ${theme === 'light' ? (isActiveStatus(script.last_status) ? 'bg-red-500 hover:bg-red-600 text-white' : 'bg-black text-white hover:bg-gray-800') : (isActiveStatus(script.last_status) ? 'bg-red-500 hover:bg-red-600 text-white' : 'bg-white text-black hover:bg-gray-200')}`}>
+            {isActiveStatus(script.last_status) ? <Square size={16} fill="currentColor" /> : <Play size={16} fill="currentColor" />}
+            <span>{isActiveStatus(script.last_status) ? 'STOP' : 'RUN'}</span>
           </button>
         </div>
       </div>
@@ -1605,7 +1948,7 @@ const ScriptCard = ({ script, onRunToggle, onEdit, onDelete, onLog, onOpenEditor
       {/* 状态 */}
       <div className="flex items-center gap-1.5 flex-shrink-0">
         <div className={`w-2.5 h-2.5 rounded-full ${script.last_status === 'running' ? 'bg-green-500 shadow-[0_0_8px_rgba(34,197,94,0.6)] animate-pulse' : 'bg-gray-300'}`} />
-        <span className={`text-sm font-medium ${getStatusColor(script.last_status)}`}>{script.last_status === 'success' ? '成功' : script.last_status === 'failed' ? '失败' : script.last_status === 'running' ? '运行' : script.last_status === 'stopped' ? '停止' : '未运行'}</span>
+        <span className={`text-sm font-medium ${getStatusColor(script.last_status)}`}>{script.last_status === 'success' ? '成功' : script.last_status === 'failed' ? '失败' : script.last_status === 'running' ? '运行' : script.last_status === 'queued' ? '排队' : script.last_status === 'stopped' ? '停止' : script.last_status === 'limit_exceeded' ? '超限' : '未运行'}</span>
       </div>
 
       {/* 运行时长 */}
@@ -1625,7 +1968,7 @@ const ScriptCard = ({ script, onRunToggle, onEdit, onDelete, onLog, onOpenEditor
         <button onClick={(e) => { e.stopPropagation(); onLog(); }} title="View Log" className={`p-1.5 rounded transition-colors ${theme === 'light' ? 'bg-blue-50 hover:bg-blue-100 text-blue-600' : 'bg-blue-500/10 hover:bg-blue-500/20 text-blue-400'}`}><FileText size={14} /></button>
         <button onClick={(e) => { e.stopPropagation(); onOpenEditor(); }} title="Edit Code" className={`p-1.5 rounded transition-colors ${theme === 'light' ? 'bg-indigo-50 hover:bg-indigo-100 text-indigo-600' : 'bg-indigo-500/10 hover:bg-indigo-500/20 text-indigo-400'}`}><Code2 size={14} /></button>
         <button onClick={(e) => { e.stopPropagation(); onEdit(); }} title="Settings" className={`p-1.5 rounded transition-colors ${theme === 'light' ? 'bg-gray-100 hover:bg-gray-200 text-gray-600' : 'bg-white/10 hover:bg-white/20 text-gray-300'}`}><Edit2 size={14} /></button>
-        <button onClick={(e) => { e.stopPropagation(); onRunToggle(); }} className={`p-1.5 rounded transition-colors font-bold text-sm ${theme === 'light' ? (script.last_status === 'running' ? 'bg-red-50 hover:bg-red-100 text-red-500' : 'bg-green-50 hover:bg-green-100 text-green-600') : (script.last_status === 'running' ? 'bg-red-500/10 hover:bg-red-500/20 text-red-400' : 'bg-green-500/10 hover:bg-green-500/20 text-green-400')}`}>{script.last_status === 'running' ? <Square size={14} fill="currentColor" /> : <Play size={14} fill="currentColor" />}</button>
+        <button onClick={(e) => { e.stopPropagation(); onRunToggle(); }} className={`p-1.5 rounded transition-colors font-bold text-sm ${theme === 'light' ? (isActiveStatus(script.last_status) ? 'bg-red-50 hover:bg-red-100 text-red-500' : 'bg-green-50 hover:bg-green-100 text-green-600') : (isActiveStatus(script.last_status) ? 'bg-red-500/10 hover:bg-red-500/20 text-red-400' : 'bg-green-500/10 hover:bg-green-500/20 text-green-400')}`}>{isActiveStatus(script.last_status) ? <Square size={14} fill="currentColor" /> : <Play size={14} fill="currentColor" />}</button>
         <button onClick={(e) => { e.stopPropagation(); onDelete(); }} title="Delete" className={`p-1.5 rounded transition-colors ${theme === 'light' ? 'bg-red-50 hover:bg-red-100 text-red-500' : 'bg-red-500/10 hover:bg-red-500/20 text-red-400'}`}><Trash2 size={14} /></button>
       </div>
     </div>
@@ -1673,9 +2016,14 @@ const getStatusColor = (status: string | null) => {
   if (status === 'success') return 'text-green-600';
   if (status === 'failed') return 'text-red-600';
   if (status === 'running') return 'text-green-600';
+  if (status === 'queued') return 'text-amber-500';
+  if (status === 'limit_exceeded') return 'text-orange-600';
   return 'text-gray-400';
 }
 
+// 运行中或排队中的脚本都视为"活跃"，按钮显示为 STOP
+const isActiveStatus = (status: string | null) => status === 'running' || status === 'queued';
+
 const Notification = ({ type, message, onClose }: { type: 'success' | 'error', message: string, onClose: () => void }) => {
   React.useEffect(() => {
     const timer = setTimeout(() => {
@@ -5,6 +5,10 @@ const api = axios.create({
 });
 
 export const getScripts = () => api.get('/scripts');
+// 精简脚本列表；传入上次返回的 version 时只返回之后变化 / 删除的脚本
+// params 为筛选 / 排序 / 分页参数 (status, enabled, file_type, q, sort, order, running_first, limit, cursor)
+export const getScriptsSummary = (since?: number | null, params: Record<string, any> = {}) =>
+  api.get('/scripts/summary', { params: since != null ? { ...params, since } : params });
 export const createScript = (data: any) => api.post('/scripts', data);
 export const updateScript = (id: number, data: any) => api.put(`/scripts/${id}`, data);
 export const deleteScript = (id: number) => api.delete(`/scripts/${id}`);
@@ -27,9 +31,11 @@ export const applySettings = () => api.post('/settings/apply');
 export const getSettings = () => api.get('/settings');
 
 // 备份相关API
-export const manualBackup = (scriptIds?: number[], backupType: 'local' | 'clouddrive' = 'local') => 
-  api.post('/backup/manual', { script_ids: scriptIds, backup_type: backupType });
+export const manualBackup = (scriptIds?: number[], backupType: 'local' | 'clouddrive' = 'local', incremental = false) => 
+  api.post('/backup/manual', { script_ids: scriptIds, backup_type: backupType, incremental });
 export const backupSingleScript = (scriptId: number) => api.post(`/backup/script/${scriptId}`);
+export const getBackupJob = (jobId: string) => api.get(`/backup/jobs/${jobId}`);
+export const cancelBackupJob = (jobId: string) => api.post(`/backup/jobs/${jobId}/cancel`);
 export const getBackupConfig = () => api.get('/backup/config');
 export const saveBackupConfig = (config: any) => api.post('/backup/config', config);
 export const testCloudDrive = (webdavUrl: string, username: string, password: string) =>
@@ -41,10 +47,10 @@ export const downloadBackup = (filename: string) => {
 };
 export const deleteBackup = (filename: string) => api.delete(`/backup/${filename}`);
 export const deleteAllBackups = () => api.delete('/backup');
-export const uploadAndRestore = (file: File) => {
+export const uploadAndRestore = (file: File, dryRun = false) => {
   const formData = new FormData();
   formData.append('file', file);
-  return api.post('/backup/upload-restore', formData);
+  return api.post('/backup/upload-restore', formData, { params: { dry_run: dryRun } });
 };
 
 export default api;
\ No newline at end of file